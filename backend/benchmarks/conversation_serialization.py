@@ -0,0 +1,112 @@
+"""
+Benchmark serializing a long conversation: the previous path (ORM objects ->
+Pydantic response model -> jsonable_encoder -> json.dumps) against the
+streamed path used by GET /api/conversations/{id} (row dicts -> orjson,
+batched and optionally compressed).
+
+No database is needed: rows are synthesized in memory, so the numbers
+cover serialization and compression only, not query time.
+
+Usage:
+    python benchmarks/conversation_serialization.py --messages 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from routes.conversations import ConversationDetailResponse  # noqa: E402
+from services.response_encoding import _encode, dumps  # noqa: E402
+
+WORDS = "the model returned a detailed answer about configuring postgres pgvector indexes and ollama".split()
+
+
+def make_rows(count: int, seed: int):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for seq in range(1, count + 1):
+        role = "user" if seq % 2 else "assistant"
+        content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 400)))
+        if role == "user" and rng.random() < 0.05:
+            content = f"![image](/api/images/{uuid.uuid4().hex}{uuid.uuid4().hex})\n{content}"
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "seq": seq,
+            "role": role,
+            "content": content,
+            "model_used": None if role == "user" else "llama3.2:latest",
+            "status": "complete",
+            "version": seq,
+            "timestamp": start + timedelta(seconds=seq * 30),
+        })
+    conversation = {
+        "id": str(uuid.uuid4()),
+        "title": "Benchmark conversation",
+        "created_at": start,
+        "updated_at": start + timedelta(seconds=count * 30),
+        "version": count,
+    }
+    return conversation, rows
+
+
+def old_path(conversation, rows) -> bytes:
+    orm_messages = [SimpleNamespace(**row) for row in rows]
+    model = ConversationDetailResponse.model_validate({**conversation, "messages": orm_messages})
+    return json.dumps(jsonable_encoder(model), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+async def new_path(conversation, rows, encoding) -> bytes:
+    async def body():
+        yield dumps(conversation)[:-1] + b',"messages":['
+        separator = b""
+        for row in rows:
+            yield separator + dumps(row)
+            separator = b","
+        yield b"]}"
+    
+    return b"".join([part async for part in _encode(body(), encoding, 64 * 1024)])
+
+
+def measure(label, fn, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = fn()
+    elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28}{elapsed_ms:>10.1f}{len(body) / 1024:>12.0f}{peak / 1024 / 1024:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    conversation, rows = make_rows(args.messages, args.seed)
+    print(f"messages={args.messages}")
+    print(f"{'path':<28}{'ms':>10}{'body KiB':>12}{'peak MiB':>12}")
+    
+    measure("pydantic + json.dumps", lambda: old_path(conversation, rows), args.repeat)
+    for encoding in (None, "gzip", "br", "zstd"):
+        measure(
+            f"orjson stream ({encoding or 'identity'})",
+            lambda: asyncio.run(new_path(conversation, rows, encoding)),
+            args.repeat
+        )
+
+
+if __name__ == "__main__":
+    main()
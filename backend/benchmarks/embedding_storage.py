@@ -0,0 +1,122 @@
+"""
+Benchmark the recall / latency / memory trade-off of the compact embedding
+storage modes (see services/vector_index.py).
+
+Each mode runs the same two-stage search the RAG service uses: a coarse
+top-N on the compact representation, then an exact cosine rerank of those
+candidates on the full-precision vectors. Searches are brute force in NumPy,
+so latencies compare the representations rather than an HNSW index.
+
+Usage:
+    python benchmarks/embedding_storage.py
+    python benchmarks/embedding_storage.py --embeddings chunks.npy --queries 200
+
+Without --embeddings, synthetic clustered vectors are used whose variance
+decays across dimensions, roughly like a Matryoshka-trained model.
+Queries are noisy copies of corpus vectors.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import EMBEDDING_DIMENSION, MATRYOSHKA_DIMENSIONS  # noqa: E402
+
+
+def synthetic_embeddings(count: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Clustered unit vectors with most of the signal in the leading dimensions."""
+    scale = 1.0 / np.sqrt(1.0 + np.arange(dim) / 32.0)
+    centers = rng.normal(size=(max(count // 50, 1), dim)) * scale
+    labels = rng.integers(0, len(centers), size=count)
+    vectors = centers[labels] + 0.8 * rng.normal(size=(count, dim)) * scale
+    return vectors.astype(np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores per row, best first."""
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, idx, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def coarse_scores(mode: str, corpus: np.ndarray, queries: np.ndarray, matryoshka_dim: int):
+    """Similarity in the compact space plus the bytes one indexed vector takes."""
+    if mode == "full":
+        return normalize(queries) @ normalize(corpus).T, corpus.shape[1] * 4
+    if mode == "halfvec":
+        c = normalize(corpus.astype(np.float16).astype(np.float32))
+        q = normalize(queries.astype(np.float16).astype(np.float32))
+        return q @ c.T, corpus.shape[1] * 2
+    if mode == "binary":
+        # Hamming similarity on sign bits == dim - 2 * hamming distance on +/-1 vectors
+        c = np.where(corpus > 0, 1.0, -1.0).astype(np.float32)
+        q = np.where(queries > 0, 1.0, -1.0).astype(np.float32)
+        return q @ c.T, corpus.shape[1] // 8
+    if mode == "matryoshka":
+        return normalize(queries[:, :matryoshka_dim]) @ normalize(corpus[:, :matryoshka_dim]).T, matryoshka_dim * 4
+    raise ValueError(mode)
+
+
+def run(corpus: np.ndarray, queries: np.ndarray, k: int, multiplier: int):
+    exact = top_k(normalize(queries) @ normalize(corpus).T, k)
+    full_corpus = normalize(corpus)
+    full_queries = normalize(queries)
+    
+    modes = [("full", None), ("halfvec", None), ("binary", None)]
+    modes += [("matryoshka", d) for d in MATRYOSHKA_DIMENSIONS if d < corpus.shape[1]]
+    
+    print(f"corpus={len(corpus)} queries={len(queries)} dim={corpus.shape[1]} k={k} candidates={k * multiplier}")
+    print(f"{'mode':<16}{'bytes/vec':>10}{'index MB':>10}{'recall@k':>10}{'no-rerank':>11}{'ms/query':>10}")
+    
+    for mode, dim in modes:
+        start = time.perf_counter()
+        scores, vector_bytes = coarse_scores(mode, corpus, queries, dim or corpus.shape[1])
+        coarse_only = top_k(scores, k)
+        if mode == "full":
+            results = coarse_only
+        else:
+            candidates = top_k(scores, k * multiplier)
+            rerank = np.einsum("qd,qcd->qc", full_queries, full_corpus[candidates])
+            results = np.take_along_axis(candidates, top_k(rerank, k), axis=1)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        
+        recall = np.mean([len(set(r) & set(e)) / k for r, e in zip(results, exact)])
+        recall_coarse = np.mean([len(set(r) & set(e)) / k for r, e in zip(coarse_only, exact)])
+        label = f"{mode}-{dim}" if dim else mode
+        index_mb = vector_bytes * len(corpus) / 1024 / 1024
+        print(f"{label:<16}{vector_bytes:>10}{index_mb:>10.1f}{recall:>10.3f}{recall_coarse:>11.3f}{elapsed_ms:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", help="Path to a .npy array of real chunk embeddings")
+    parser.add_argument("--corpus", type=int, default=50000, help="Synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--multiplier", type=int, default=10, help="Coarse candidates per result")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(args.seed)
+    if args.embeddings:
+        corpus = np.load(args.embeddings).astype(np.float32)
+    else:
+        corpus = synthetic_embeddings(args.corpus, EMBEDDING_DIMENSION, rng)
+    
+    # Queries are perturbed corpus vectors, so each has a meaningful neighbourhood
+    picks = rng.choice(len(corpus), size=min(args.queries, len(corpus)), replace=False)
+    noise = rng.normal(size=(len(picks), corpus.shape[1])).astype(np.float32)
+    queries = corpus[picks] + 0.5 * noise * corpus.std(axis=0)
+    
+    run(corpus, queries, args.k, args.multiplier)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Exercise the Ollama backend pool (see services/ollama_pool.py) against local fake servers.
+
+Each fake server speaks the parts of the Ollama API the app uses (/api/chat streaming and
+not, /api/embeddings, /api/tags, /api/ps). It holds one model in memory at a time: a
+request for another model first pays --load-ms to swap it in, so routing that ignores
+which model is loaded shows up as extra loads and latency. Tokens stream at --token-ms.
+
+The run sends --requests streaming chats (a mix of models, --concurrency at a time)
+through the pool, once per affinity weight, and then again while one server is
+stopped partway through to show failover.
+
+Usage:
+    python benchmarks/ollama_backends.py
+    python benchmarks/ollama_backends.py --servers 4 --requests 400 --affinity 0 2 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import settings  # noqa: E402
+
+MODELS = ["llama3.2:latest", "phi3:latest", "gemma3:1b"]
+
+
+class FakeOllama:
+    """A single-slot Ollama stand-in on a local port."""
+    
+    def __init__(self, port: int, models, load_ms: float, token_ms: float, tokens: int):
+        self.port = port
+        self.models = list(models)
+        self.load_ms = load_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+        self.loaded = None
+        self.loads = 0
+        self.requests = 0
+        self._swap = asyncio.Lock()
+        self._runner = None
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/tags", self.tags)
+        app.router.add_get("/api/ps", self.ps)
+        app.router.add_post("/api/chat", self.chat)
+        app.router.add_post("/api/embeddings", self.embeddings)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+    
+    async def stop(self):
+        await self._runner.cleanup()
+    
+    async def tags(self, request):
+        return web.json_response({"models": [{"name": m} for m in self.models]})
+    
+    async def ps(self, request):
+        return web.json_response({"models": [{"name": self.loaded}] if self.loaded else []})
+    
+    async def _load(self, model: str):
+        async with self._swap:
+            if self.loaded != model:
+                await asyncio.sleep(self.load_ms / 1000)
+                self.loaded = model
+                self.loads += 1
+    
+    async def chat(self, request):
+        body = await request.json()
+        model = body["model"]
+        if model not in self.models:
+            return web.json_response({"error": f"model '{model}' not found"}, status=404)
+        self.requests += 1
+        await self._load(model)
+        final = {"model": model, "done": True, "prompt_eval_count": 20, "eval_count": self.tokens}
+        if not body.get("stream", True):
+            await asyncio.sleep(self.token_ms * self.tokens / 1000)
+            return web.json_response({**final, "message": {"role": "assistant", "content": "ok " * self.tokens}})
+        
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for _ in range(self.tokens):
+            await asyncio.sleep(self.token_ms / 1000)
+            chunk = {"model": model, "message": {"role": "assistant", "content": "ok "}, "done": False}
+            await response.write((json.dumps(chunk) + "\n").encode())
+        await response.write((json.dumps({**final, "message": {"role": "assistant", "content": ""}}) + "\n").encode())
+        return response
+    
+    async def embeddings(self, request):
+        return web.json_response({"embedding": [0.0] * 8})
+
+
+async def drive(pool, requests: int, concurrency: int, rng: random.Random, on_progress=None):
+    """Send streaming chats through the pool; returns (latencies in ms, failures)."""
+    latencies, failures = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(i: int):
+        nonlocal failures
+        model = rng.choices(MODELS, weights=[5, 3, 2])[0]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                stream = pool.stream(model, lambda client: client.chat(
+                    model=model, messages=[{"role": "user", "content": "hi"}], stream=True
+                ))
+                async for _ in stream:
+                    pass
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                failures += 1
+        if on_progress:
+            await on_progress(i)
+    
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, failures
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)] if ordered else float("nan")
+
+
+async def run(args):
+    # Every server has every model installed; servers only differ in what is loaded
+    servers = [
+        FakeOllama(args.port + i, MODELS, args.load_ms, args.token_ms, args.tokens)
+        for i in range(args.servers)
+    ]
+    for server in servers:
+        await server.start()
+    settings.ollama_backends = [{"url": server.url} for server in servers]
+    settings.ollama_connect_timeout = 1.0
+    from services.ollama_pool import OllamaPool
+    
+    print(
+        f"servers={args.servers} requests={args.requests} concurrency={args.concurrency} "
+        f"load={args.load_ms:g}ms token={args.token_ms:g}ms x {args.tokens}"
+    )
+    print(f"{'run':<16}{'ok':>6}{'failed':>8}{'loads':>7}{'p50 ms':>9}{'p95 ms':>9}  requests per server")
+    
+    async def one_run(label: str, weight: int, stop_at=None):
+        settings.ollama_affinity_weight = weight
+        for server in servers:
+            server.loaded, server.loads, server.requests = None, 0, 0
+        pool = OllamaPool()
+        await pool.check_all()
+        
+        async def on_progress(i):
+            if stop_at is not None and i == stop_at:
+                await servers[-1].stop()
+        
+        latencies, failures = await drive(pool, args.requests, args.concurrency, random.Random(args.seed), on_progress)
+        per_server = " ".join(str(s.requests) for s in servers)
+        print(
+            f"{label:<16}{len(latencies):>6}{failures:>8}{sum(s.loads for s in servers):>7}"
+            f"{percentile(latencies, 0.5):>9.0f}{percentile(latencies, 0.95):>9.0f}  {per_server}"
+        )
+        return pool
+    
+    for weight in args.affinity:
+        await one_run(f"affinity={weight}", weight)
+    
+    pool = await one_run("failover", args.affinity[-1], stop_at=args.requests // 3)
+    down = [b.url for b in pool.backends if not b.healthy]
+    print(f"{'':<16}marked down: {', '.join(down) or 'none'}")
+    
+    for server in servers[:-1]:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=12)
+    parser.add_argument("--load-ms", type=float, default=200, help="Time to swap a model into memory")
+    parser.add_argument("--token-ms", type=float, default=2)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--affinity", type=int, nargs="+", default=[0, 2], help="OLLAMA_AFFINITY_WEIGHT values to compare")
+    parser.add_argument("--port", type=int, default=18434, help="First fake server port")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
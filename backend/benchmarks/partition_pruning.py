@@ -0,0 +1,116 @@
+"""
+Check which document_chunks partitions a chunk search scans, using EXPLAIN.
+
+Two ways of passing the attached document ids are compared on a scratch
+hash-partitioned table shaped like document_chunks (temporary, so nothing in
+the database is touched):
+
+- a bound array (`document_id = ANY($1)`), prepared and forced to a generic
+  plan, which is what asyncpg's statement cache ends up running;
+- literal ids (`document_id IN ('a', 'b')`), rendered by the same
+  DOCUMENT_IDS_PARAM the RAG service uses.
+
+For each, the partitions left in the plan are counted. Pruning works when
+the literal form keeps only the partitions the ids hash to.
+
+Needs a reachable PostgreSQL at DATABASE_URL.
+
+Usage:
+    python benchmarks/partition_pruning.py --partitions 8 --documents 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from database import DATABASE_URL  # noqa: E402
+from services.rag_service import DOCUMENT_IDS_PARAM  # noqa: E402
+
+TABLE = "bench_document_chunks"
+
+
+def scanned_partitions(plan: dict) -> set:
+    """Relations the plan still reads, walking every node."""
+    found = set()
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if node.get("Relation Name", "").startswith(f"{TABLE}_p"):
+            found.add(node["Relation Name"])
+        stack.extend(node.get("Plans", []))
+    return found
+
+
+async def explain(conn, statement, params=None) -> set:
+    result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {statement}"), params or {})
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return scanned_partitions(plan[0]["Plan"])
+
+
+async def run(partitions: int, documents: int, chunks: int):
+    engine = create_async_engine(DATABASE_URL)
+    document_ids = [str(uuid.uuid4()) for _ in range(max(documents * 4, partitions * 2))]
+    attached = document_ids[:documents]
+    
+    async with engine.connect() as conn:
+        await conn.execute(text(
+            f"CREATE TEMPORARY TABLE {TABLE} (id bigserial, document_id varchar NOT NULL, chunk_text text) "
+            f"PARTITION BY HASH (document_id)"
+        ))
+        for remainder in range(partitions):
+            await conn.execute(text(
+                f"CREATE TEMPORARY TABLE {TABLE}_p{remainder} PARTITION OF {TABLE} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            ))
+        await conn.execute(text(f"CREATE INDEX ON {TABLE} (document_id)"))
+        await conn.execute(
+            text(f"INSERT INTO {TABLE} (document_id, chunk_text) "
+                 f"SELECT (CAST(:ids AS varchar[]))[1 + i % cardinality(CAST(:ids AS varchar[]))], md5(i::text) "
+                 f"FROM generate_series(1, :chunks) AS i"),
+            {"ids": document_ids, "chunks": chunks}
+        )
+        await conn.execute(text(f"ANALYZE {TABLE}"))
+        
+        # Bound array, generic plan: what a cached prepared statement runs after a few executions
+        await conn.execute(text("SET plan_cache_mode = force_generic_plan"))
+        await conn.execute(text(
+            f"PREPARE bound_ids (varchar[]) AS SELECT chunk_text FROM {TABLE} WHERE document_id = ANY($1)"
+        ))
+        array_literal = "{" + ",".join(attached) + "}"
+        bound = await explain(conn, f"EXECUTE bound_ids ('{array_literal}')")
+        
+        # Literal ids, rendered exactly as the RAG service renders them
+        statement = text(f"SELECT chunk_text FROM {TABLE} WHERE document_id IN :document_ids").bindparams(
+            DOCUMENT_IDS_PARAM, document_ids=attached
+        )
+        literal_sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True}))
+        literal = await explain(conn, literal_sql)
+        
+        await conn.rollback()
+    await engine.dispose()
+    
+    print(f"partitions={partitions} attached documents={documents} chunks={chunks}")
+    print(f"{'ids passed as':<28}{'partitions scanned':>20}")
+    print(f"{'bound array (generic plan)':<28}{len(bound):>20}")
+    print(f"{'literals':<28}{len(literal):>20}")
+    print("pruned" if len(literal) < len(bound) else "NOT pruned")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--documents", type=int, default=2, help="Attached documents searched")
+    parser.add_argument("--chunks", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args.partitions, args.documents, args.chunks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark the MMR retrieval stage (see services/mmr.py): extra latency per query
+against the prompt tokens saved by dropping near-duplicate chunks.
+
+The corpus imitates documents whose chunks repeat each other: every topic has a
+few variants that share most of their words (re-uploaded revisions, boilerplate,
+paragraphs quoted in several places). Embeddings are hashed bag-of-words vectors,
+so word overlap shows up as cosine similarity the way it does with a real model.
+
+For each query the plain path takes the top-k chunks; the MMR path over-fetches
+k * multiplier candidates (with their embeddings in pgvector text form, as the
+database returns them), parses them and runs the selection. Latency covers the
+parse and the selection, i.e. the in-process cost on top of the SQL query.
+Two effects are reported separately:
+
+- de-duplication: "repeat tok" are prompt tokens spent on a chunk whose topic
+  is already in the result set, and "saved" the prompt tokens saved against
+  top-k. With no relevance floor, MMR mostly swaps copies for new topics and
+  saves tokens only when the candidates run out of distinct ones;
+- recall: the share of the k most relevant distinct topics (by each topic's
+  best chunk) that the result set covers. A relevance floor
+  (RAG_MMR_MIN_RELEVANCE, off by default) saves more tokens by returning fewer
+  chunks, and this column shows what that costs.
+
+Usage:
+    python benchmarks/retrieval_mmr.py
+    python benchmarks/retrieval_mmr.py --topics 500 --variants 4 --duplicate-threshold 0.95 0.85
+    python benchmarks/retrieval_mmr.py --min-relevance 0 0.75
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import EMBEDDING_DIMENSION, TOP_K_DOCUMENTS, TOKENIZER_ENCODING  # noqa: E402
+from services.mmr import mmr_select, parse_embeddings  # noqa: E402
+
+
+def token_counter():
+    """tiktoken when installed, else the same len // 4 fallback the service uses."""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return lambda text: len(text) // 4
+
+
+def synthetic_corpus(topics: int, variants: int, words: int, rng: np.random.Generator):
+    """Chunk texts plus their hashed bag-of-words embeddings; variants of a topic overlap heavily."""
+    vocabulary = [f"w{i}" for i in range(20000)]
+    word_vectors = rng.normal(size=(len(vocabulary), EMBEDDING_DIMENSION)).astype(np.float32)
+
+    texts, ids = [], []
+    for _ in range(topics):
+        base = rng.integers(0, len(vocabulary), size=words)
+        for _ in range(variants):
+            # Each variant rewrites 5-30% of the topic's words
+            variant = base.copy()
+            changed = rng.random(words) < rng.uniform(0.05, 0.3)
+            variant[changed] = rng.integers(0, len(vocabulary), size=int(changed.sum()))
+            ids.append(variant)
+            texts.append(" ".join(vocabulary[i] for i in variant))
+
+    embeddings = np.stack([word_vectors[i].sum(axis=0) for i in ids])
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    topic_of = np.repeat(np.arange(topics), variants)
+    return texts, embeddings, word_vectors, ids, topic_of
+
+
+def redundancy(embeddings: np.ndarray) -> float:
+    """Mean over a result set of each chunk's highest similarity to another chunk in it."""
+    if len(embeddings) < 2:
+        return 0.0
+    sims = embeddings @ embeddings.T
+    np.fill_diagonal(sims, -1.0)
+    return float(sims.max(axis=1).mean())
+
+
+def repeat_tokens(chosen: np.ndarray, topic_of: np.ndarray, chunk_tokens: np.ndarray) -> int:
+    """Tokens of chunks whose topic an earlier chunk in the set already covers."""
+    seen, repeated = set(), 0
+    for i in chosen:
+        if topic_of[i] in seen:
+            repeated += chunk_tokens[i]
+        seen.add(topic_of[i])
+    return repeated
+
+
+def relevant_topics(order: np.ndarray, topic_of: np.ndarray, k: int) -> set:
+    """The first k distinct topics in a query's exact ranking."""
+    topics = []
+    for i in order:
+        if topic_of[i] not in topics:
+            topics.append(topic_of[i])
+            if len(topics) == k:
+                break
+    return set(topics)
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    count_tokens = token_counter()
+    texts, corpus, word_vectors, ids, topic_of = synthetic_corpus(args.topics, args.variants, args.words, rng)
+    chunk_tokens = np.array([count_tokens(t) for t in texts])
+
+    # Queries are a handful of words from a random chunk
+    picks = rng.choice(len(texts), size=args.queries, replace=False)
+    queries = np.stack([word_vectors[rng.choice(ids[p], size=12, replace=False)].sum(axis=0) for p in picks])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ corpus.T
+
+    k = args.k
+    fetch = k * args.multiplier
+    print(
+        f"chunks={len(texts)} ({args.topics} topics x {args.variants} variants) queries={args.queries} "
+        f"k={k} candidates={fetch} lambda={args.lambda_mult}"
+    )
+    print(
+        f"{'path':<22}{'chunks':>8}{'tokens':>10}{'saved':>8}{'repeat tok':>12}{'recall':>8}"
+        f"{'redundancy':>12}{'ms/query':>10}{'p95 ms':>9}"
+    )
+
+    orders = np.argsort(-scores, axis=1)
+    relevant = [relevant_topics(orders[q], topic_of, k) for q in range(args.queries)]
+    plain = [orders[q, :k] for q in range(args.queries)]
+    baseline = np.mean([chunk_tokens[c].sum() for c in plain])
+    report("top-k", plain, [], relevant, baseline, corpus, topic_of, chunk_tokens)
+
+    # Candidate embeddings as the database returns them (text), parsed inside the timed region
+    candidates = [orders[q, :fetch] for q in range(args.queries)]
+    as_text = [["[" + ",".join(f"{x:.6g}" for x in corpus[i]) + "]" for i in c] for c in candidates]
+    for min_relevance in args.min_relevance:
+        for threshold in args.duplicate_threshold:
+            chosen, elapsed = [], []
+            for q in range(args.queries):
+                start = time.perf_counter()
+                picked = mmr_select(
+                    queries[q], parse_embeddings(as_text[q]), k, args.lambda_mult, threshold, min_relevance
+                )
+                elapsed.append((time.perf_counter() - start) * 1000)
+                chosen.append(candidates[q][picked])
+            label = f"mmr@{threshold:g} floor={min_relevance:g}"
+            report(label, chosen, elapsed, relevant, baseline, corpus, topic_of, chunk_tokens)
+
+
+def report(label, results, elapsed, relevant, baseline, corpus, topic_of, chunk_tokens):
+    """Print one row of averages over the queries."""
+    tokens = np.mean([chunk_tokens[c].sum() for c in results])
+    repeated = np.mean([repeat_tokens(c, topic_of, chunk_tokens) for c in results])
+    recall = np.mean([len(set(topic_of[c]) & topics) / len(topics) for c, topics in zip(results, relevant)])
+    timing = f"{np.mean(elapsed):>10.2f}{np.percentile(elapsed, 95):>9.2f}" if elapsed else f"{'-':>10}{'-':>9}"
+    print(
+        f"{label:<22}{np.mean([len(c) for c in results]):>8.1f}{tokens:>10.0f}{1 - tokens / baseline:>8.1%}"
+        f"{repeated:>12.0f}{recall:>8.1%}{np.mean([redundancy(corpus[c]) for c in results]):>12.3f}{timing}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, default=400)
+    parser.add_argument("--variants", type=int, default=3, help="Near-duplicate chunks per topic")
+    parser.add_argument("--words", type=int, default=200, help="Words per chunk")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=TOP_K_DOCUMENTS)
+    parser.add_argument("--multiplier", type=int, default=4, help="Candidates fetched per result")
+    parser.add_argument("--lambda", dest="lambda_mult", type=float, default=0.7)
+    parser.add_argument(
+        "--duplicate-threshold", type=float, nargs="+", default=[0.95, 0.85, 0.75],
+        help="Similarity at which a candidate counts as a copy (one run each)"
+    )
+    parser.add_argument(
+        "--min-relevance", type=float, nargs="+", default=[0.0],
+        help="Relevance floor as a fraction of the best similarity, 0 for none (one run each)"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
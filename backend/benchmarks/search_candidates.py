@@ -0,0 +1,141 @@
+"""
+Benchmark bounding full-text search to the newest matches before ranking
+(see services/search_service.py) on a large synthetic message table.
+
+A temporary table shaped like messages (stored tsvector, GIN index and a
+timestamp index) is filled with generated text whose word frequencies are
+heavily skewed, so some terms match most rows and others a handful. For a
+common, a medium and a rare term the message branch of the search runs two
+ways:
+
+- unbounded: every match is ranked with ts_rank_cd, then the page is taken;
+- bounded: the newest TEXT_SEARCH_CANDIDATES matches are taken first and only
+  those are ranked, as the service does.
+
+Timings come from EXPLAIN ANALYZE (server-side execution time, best of
+--repeat runs) along with the number of rows each plan ranked.
+
+Needs a reachable PostgreSQL at DATABASE_URL; nothing outside the temporary
+table is touched.
+
+Usage:
+    python benchmarks/search_candidates.py --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from database import DATABASE_URL  # noqa: E402
+from config import TEXT_SEARCH_CANDIDATES  # noqa: E402
+
+TABLE = "bench_search_messages"
+VOCABULARY = 5000
+# power(random(), 4) puts most draws on the first words: w0 is in nearly every row
+TERMS = {"common": "w0", "medium": "w400", "rare": "w4900"}
+
+UNBOUNDED = f"""
+    SELECT id, ts_rank_cd(search_vector, q.query) AS rank, timestamp
+    FROM {TABLE}, plainto_tsquery('simple', :term) AS q(query)
+    WHERE search_vector @@ q.query
+    ORDER BY rank DESC, timestamp DESC
+    LIMIT :limit
+"""
+
+BOUNDED = f"""
+    WITH matches AS (
+        SELECT id, search_vector, timestamp
+        FROM {TABLE}, plainto_tsquery('simple', :term) AS q(query)
+        WHERE search_vector @@ q.query
+        ORDER BY timestamp DESC
+        LIMIT :candidates
+    )
+    SELECT id, ts_rank_cd(search_vector, q.query) AS rank, timestamp
+    FROM matches, plainto_tsquery('simple', :term) AS q(query)
+    ORDER BY rank DESC, timestamp DESC
+    LIMIT :limit
+"""
+
+
+def ranked_rows(plan: dict) -> int:
+    """Rows fed into the top-level sort (the ones that were ranked)."""
+    node = plan
+    while node.get("Node Type") in ("Limit",) and node.get("Plans"):
+        node = node["Plans"][0]
+    if node.get("Node Type") == "Sort" and node.get("Plans"):
+        node = node["Plans"][0]
+    return int(node.get("Actual Rows", 0))
+
+
+async def explain(conn, statement: str, params: dict, repeat: int):
+    best, rows = None, 0
+    for _ in range(repeat):
+        result = await conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {statement}"), params)
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        elapsed = plan[0]["Execution Time"]
+        if best is None or elapsed < best:
+            best, rows = elapsed, ranked_rows(plan[0]["Plan"])
+    return best, rows
+
+
+async def run(rows: int, words: int, candidates: int, limit: int, repeat: int):
+    engine = create_async_engine(DATABASE_URL)
+    async with engine.connect() as conn:
+        await conn.execute(text(
+            f"CREATE TEMPORARY TABLE {TABLE} ("
+            f"id bigserial PRIMARY KEY, content text NOT NULL, timestamp timestamptz NOT NULL, "
+            f"search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED)"
+        ))
+        await conn.execute(
+            text(
+                f"INSERT INTO {TABLE} (content, timestamp) "
+                f"SELECT words.content, now() - i * interval '1 second' "
+                f"FROM generate_series(1, :rows) AS i, LATERAL ("
+                f"  SELECT string_agg('w' || floor(power(random(), 4) * :vocabulary)::int, ' ') AS content "
+                f"  FROM generate_series(1, :words) WHERE i > 0"
+                f") words"
+            ),
+            {"rows": rows, "words": words, "vocabulary": VOCABULARY}
+        )
+        await conn.execute(text(f"CREATE INDEX ON {TABLE} USING gin (search_vector)"))
+        await conn.execute(text(f"CREATE INDEX ON {TABLE} (timestamp)"))
+        await conn.execute(text(f"ANALYZE {TABLE}"))
+
+        print(f"rows={rows} words/row={words} candidates={candidates} page={limit}")
+        print(f"{'term':<10}{'matches':>10}{'unbounded ms':>14}{'ranked':>10}{'bounded ms':>12}{'ranked':>10}")
+        for label, term in TERMS.items():
+            matches = await conn.scalar(
+                text(f"SELECT count(*) FROM {TABLE} WHERE search_vector @@ plainto_tsquery('simple', :term)"),
+                {"term": term}
+            )
+            params = {"term": term, "limit": limit, "candidates": candidates}
+            unbounded_ms, unbounded_rows = await explain(conn, UNBOUNDED, params, repeat)
+            bounded_ms, bounded_rows = await explain(conn, BOUNDED, params, repeat)
+            print(
+                f"{label:<10}{matches:>10}{unbounded_ms:>14.1f}{unbounded_rows:>10}"
+                f"{bounded_ms:>12.1f}{bounded_rows:>10}"
+            )
+
+        await conn.rollback()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--words", type=int, default=40, help="Words per synthetic message")
+    parser.add_argument("--candidates", type=int, default=TEXT_SEARCH_CANDIDATES)
+    parser.add_argument("--limit", type=int, default=21, help="Page size plus one, as the API asks for")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.words, args.candidates, args.limit, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
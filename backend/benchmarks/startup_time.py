@@ -0,0 +1,73 @@
+"""
+Benchmark backend start-up: the time to import main.py (everything the process
+loads before it can serve) and to load the tokenizer, each in a fresh
+interpreter. Also lists the slowest imports from `python -X importtime`.
+
+No database or Ollama server is needed; the app lifespan is not run.
+
+Usage:
+    python benchmarks/startup_time.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_MAIN = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+LOAD_TOKENIZER = (
+    "import time; from services.ollama_service import ollama_service; start = time.perf_counter(); "
+    "loaded = ollama_service.load_tokenizer(); print(time.perf_counter() - start if loaded else -1)"
+)
+
+
+def run_timed(code: str) -> float:
+    """Run code in a fresh interpreter and return the seconds it printed."""
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(count: int):
+    """(cumulative microseconds, package) for the slowest packages imported by main."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stderr
+    # A package's outermost import has the largest cumulative time, which includes its submodules
+    by_package = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        if package != "main":
+            by_package[package] = max(by_package.get(package, 0), int(cumulative))
+    return sorted(((us, package) for package, us in by_package.items()), reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+    
+    import_times = [run_timed(IMPORT_MAIN) for _ in range(args.runs)]
+    print(f"import main: median {statistics.median(import_times) * 1000:.0f} ms over {args.runs} runs")
+    
+    tokenizer_time = run_timed(LOAD_TOKENIZER)
+    if tokenizer_time < 0:
+        print("tokenizer: not available (set TIKTOKEN_CACHE_DIR)")
+    else:
+        print(f"tokenizer load: {tokenizer_time * 1000:.0f} ms")
+    
+    print("\nslowest imports (cumulative):")
+    for cumulative, name in slowest_imports(args.top):
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
+import os
+from typing import List, Tuple
+from alembic.config import Config
+from alembic.script import ScriptDirectory
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from sqlalchemy import text
 from config import settings
+from services import vector_index
 
 # Convert postgres:// to postgresql+asyncpg://
 DATABASE_URL = settings.database_url.replace("postgresql://", "postgresql+asyncpg://").replace("?sslmode=disable", "")
@@ -10,7 +15,13 @@ DATABASE_URL = settings.database_url.replace("postgresql://", "postgresql+asyncp
 engine = create_async_engine(
     DATABASE_URL,
     echo=True,
-    future=True
+    future=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+    connect_args={"command_timeout": settings.db_command_timeout}
 )
 
 # Create async session factory
@@ -24,14 +35,64 @@ async_session_maker = async_sessionmaker(
 Base = declarative_base()
 
 
+MIGRATIONS_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def _schema_head() -> str:
+    """Latest migration revision shipped with the code."""
+    config = Config(MIGRATIONS_CONFIG)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(MIGRATIONS_CONFIG), "migrations"))
+    return ScriptDirectory.from_config(config).get_current_head()
+
+
+async def ann_index_status(conn) -> Tuple[bool, List[str]]:
+    """
+    Whether the ANN index for the configured embedding storage mode exists, and the names of
+    chunk ANN indexes built for other modes (never used by the search, only maintained on insert).
+    """
+    exists = await conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": vector_index.index_name()})
+    stale = await conn.scalars(
+        text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'document_chunks' "
+            "AND starts_with(indexname, :prefix) AND indexname <> :name"
+        ),
+        {"prefix": vector_index.INDEX_PREFIX, "name": vector_index.index_name()}
+    )
+    return exists, list(stale.all())
+
+
 async def init_db():
-    """Initialize database and create tables."""
-    async with engine.begin() as conn:
-        # Enable pgvector extension
-        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    """
+    Check that the database schema is at the latest migration and the ANN index matches the
+    embedding storage mode. Read-only: index problems are reported, never fixed here.
+    """
+    expected = _schema_head()
+    
+    async with engine.connect() as conn:
+        has_version_table = await conn.scalar(text("SELECT to_regclass('alembic_version') IS NOT NULL"))
+        current = None
+        if has_version_table:
+            current = await conn.scalar(text("SELECT version_num FROM alembic_version"))
+        
+        if current != expected:
+            raise RuntimeError(
+                f"Database schema is at revision {current or 'none'}, expected {expected}. "
+                f"Run `alembic upgrade head` in the backend directory "
+                f"(databases created before migrations existed: `alembic stamp 0001` first)."
+            )
         
-        # Create all tables
-        await conn.run_sync(Base.metadata.create_all)
+        # The ANN index depends on EMBEDDING_STORAGE_MODE, which can change after migrating
+        has_vector_index, stale = await ann_index_status(conn)
+        if not has_vector_index:
+            print(
+                f"Warning: ANN index {vector_index.index_name()} for embedding storage mode "
+                f"'{settings.embedding_storage_mode}' is missing. Build it with `python manage_vector_index.py --apply`."
+            )
+        if stale:
+            print(
+                f"Warning: ANN indexes from another embedding storage mode are still maintained: {', '.join(stale)}. "
+                f"Drop them with `python manage_vector_index.py --apply`."
+            )
 
 
 async def get_db():
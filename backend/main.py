@@ -1,21 +1,39 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from database import init_db
+from database import init_db, async_session_maker
 from config import settings
-from routes import chat, conversations, documents, models
+from routes import chat, conversations, documents, models, images, backup
+from services.context_manager import context_manager
+from services.archive_service import archive_service
+from services.ollama_service import ollama_service
+from services.ollama_pool import ollama_pool
+from services.token_calibration import token_calibration
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan events for startup and shutdown."""
     # Startup
-    print("Initializing database...")
+    print("Checking database schema...")
     await init_db()
-    print("Database initialized successfully!")
+    print("Database schema is up to date!")
+    # Load the tokenizer now rather than inside the first request
+    await asyncio.to_thread(ollama_service.load_tokenizer)
+    async with async_session_maker() as db:
+        await token_calibration.load(db)
+    if settings.summary_compaction_on_startup:
+        async with async_session_maker() as db:
+            await context_manager.compact_summaries(db)
+            await db.commit()
+    archive_service.start()
+    await ollama_pool.start()
     yield
     # Shutdown
     print("Shutting down...")
+    await ollama_pool.stop()
+    await archive_service.stop()
 
 
 app = FastAPI(
@@ -39,6 +57,8 @@ app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(conversations.router, prefix="/api/conversations", tags=["Conversations"])
 app.include_router(documents.router, prefix="/api/documents", tags=["Documents"])
 app.include_router(models.router, prefix="/api/models", tags=["Models"])
+app.include_router(images.router, prefix="/api/images", tags=["Images"])
+app.include_router(backup.router, prefix="/api/backup", tags=["Backup"])
 
 
 @app.get("/")
@@ -0,0 +1,63 @@
+"""
+Switch the document chunk ANN index to the configured EMBEDDING_STORAGE_MODE.
+
+The backend only reports a missing or leftover index at startup; this is
+the explicit step that changes it. Without --apply it prints what it would
+do. With --apply it builds the index for the configured mode and drops the
+indexes built for other modes, in one transaction.
+
+Building an index on the partitioned document_chunks table blocks writes to
+it until the build finishes, so run this while uploads are quiet.
+
+Usage:
+    python manage_vector_index.py
+    python manage_vector_index.py --apply
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import text
+from config import settings
+from database import engine, ann_index_status
+from services import vector_index
+
+
+async def run(apply: bool):
+    async with engine.connect() as conn:
+        has_vector_index, stale = await ann_index_status(conn)
+    
+    statements = [] if has_vector_index else [vector_index.index_ddl()]
+    statements += [f'DROP INDEX IF EXISTS "{name}"' for name in stale]
+    
+    print(f"Embedding storage mode '{settings.embedding_storage_mode}', ANN index {vector_index.index_name()}")
+    if not statements:
+        print("Nothing to do")
+        return
+    for statement in statements:
+        print(f"  {statement}")
+    if not apply:
+        print("Run again with --apply to execute these statements")
+        return
+    
+    async with engine.begin() as conn:
+        for statement in statements:
+            await conn.execute(text(statement))
+    print("Done")
+
+
+async def main_async(apply: bool):
+    try:
+        await run(apply)
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="Execute the statements instead of printing them")
+    args = parser.parse_args()
+    asyncio.run(main_async(args.apply))
+
+
+if __name__ == "__main__":
+    main()
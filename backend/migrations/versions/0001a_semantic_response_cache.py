@@ -0,0 +1,48 @@
+"""Semantic response cache
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-19
+
+The schema of the optional semantic response cache. Before migrations existed
+that change created its table with create_all, so databases stamped 0001 may
+already have it: the table and its indexes are only created when missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+revision = "0001a"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table = sa.Table(
+        "response_cache",
+        sa.MetaData(),
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("prompt", sa.Text(), nullable=False),
+        sa.Column("response", sa.Text(), nullable=False),
+        sa.Column("embedding", Vector(768), nullable=False),
+        sa.Column("hit_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("last_used_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.execute(sa.schema.CreateTable(table, if_not_exists=True))
+    op.create_index(
+        "ix_response_cache_embedding_hnsw",
+        "response_cache",
+        ["embedding"],
+        postgresql_using="hnsw",
+        postgresql_with={"m": 16, "ef_construction": 64},
+        postgresql_ops={"embedding": "vector_cosine_ops"},
+        if_not_exists=True,
+    )
+    op.create_index("ix_response_cache_last_used_at", "response_cache", ["last_used_at"], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_table("response_cache")
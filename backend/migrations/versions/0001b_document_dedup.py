@@ -0,0 +1,30 @@
+"""Upload deduplication: content hash, embedding model and chunker version per document
+
+Revision ID: 0001b
+Revises: 0001a
+Create Date: 2026-10-19
+
+The columns of upload deduplication. A database created with create_all while
+that change was current already has them, plus a single-column
+ix_documents_content_hash that 0003 replaces, so the columns are only added
+when missing and that index is dropped.
+"""
+from alembic import op
+
+revision = "0001b"
+down_revision = "0001a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+    op.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding_model VARCHAR")
+    op.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS chunker_version INTEGER")
+    op.execute("DROP INDEX IF EXISTS ix_documents_content_hash")
+
+
+def downgrade():
+    op.drop_column("documents", "chunker_version")
+    op.drop_column("documents", "embedding_model")
+    op.drop_column("documents", "content_hash")
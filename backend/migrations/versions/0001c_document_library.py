@@ -0,0 +1,66 @@
+"""Shared document library: move document ownership into a link table
+
+Revision ID: 0001c
+Revises: 0001b
+Create Date: 2026-10-19
+
+The schema of the shared document library. Before migrations existed that
+change created conversation_documents with create_all but left
+documents.conversation_id in place, so the link table is only created when
+missing and existing owners are copied into it only while that column is there.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001c"
+down_revision = "0001b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_documents (
+            conversation_id VARCHAR NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+            document_id VARCHAR NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+            attached_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            PRIMARY KEY (conversation_id, document_id)
+        )
+    """)
+    op.create_index("ix_conversation_documents_document_id", "conversation_documents", ["document_id"], if_not_exists=True)
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'documents' AND column_name = 'conversation_id'
+            ) THEN
+                INSERT INTO conversation_documents (conversation_id, document_id, attached_at)
+                SELECT conversation_id, id, uploaded_at FROM documents
+                ON CONFLICT DO NOTHING;
+                ALTER TABLE documents DROP COLUMN conversation_id;
+            END IF;
+        END $$
+    """)
+
+
+def downgrade():
+    # Each document goes back to a single owner: its earliest attachment.
+    # Library documents that are not attached anywhere cannot be represented and are dropped.
+    op.add_column("documents", sa.Column("conversation_id", sa.String(), nullable=True))
+    op.execute("""
+        UPDATE documents d
+        SET conversation_id = (
+            SELECT cd.conversation_id FROM conversation_documents cd
+            WHERE cd.document_id = d.id
+            ORDER BY cd.attached_at
+            LIMIT 1
+        )
+    """)
+    op.execute("DELETE FROM documents WHERE conversation_id IS NULL")
+    op.alter_column("documents", "conversation_id", nullable=False)
+    op.create_foreign_key(
+        "documents_conversation_id_fkey", "documents", "conversations",
+        ["conversation_id"], ["id"], ondelete="CASCADE"
+    )
+    op.drop_table("conversation_documents")
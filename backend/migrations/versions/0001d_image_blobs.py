@@ -0,0 +1,34 @@
+"""Out-of-line message images
+
+Revision ID: 0001d
+Revises: 0001c
+Create Date: 2026-10-19
+
+The schema of out-of-line message images. Before migrations existed that
+change created image_blobs with create_all, so the table is only created when
+missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001d"
+down_revision = "0001c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table = sa.Table(
+        "image_blobs",
+        sa.MetaData(),
+        sa.Column("id", sa.String(64), primary_key=True),
+        sa.Column("mime_type", sa.String(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.execute(sa.schema.CreateTable(table, if_not_exists=True))
+
+
+def downgrade():
+    op.drop_table("image_blobs")
@@ -0,0 +1,24 @@
+"""Checkpointed streaming replies: message status
+
+Revision ID: 0002
+Revises: 0001d
+Create Date: 2026-10-19
+
+The status column of checkpointed streaming replies. Databases created with
+create_all while that change was current already have it, so it is only added
+when missing.
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS status VARCHAR DEFAULT 'complete' NOT NULL")
+
+
+def downgrade():
+    op.drop_column("messages", "status")
@@ -0,0 +1,47 @@
+"""Indexes for the hot query paths and the document chunk ANN index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# HNSW index for the default EMBEDDING_STORAGE_MODE (full); the index for another mode is
+# built by `python manage_vector_index.py --apply`
+ANN_INDEX = "ix_document_chunks_embedding_full"
+
+
+def upgrade():
+    # Chat history and context: WHERE conversation_id = ? ORDER BY timestamp
+    op.create_index("ix_messages_conversation_id_timestamp", "messages", ["conversation_id", "timestamp"])
+    # Retrieval join and chunk copies: WHERE document_id = ?
+    op.create_index("ix_document_chunks_document_id_chunk_index", "document_chunks", ["document_id", "chunk_index"])
+    # Latest summary: WHERE conversation_id = ? ORDER BY created_at DESC LIMIT 1
+    op.create_index(
+        "ix_conversation_summaries_conversation_id_created_at",
+        "conversation_summaries",
+        ["conversation_id", "created_at"],
+    )
+    # Conversation list: ORDER BY updated_at DESC
+    op.create_index("ix_conversations_updated_at", "conversations", ["updated_at"])
+    # Upload deduplication lookup
+    op.create_index(
+        "ix_documents_content_hash",
+        "documents",
+        ["content_hash", "embedding_model", "chunker_version"],
+    )
+    op.execute(f"CREATE INDEX IF NOT EXISTS {ANN_INDEX} ON document_chunks USING hnsw ((embedding) vector_cosine_ops)")
+
+
+def downgrade():
+    op.execute(f"DROP INDEX IF EXISTS {ANN_INDEX}")
+    op.drop_index("ix_documents_content_hash", table_name="documents")
+    op.drop_index("ix_conversations_updated_at", table_name="conversations")
+    op.drop_index("ix_conversation_summaries_conversation_id_created_at", table_name="conversation_summaries")
+    op.drop_index("ix_document_chunks_document_id_chunk_index", table_name="document_chunks")
+    op.drop_index("ix_messages_conversation_id_timestamp", table_name="messages")
@@ -0,0 +1,49 @@
+"""Per-conversation message sequence numbers
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("conversations", sa.Column("last_seq", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("messages", sa.Column("seq", sa.Integer(), nullable=True))
+    op.add_column("conversation_summaries", sa.Column("summarized_through_seq", sa.Integer(), nullable=True))
+    
+    # Number existing messages in their previous (timestamp) order, ties broken by id
+    op.execute("""
+        UPDATE messages m
+        SET seq = numbered.seq
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY conversation_id ORDER BY timestamp, id) AS seq
+            FROM messages
+        ) numbered
+        WHERE m.id = numbered.id
+    """)
+    op.execute("""
+        UPDATE conversations c
+        SET last_seq = COALESCE((SELECT max(seq) FROM messages m WHERE m.conversation_id = c.id), 0)
+    """)
+    # Summaries covered the first N messages, which are now exactly seq 1..N
+    op.execute("UPDATE conversation_summaries SET summarized_through_seq = messages_summarized")
+    
+    op.alter_column("messages", "seq", nullable=False)
+    op.alter_column("conversation_summaries", "summarized_through_seq", nullable=False)
+    op.create_index("ix_messages_conversation_id_seq", "messages", ["conversation_id", "seq"], unique=True)
+    op.drop_index("ix_messages_conversation_id_timestamp", table_name="messages")
+
+
+def downgrade():
+    op.create_index("ix_messages_conversation_id_timestamp", "messages", ["conversation_id", "timestamp"])
+    op.drop_index("ix_messages_conversation_id_seq", table_name="messages")
+    op.drop_column("conversation_summaries", "summarized_through_seq")
+    op.drop_column("messages", "seq")
+    op.drop_column("conversations", "last_seq")
@@ -0,0 +1,29 @@
+"""Conversation change versions for delta sync
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("conversations", sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("conversations", sa.Column("title_version", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("messages", sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("conversation_summaries", sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+    op.create_index("ix_messages_conversation_id_version", "messages", ["conversation_id", "version"])
+
+
+def downgrade():
+    op.drop_index("ix_messages_conversation_id_version", table_name="messages")
+    op.drop_column("conversation_summaries", "version")
+    op.drop_column("messages", "version")
+    op.drop_column("conversations", "title_version")
+    op.drop_column("conversations", "version")
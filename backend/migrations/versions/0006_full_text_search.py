@@ -0,0 +1,46 @@
+"""Full-text search vectors over message content and conversation titles
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+# Generated column expressions as of this revision (services/text_search.py builds the
+# current ones; later revisions that change them carry their own copies). Inline images
+# are stripped and the text is capped at 100000 characters before parsing.
+MESSAGE_VECTOR_SQL = (
+    r"to_tsvector('english'::regconfig, left(regexp_replace(regexp_replace(content, "
+    r"'!\[[^]]*\]\([^)]*\)', ' ', 'g'), 'data:[^;,\s]+;base64,[A-Za-z0-9+/=]+', ' ', 'g'), 100000))"
+)
+TITLE_VECTOR_SQL = "to_tsvector('english'::regconfig, title)"
+
+
+def upgrade():
+    # Stored generated columns: adding them rewrites both tables once
+    op.add_column(
+        "messages",
+        sa.Column("search_vector", TSVECTOR(), sa.Computed(MESSAGE_VECTOR_SQL, persisted=True)),
+    )
+    op.add_column(
+        "conversations",
+        sa.Column("title_search_vector", TSVECTOR(), sa.Computed(TITLE_VECTOR_SQL, persisted=True)),
+    )
+    op.create_index("ix_messages_search_vector", "messages", ["search_vector"], postgresql_using="gin")
+    op.create_index(
+        "ix_conversations_title_search_vector", "conversations", ["title_search_vector"], postgresql_using="gin"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_conversations_title_search_vector", table_name="conversations")
+    op.drop_index("ix_messages_search_vector", table_name="messages")
+    op.drop_column("conversations", "title_search_vector")
+    op.drop_column("messages", "search_vector")
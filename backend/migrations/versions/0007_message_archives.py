@@ -0,0 +1,43 @@
+"""Cold storage for idle conversations' messages
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("conversations", sa.Column("archived_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_table(
+        "message_archives",
+        sa.Column(
+            "conversation_id", sa.String(),
+            sa.ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("message_count", sa.Integer(), nullable=False),
+        sa.Column("raw_bytes", sa.Integer(), nullable=False),
+        sa.Column("compressed_bytes", sa.Integer(), nullable=False),
+        sa.Column("search_vector", TSVECTOR(), nullable=True),
+        sa.Column("archived_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    # The blob is already zstd-compressed; keep TOAST from trying to compress it again
+    op.execute("ALTER TABLE message_archives ALTER COLUMN data SET STORAGE EXTERNAL")
+    op.create_index(
+        "ix_message_archives_search_vector", "message_archives", ["search_vector"], postgresql_using="gin"
+    )
+
+
+def downgrade():
+    # Rehydrate archived conversations first; dropping the table discards their messages
+    op.drop_index("ix_message_archives_search_vector", table_name="message_archives")
+    op.drop_table("message_archives")
+    op.drop_column("conversations", "archived_at")
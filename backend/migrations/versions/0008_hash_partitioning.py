@@ -0,0 +1,108 @@
+"""Hash-partition messages by conversation and document_chunks by document
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+
+Both tables get 8 partitions. Each is rebuilt: a partitioned copy is created
+and filled, the old table is dropped, and keys and indexes are built once
+after the bulk copy. Both tables are locked for the duration, so run this in
+a maintenance window.
+"""
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+# Stored columns (generated columns are recomputed, never copied)
+MESSAGE_COLUMNS = "id, conversation_id, seq, role, content, model_used, status, version, timestamp"
+CHUNK_COLUMNS = "id, document_id, chunk_text, chunk_index, embedding"
+PARTITIONS = 8
+
+
+def _rebuild(table: str, columns: str, partition_key: str = None):
+    """Recreate a table with the same columns, hash-partitioned on partition_key (or plain), and copy its rows."""
+    if partition_key:
+        op.execute(f"""
+            CREATE TABLE {table}_rebuild (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE)
+            PARTITION BY HASH ({partition_key})
+        """)
+        for remainder in range(PARTITIONS):
+            op.execute(
+                f"CREATE TABLE {table}_p{remainder} PARTITION OF {table}_rebuild "
+                f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})"
+            )
+    else:
+        op.execute(f"CREATE TABLE {table}_rebuild (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE)")
+    
+    op.execute(f"INSERT INTO {table}_rebuild ({columns}) SELECT {columns} FROM {table}")
+    op.execute(f"DROP TABLE {table}")
+    op.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+
+
+def _message_keys_and_indexes(primary_key: str):
+    op.execute(f"ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY ({primary_key})")
+    op.execute(
+        "ALTER TABLE messages ADD CONSTRAINT messages_conversation_id_fkey "
+        "FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE"
+    )
+    op.create_index("ix_messages_conversation_id_seq", "messages", ["conversation_id", "seq"], unique=True)
+    op.create_index("ix_messages_conversation_id_version", "messages", ["conversation_id", "version"])
+    op.create_index("ix_messages_search_vector", "messages", ["search_vector"], postgresql_using="gin")
+
+
+def _save_ann_indexes():
+    """
+    Keep the definitions of the chunk ANN indexes (whichever storage mode built them) in a
+    temporary table, since dropping the old table drops them.
+    """
+    op.execute(
+        "CREATE TEMPORARY TABLE ann_index_definitions ON COMMIT DROP AS "
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() "
+        "AND tablename = 'document_chunks' AND indexname LIKE 'ix\\_document\\_chunks\\_embedding\\_%'"
+    )
+
+
+def _chunk_keys_and_indexes(primary_key: str):
+    op.execute(f"ALTER TABLE document_chunks ADD CONSTRAINT document_chunks_pkey PRIMARY KEY ({primary_key})")
+    op.execute(
+        "ALTER TABLE document_chunks ADD CONSTRAINT document_chunks_document_id_fkey "
+        "FOREIGN KEY (document_id) REFERENCES documents (id) ON DELETE CASCADE"
+    )
+    op.create_index(
+        "ix_document_chunks_document_id_chunk_index", "document_chunks", ["document_id", "chunk_index"]
+    )
+    # Rebuild the saved ANN indexes; built on the parent, each is created on every partition
+    op.execute("""
+        DO $$
+        DECLARE definition text;
+        BEGIN
+            FOR definition IN SELECT indexdef FROM ann_index_definitions LOOP
+                EXECUTE replace(definition, ' ON ONLY ', ' ON ');
+            END LOOP;
+        END $$
+    """)
+    op.execute("DROP TABLE ann_index_definitions")
+
+
+def upgrade():
+    _rebuild("messages", MESSAGE_COLUMNS, "conversation_id")
+    _message_keys_and_indexes("id, conversation_id")
+    
+    _save_ann_indexes()
+    _rebuild("document_chunks", CHUNK_COLUMNS, "document_id")
+    _chunk_keys_and_indexes("id, document_id")
+    
+    op.execute("ANALYZE messages")
+    op.execute("ANALYZE document_chunks")
+
+
+def downgrade():
+    _rebuild("messages", MESSAGE_COLUMNS)
+    _message_keys_and_indexes("id")
+    
+    _save_ann_indexes()
+    _rebuild("document_chunks", CHUNK_COLUMNS)
+    _chunk_keys_and_indexes("id")
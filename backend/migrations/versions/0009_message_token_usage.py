@@ -0,0 +1,30 @@
+"""Token usage reported by Ollama on assistant messages
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("messages", sa.Column("prompt_tokens", sa.Integer(), nullable=True))
+    op.add_column("messages", sa.Column("completion_tokens", sa.Integer(), nullable=True))
+    op.add_column("messages", sa.Column("estimated_prompt_tokens", sa.Integer(), nullable=True))
+    op.create_index(
+        "ix_messages_timestamp_usage", "messages", ["timestamp"],
+        postgresql_where=sa.text("prompt_tokens IS NOT NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_messages_timestamp_usage", table_name="messages")
+    op.drop_column("messages", "estimated_prompt_tokens")
+    op.drop_column("messages", "completion_tokens")
+    op.drop_column("messages", "prompt_tokens")
@@ -0,0 +1,21 @@
+"""Name a document was uploaded under, per conversation
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("conversation_documents", sa.Column("filename", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("conversation_documents", "filename")
@@ -0,0 +1,43 @@
+"""Leave replies that are still streaming out of messages.search_vector
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+# The expression from 0006, indexing every row
+PREVIOUS_VECTOR_SQL = (
+    r"to_tsvector('english'::regconfig, left(regexp_replace(regexp_replace(content, "
+    r"'!\[[^]]*\]\([^)]*\)', ' ', 'g'), 'data:[^;,\s]+;base64,[A-Za-z0-9+/=]+', ' ', 'g'), 100000))"
+)
+# The same, with NULL for replies that are still streaming
+VECTOR_SQL = f"CASE WHEN status = 'streaming' THEN NULL ELSE {PREVIOUS_VECTOR_SQL} END"
+
+
+def _replace_search_vector(expression: str):
+    # A generated column's expression cannot be altered: drop it (and its index) and add it
+    # back, which rewrites every partition of messages once
+    op.drop_index("ix_messages_search_vector", table_name="messages")
+    op.drop_column("messages", "search_vector")
+    op.add_column(
+        "messages",
+        sa.Column("search_vector", TSVECTOR(), sa.Computed(expression, persisted=True)),
+    )
+    # Built on the parent, the index is created on every partition
+    op.create_index("ix_messages_search_vector", "messages", ["search_vector"], postgresql_using="gin")
+
+
+def upgrade():
+    _replace_search_vector(VECTOR_SQL)
+
+
+def downgrade():
+    _replace_search_vector(PREVIOUS_VECTOR_SQL)
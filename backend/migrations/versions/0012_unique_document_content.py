@@ -0,0 +1,57 @@
+"""Make upload deduplication unique per content hash, embedding model and chunker version
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19
+
+Concurrent uploads of the same bytes could each ingest a copy. The copies are
+merged into the earliest one (their attachments move to it, keeping the name
+each conversation showed) before the index becomes unique.
+"""
+from alembic import op
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TEMPORARY TABLE duplicate_documents ON COMMIT DROP AS
+        SELECT id, filename, keep_id FROM (
+            SELECT id, filename, first_value(id) OVER (
+                PARTITION BY content_hash, embedding_model, chunker_version ORDER BY uploaded_at, id
+            ) AS keep_id
+            FROM documents
+            WHERE content_hash IS NOT NULL
+        ) ranked
+        WHERE id <> keep_id
+    """)
+    op.execute("""
+        INSERT INTO conversation_documents (conversation_id, document_id, attached_at, filename)
+        SELECT cd.conversation_id, d.keep_id, cd.attached_at, coalesce(cd.filename, d.filename)
+        FROM conversation_documents cd
+        JOIN duplicate_documents d ON d.id = cd.document_id
+        ON CONFLICT DO NOTHING
+    """)
+    # Chunks and the old attachments go with the copies (ON DELETE CASCADE)
+    op.execute("DELETE FROM documents WHERE id IN (SELECT id FROM duplicate_documents)")
+    op.execute("DROP TABLE duplicate_documents")
+    
+    op.drop_index("ix_documents_content_hash", table_name="documents")
+    op.create_index(
+        "ix_documents_content_hash",
+        "documents",
+        ["content_hash", "embedding_model", "chunker_version"],
+        unique=True,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_documents_content_hash", table_name="documents")
+    op.create_index(
+        "ix_documents_content_hash",
+        "documents",
+        ["content_hash", "embedding_model", "chunker_version"],
+    )
@@ -0,0 +1,22 @@
+"""Index messages by timestamp for bounded search
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Search ranks only the newest matches; for a common term they are found by walking
+    # this index. Built on the parent, it is created on every partition
+    op.create_index("ix_messages_timestamp", "messages", ["timestamp"])
+
+
+def downgrade():
+    op.drop_index("ix_messages_timestamp", table_name="messages")
@@ -1,9 +1,11 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, LargeBinary, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
 from database import Base
 from config import EMBEDDING_DIMENSION
+from services import text_search
 import uuid
 
 
@@ -18,61 +20,149 @@ class Conversation(Base):
     
     id = Column(String, primary_key=True, default=generate_uuid)
     title = Column(String, nullable=False, default="New Chat")
+    last_seq = Column(Integer, nullable=False, default=0, server_default="0")  # Highest message seq handed out
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # Bumped on every change, for delta sync
+    title_version = Column(Integer, nullable=False, default=0, server_default="0")  # Version of the last title change
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    archived_at = Column(DateTime(timezone=True), nullable=True)  # Set while messages sit in message_archives
+    title_search_vector = deferred(Column(TSVECTOR, Computed(text_search.title_vector_sql(), persisted=True)))
     
     # Relationships
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
-    documents = relationship("Document", back_populates="conversation", cascade="all, delete-orphan")
-    summaries = relationship("ConversationSummary", back_populates="conversation", cascade="all, delete-orphan")
+    # passive_deletes: the FK cascades in the database, so deleting a conversation never loads its rows
+    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True)
+    documents = relationship(
+        "Document", secondary="conversation_documents", back_populates="conversations", passive_deletes=True
+    )
+    summaries = relationship(
+        "ConversationSummary", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True
+    )
+    
+    __table_args__ = (
+        Index("ix_conversations_updated_at", "updated_at"),  # Conversation list, newest first
+        Index("ix_conversations_title_search_vector", "title_search_vector", postgresql_using="gin"),  # Search
+    )
 
 
 class Message(Base):
     """Message model to store individual chat messages."""
     __tablename__ = "messages"
     
+    # Hash-partitioned by conversation_id, which therefore is part of the primary key
     id = Column(String, primary_key=True, default=generate_uuid)
-    conversation_id = Column(String, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    conversation_id = Column(String, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(Integer, nullable=False)  # Monotonic position within the conversation
     role = Column(String, nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
     model_used = Column(String, nullable=True)  # Model name for assistant messages
+    status = Column(String, nullable=False, default="complete", server_default="complete")  # 'streaming', 'complete', 'error' or 'interrupted'
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # Conversation version of the last change
+    # Token usage reported by Ollama for assistant replies, with the tokenizer's raw prompt estimate
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    estimated_prompt_tokens = Column(Integer, nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    search_vector = deferred(Column(TSVECTOR, Computed(text_search.message_vector_sql(), persisted=True)))
     
     # Relationship
     conversation = relationship("Conversation", back_populates="messages")
     
+    __table_args__ = (
+        Index("ix_messages_conversation_id_seq", "conversation_id", "seq", unique=True),  # History in order, cursors
+        Index("ix_messages_conversation_id_version", "conversation_id", "version"),  # Delta sync
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),  # Search
+        Index("ix_messages_timestamp", "timestamp"),  # Search: newest matches of a common term
+        Index(
+            "ix_messages_timestamp_usage", "timestamp", postgresql_where=prompt_tokens.is_not(None)
+        ),  # Token calibration warm-up
+        {"postgresql_partition_by": "HASH (conversation_id)"},
+    )
+    
     class Config:
         protected_namespaces = ()
 
 
+class MessageArchive(Base):
+    """Cold storage for an idle conversation's messages, as one zstd-compressed JSON blob."""
+    __tablename__ = "message_archives"
+    
+    conversation_id = Column(String, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    data = deferred(Column(LargeBinary, nullable=False))  # zstd(JSON list of message rows)
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)  # Size of the JSON before compression
+    compressed_bytes = Column(Integer, nullable=False)
+    search_vector = deferred(Column(TSVECTOR, nullable=True))  # Lexemes of the archived text, without positions
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index("ix_message_archives_search_vector", "search_vector", postgresql_using="gin"),  # Search
+    )
+
+
+class ConversationDocument(Base):
+    """Attachment of a library document to a conversation."""
+    __tablename__ = "conversation_documents"
+    
+    conversation_id = Column(String, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    document_id = Column(String, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True, index=True)
+    filename = Column(String, nullable=True)  # Name it was uploaded under here; None = the library name
+    attached_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ImageBlob(Base):
+    """Content-addressed image bytes referenced from message content."""
+    __tablename__ = "image_blobs"
+    
+    id = Column(String(64), primary_key=True)  # SHA-256 of the image bytes
+    mime_type = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Document(Base):
-    """Document model to store uploaded files for RAG."""
+    """Document model to store uploaded files for RAG, shared through the document library."""
     __tablename__ = "documents"
     
     id = Column(String, primary_key=True, default=generate_uuid)
-    conversation_id = Column(String, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     filename = Column(String, nullable=False)
     file_type = Column(String, nullable=False)  # 'txt', 'pdf', 'docx'
-    content = Column(Text, nullable=False)
+    # Full extracted text; only written at ingestion, so it is never loaded unless asked for with undefer()
+    content = deferred(Column(Text, nullable=False), raiseload=True)
+    content_hash = Column(String(64), nullable=True)  # SHA-256 of the uploaded bytes
+    embedding_model = Column(String, nullable=True)
+    chunker_version = Column(Integer, nullable=True)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
-    conversation = relationship("Conversation", back_populates="documents")
-    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+    conversations = relationship(
+        "Conversation", secondary="conversation_documents", back_populates="documents", passive_deletes=True
+    )
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __table_args__ = (
+        Index("ix_documents_content_hash", "content_hash", "embedding_model", "chunker_version", unique=True),  # Upload dedup
+    )
 
 
 class DocumentChunk(Base):
     """Document chunks with embeddings for semantic search."""
     __tablename__ = "document_chunks"
     
+    # Hash-partitioned by document_id, which therefore is part of the primary key
     id = Column(String, primary_key=True, default=generate_uuid)
-    document_id = Column(String, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    document_id = Column(String, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
     chunk_text = Column(Text, nullable=False)
     chunk_index = Column(Integer, nullable=False)
     embedding = Column(Vector(EMBEDDING_DIMENSION))
     
     # Relationship
     document = relationship("Document", back_populates="chunks")
+    
+    __table_args__ = (
+        Index("ix_document_chunks_document_id_chunk_index", "document_id", "chunk_index"),  # Retrieval join, copies
+        {"postgresql_partition_by": "HASH (document_id)"},
+    )
 
 
 class ConversationSummary(Base):
@@ -83,7 +173,38 @@ class ConversationSummary(Base):
     conversation_id = Column(String, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     summary_text = Column(Text, nullable=False)
     messages_summarized = Column(Integer, nullable=False)  # Number of messages summarized
+    summarized_through_seq = Column(Integer, nullable=False)  # Seq of the last message the summary covers
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # Conversation version when written
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationship
     conversation = relationship("Conversation", back_populates="summaries")
+    
+    __table_args__ = (
+        Index("ix_conversation_summaries_conversation_id_created_at", "conversation_id", "created_at"),  # Latest summary
+    )
+
+
+class ResponseCacheEntry(Base):
+    """Cached answers to history-free prompts, looked up by embedding similarity."""
+    __tablename__ = "response_cache"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    model = Column(String, nullable=False)
+    prompt = Column(Text, nullable=False)
+    response = Column(Text, nullable=False)
+    embedding = Column(Vector(EMBEDDING_DIMENSION), nullable=False)
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index(
+            "ix_response_cache_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+        Index("ix_response_cache_last_used_at", "last_used_at"),
+    )
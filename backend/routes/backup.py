@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+from database import get_db
+from services.backup_service import backup_service
+from services.response_encoding import json_streaming_response
+
+router = APIRouter()
+
+
+@router.get("/export")
+async def export_data(request: Request, include_documents: bool = False):
+    """
+    Stream every conversation (messages, summaries, images) as NDJSON, optionally with the
+    document library and chunk embeddings. Compressed per Accept-Encoding.
+    """
+    filename = f"mychatgpt-export-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.ndjson"
+    return json_streaming_response(
+        request,
+        backup_service.export_lines(include_documents),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        media_type="application/x-ndjson"
+    )
+
+
+@router.post("/import")
+async def import_data(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Import an NDJSON export from the request body, read incrementally.
+    Existing rows are kept; rerunning an interrupted import finishes it.
+    """
+    try:
+        return await backup_service.import_lines(db, request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,17 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import Optional
-from database import get_db
-from models import Message, Conversation
-from services.ollama_service import ollama_service
+from typing import AsyncGenerator, Optional
+from database import async_session_maker
+from models import Message
+from services.ollama_service import ollama_service, PromptTooLongError
 from services.rag_service import rag_service
 from services.web_search_service import web_search_service
 from services.context_manager import context_manager
+from services.context_packer import context_packer
+from services.semantic_cache import semantic_cache
+from services.image_store import image_store, INLINE_IMAGE_PATTERN
+from services.image_processor import image_processor
+from services.reply_streams import reply_streams
+from services.message_sequence import allocate_seq
+from services.archive_service import archive_service
+from config import settings, MODEL_CONFIGS
 from sqlalchemy import select
+import asyncio
 import json
-import re
 
 router = APIRouter()
 
@@ -22,63 +30,163 @@ class ChatRequest(BaseModel):
     model: str
     use_rag: bool = False
     use_web_search: bool = False
+    bypass_cache: bool = False
 
 
-@router.post("/stream")
-async def chat_stream(
-    request: ChatRequest,
-    db: AsyncSession = Depends(get_db)
+def _is_vision_model(model: str) -> bool:
+    """Whether a model accepts image input."""
+    return "vision" in MODEL_CONFIGS.get(model, {}).get("capabilities", [])
+
+
+async def _prepare_images(model: str, images: list) -> Optional[list]:
+    """Downscaled base64 payloads for vision models; other models get no image bytes."""
+    if not images or not _is_vision_model(model):
+        return None
+    return await image_processor.prepare_for_model(model, images)
+
+
+def _check_prompt_size(request: ChatRequest):
+    """Refuse a message too long for the model on its own (413) before anything is stored."""
+    images = len(INLINE_IMAGE_PATTERN.findall(request.message)) if _is_vision_model(request.model) else 0
+    try:
+        context_packer.query_tokens(request.model, image_store.strip_images(request.message), images)
+    except PromptTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def _is_cacheable(request: ChatRequest, context_messages: list, images: list) -> bool:
+    """Only history-free, text-only prompts without extra context go through the semantic cache."""
+    return (
+        semantic_cache.enabled
+        and not request.bypass_cache
+        and not context_messages
+        and not images
+        and not request.use_rag
+        and not request.use_web_search
+    )
+
+
+async def _save_assistant_message(
+    db: AsyncSession,
+    conversation_id: str,
+    content: str,
+    model: str,
+    usage: Optional[dict] = None
 ):
-    """Stream chat responses with SSE."""
+    """Save an assistant reply (allocating its seq also bumps the conversation's updated_at)."""
+    seq, version = await allocate_seq(db, conversation_id)
+    db.add(Message(
+        conversation_id=conversation_id,
+        seq=seq,
+        version=version,
+        role="assistant",
+        content=content,
+        model_used=model,
+        **(usage or {})
+    ))
+    await db.commit()
+
+
+async def _iter_cached(response: str) -> AsyncGenerator[str, None]:
+    """Replay a cached answer as a token stream."""
+    for chunk in semantic_cache.iter_chunks(response):
+        yield chunk
+
+
+@router.post("/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Stream chat responses with SSE.
+    Database sessions are short-lived: one reads context and records the user message and an
+    empty 'streaming' reply row, which is then filled by batched checkpoint writes; no pooled
+    connection is held during summarization, embedding or generation. Generation continues if the client
+    disconnects, and the reply can be re-attached via /stream/{message_id}.
+    A message too long for the model is refused with 413; a prompt found too long once the
+    stream has started marks the reply failed and ends with an error event.
+    """
+    _check_prompt_size(request)
     
     async def generate():
+        assistant_message = None
+        started = False
         try:
-            # Get conversation context with summarization
-            context_messages, was_summarized = await context_manager.get_context_messages(
-                db, request.conversation_id, request.model
-            )
+            async with async_session_maker() as db:
+                # Bring back an archived conversation's history before reading it
+                await archive_service.rehydrate(db, request.conversation_id)
+                
+                # Read the context; summarizing an over-long history waits until this session is closed
+                context_messages, was_summarized, summary_job = await context_manager.get_context_messages(
+                    db, request.conversation_id, request.model
+                )
+                
+                # Move images out of line, then save user message to DB (after getting context to avoid duplication)
+                stored_content, images = await image_store.externalize(db, request.message)
+                seq, version = await allocate_seq(db, request.conversation_id)
+                user_message = Message(
+                    conversation_id=request.conversation_id,
+                    seq=seq,
+                    version=version,
+                    role="user",
+                    content=stored_content
+                )
+                db.add(user_message)
+                
+                # Create the reply row up front so generation is checkpointed into it
+                seq, version = await allocate_seq(db, request.conversation_id)
+                assistant_message = Message(
+                    conversation_id=request.conversation_id,
+                    seq=seq,
+                    version=version,
+                    role="assistant",
+                    content="",
+                    model_used=request.model,
+                    status="streaming"
+                )
+                db.add(assistant_message)
+                await db.commit()
             
-            # Save user message to DB (after getting context to avoid duplication)
-            user_message = Message(
-                conversation_id=request.conversation_id,
-                role="user",
-                content=request.message
-            )
-            db.add(user_message)
-            await db.commit()
+            # Model and embedding calls from here on run with no database session open
+            if summary_job:
+                context_messages, was_summarized = await context_manager.summarize(
+                    request.conversation_id, summary_job, request.model
+                )
             
-            # Extract images and clean content for processing
-            images = []
-            img_matches = re.finditer(r'!\[.*?\]\(data:image\/.*?;base64,(.*?)\)', request.message)
-            for match in img_matches:
-                images.append(match.group(1))
+            # Clean content for processing
+            clean_message = image_store.strip_images(stored_content)
+            
+            # Retrieve RAG chunks if enabled using clean message
+            relevant_chunks = []
+            if request.use_rag:
+                relevant_chunks = await rag_service.search_relevant_chunks(
+                    request.conversation_id, clean_message
+                )
             
-            clean_message = re.sub(r'!\[.*?\]\(data:image\/.*?;base64,.*?\)', '[Image]', request.message)
+            # Check the semantic cache for history-free prompts
+            cached_response = None
+            cache_embedding = []
+            cacheable = _is_cacheable(request, context_messages, images)
+            if cacheable:
+                cached_response, cache_embedding = await semantic_cache.lookup(request.model, clean_message)
             
-            # Prepare the current message for Ollama
+            # Prepare the current message for Ollama (image bytes only go to vision models)
             current_message = {
                 "role": "user", 
                 "content": clean_message,
-                "images": images if images else None
+                "images": await _prepare_images(request.model, images)
             }
             
-            # Add RAG context if enabled using clean message
-            rag_context = ""
-            if request.use_rag:
-                relevant_chunks = await rag_service.search_relevant_chunks(
-                    db, request.conversation_id, clean_message
-                )
-                if relevant_chunks:
-                    rag_context = "### Relevant Documents:\n\n"
-                    for i, chunk in enumerate(relevant_chunks, 1):
-                        rag_context += f"**Document {i}:**\n{chunk}\n\n"
-                    rag_context += "---\n\n"
-            
-            # Add web search context if enabled using clean message
-            web_context = ""
+            # Search the web if enabled using clean message
+            search_results = []
             if request.use_web_search:
                 search_results = await web_search_service.search(clean_message)
-                web_context = web_search_service.format_search_context(search_results)
+            
+            # Fit history, documents and web results into the model's context window
+            context_messages, relevant_chunks, search_results, packing = context_packer.pack(
+                request.model, context_messages, was_summarized, clean_message,
+                relevant_chunks, search_results, images=len(current_message["images"] or [])
+            )
+            rag_context = rag_service.format_document_context(relevant_chunks)
+            web_context = web_search_service.format_search_context(search_results)
             
             # Combine contexts
             enhanced_message = ""
@@ -93,39 +201,44 @@ async def chat_stream(
             metadata = {
                 "was_summarized": was_summarized,
                 "used_rag": bool(rag_context),
-                "used_web_search": bool(web_context)
+                "used_web_search": bool(web_context),
+                "cache_hit": cached_response is not None,
+                "assistant_message_id": assistant_message.id,
+                "context": packing
             }
             yield f"data: {json.dumps({'type': 'metadata', 'data': metadata})}\n\n"
             
-            # Stream the response
-            assistant_response = ""
-            async for chunk in ollama_service.chat_stream(request.model, messages):
-                assistant_response += chunk
-                yield f"data: {json.dumps({'type': 'chunk', 'content': chunk})}\n\n"
+            # Generate in the background so the reply survives a client disconnect
+            async def on_complete(response: str):
+                async with async_session_maker() as cache_db:
+                    await semantic_cache.store(
+                        cache_db, request.model, clean_message, response, cache_embedding
+                    )
             
-            # Save assistant message
-            assistant_message = Message(
-                conversation_id=request.conversation_id,
-                role="assistant",
-                content=assistant_response,
-                model_used=request.model
-            )
-            db.add(assistant_message)
+            usage = {}
+            if cached_response is not None:
+                source = _iter_cached(cached_response)
+            else:
+                source = ollama_service.chat_stream(request.model, messages, usage=usage)
             
-            # Update conversation timestamp
-            result = await db.execute(
-                select(Conversation).where(Conversation.id == request.conversation_id)
+            fanout = reply_streams.start(
+                assistant_message.id, request.conversation_id, source,
+                on_complete if cacheable and cached_response is None else None, usage
             )
-            conversation = result.scalars().first()
-            if conversation:
-                # This will trigger the onupdate for updated_at
-                conversation.title = conversation.title
+            started = True
+            async for chunk in fanout.subscribe():
+                yield f"data: {json.dumps({'type': 'chunk', 'content': chunk})}\n\n"
             
-            await db.commit()
+            if fanout.error:
+                yield f"data: {json.dumps({'type': 'error', 'content': fanout.error})}\n\n"
+                return
             
             yield f"data: {json.dumps({'type': 'done'})}\n\n"
             
         except Exception as e:
+            # Don't leave a reply row that nothing will ever fill
+            if assistant_message is not None and not started:
+                await reply_streams.fail(assistant_message.id, request.conversation_id)
             error_message = f"Error: {str(e)}"
             yield f"data: {json.dumps({'type': 'error', 'content': error_message})}\n\n"
     
@@ -140,62 +253,163 @@ async def chat_stream(
 
 
 @router.post("/message")
-async def chat_message(
-    request: ChatRequest,
-    db: AsyncSession = Depends(get_db)
-):
-    """Non-streaming chat endpoint (alternative)."""
+async def chat_message(request: ChatRequest):
+    """
+    Non-streaming chat endpoint (alternative). Holds no database connection during generation.
+    A prompt too long for the model is refused with 413 and no reply is saved.
+    """
+    _check_prompt_size(request)
     
     try:
-        # Get conversation context
-        context_messages, was_summarized = await context_manager.get_context_messages(
-            db, request.conversation_id, request.model
-        )
+        async with async_session_maker() as db:
+            await archive_service.rehydrate(db, request.conversation_id)
+            
+            # Get conversation context (summarized below, once this session is closed)
+            context_messages, was_summarized, summary_job = await context_manager.get_context_messages(
+                db, request.conversation_id, request.model
+            )
+            
+            # Move images out of line, then save user message
+            stored_content, images = await image_store.externalize(db, request.message)
+            seq, version = await allocate_seq(db, request.conversation_id)
+            user_message = Message(
+                conversation_id=request.conversation_id,
+                seq=seq,
+                version=version,
+                role="user",
+                content=stored_content
+            )
+            db.add(user_message)
+            await db.commit()
         
-        # Save user message
-        user_message = Message(
-            conversation_id=request.conversation_id,
-            role="user",
-            content=request.message
-        )
-        db.add(user_message)
-        await db.commit()
+        if summary_job:
+            context_messages, was_summarized = await context_manager.summarize(
+                request.conversation_id, summary_job, request.model
+            )
         
-        # Extract images and clean content for processing
-        images = []
-        img_matches = re.finditer(r'!\[.*?\]\(data:image\/.*?;base64,(.*?)\)', request.message)
-        for match in img_matches:
-            images.append(match.group(1))
+        # Clean content for processing
+        clean_message = image_store.strip_images(stored_content)
         
-        clean_message = re.sub(r'!\[.*?\]\(data:image\/.*?;base64,.*?\)', '[Image]', request.message)
+        # Check the semantic cache for history-free prompts
+        cached_response = None
+        cache_embedding = []
+        cacheable = _is_cacheable(request, context_messages, images)
+        if cacheable:
+            cached_response, cache_embedding = await semantic_cache.lookup(request.model, clean_message)
         
-        # Prepare the current message
+        # Prepare the current message (image bytes only go to vision models)
         current_message = {
             "role": "user", 
             "content": clean_message,
-            "images": images if images else None
+            "images": await _prepare_images(request.model, images)
         }
         
-        # Add current message
+        # Fit history into the model's context window, then add current message
+        context_messages, _, _, packing = context_packer.pack(
+            request.model, context_messages, was_summarized, clean_message,
+            images=len(current_message["images"] or [])
+        )
         messages = context_messages + [current_message]
         
-        # Get response
-        response = await ollama_service.chat(request.model, messages)
+        # Get response, from the semantic cache when possible
+        usage = {}
+        if cached_response is not None:
+            response = cached_response
+        else:
+            response = await ollama_service.chat(request.model, messages, usage=usage)
         
-        # Save assistant message
-        assistant_message = Message(
-            conversation_id=request.conversation_id,
-            role="assistant",
-            content=response,
-            model_used=request.model
-        )
-        db.add(assistant_message)
-        await db.commit()
+        # Save assistant message in a fresh session
+        async with async_session_maker() as db:
+            if cacheable and cached_response is None:
+                await semantic_cache.store(
+                    db, request.model, clean_message, response, cache_embedding
+                )
+            await _save_assistant_message(db, request.conversation_id, response, request.model, usage)
         
         return {
             "response": response,
-            "was_summarized": was_summarized
+            "was_summarized": was_summarized,
+            "cache_hit": cached_response is not None,
+            "context": packing
         }
         
+    except PromptTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/stream/{message_id}")
+async def resume_stream(message_id: str, offset: int = 0):
+    """
+    Reconnect to an assistant reply by message id with SSE.
+    Replays the reply from character `offset`, then follows it until it finishes.
+    Replies generating on this worker are followed live; otherwise the checkpointed row is polled.
+    """
+    
+    async def follow_live(fanout):
+        position = 0
+        async for chunk in fanout.subscribe():
+            if position + len(chunk) > offset:
+                yield chunk[max(offset - position, 0):]
+            position += len(chunk)
+    
+    async def generate():
+        try:
+            fanout = reply_streams.get(message_id)
+            if fanout:
+                async for chunk in follow_live(fanout):
+                    yield f"data: {json.dumps({'type': 'chunk', 'content': chunk})}\n\n"
+                if fanout.error:
+                    yield f"data: {json.dumps({'type': 'error', 'content': fanout.error})}\n\n"
+                else:
+                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                return
+            
+            position = offset
+            last_progress = asyncio.get_running_loop().time()
+            lookup = select(Message.content, Message.status, Message.conversation_id).where(Message.id == message_id)
+            partition_known = False
+            while True:
+                async with async_session_maker() as db:
+                    result = await db.execute(lookup)
+                    row = result.first()
+                
+                if not row:
+                    yield f"data: {json.dumps({'type': 'error', 'content': 'Message not found'})}\n\n"
+                    return
+                
+                # After the first poll, include the partition key so only one partition is probed
+                if not partition_known:
+                    lookup = lookup.where(Message.conversation_id == row.conversation_id)
+                    partition_known = True
+                
+                if len(row.content) > position:
+                    yield f"data: {json.dumps({'type': 'chunk', 'content': row.content[position:]})}\n\n"
+                    position = len(row.content)
+                    last_progress = asyncio.get_running_loop().time()
+                
+                if row.status == "complete":
+                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                    return
+                if row.status != "streaming":
+                    yield f"data: {json.dumps({'type': 'error', 'content': f'Reply {row.status}'})}\n\n"
+                    return
+                if asyncio.get_running_loop().time() - last_progress > settings.stream_resume_stall_timeout:
+                    yield f"data: {json.dumps({'type': 'error', 'content': 'Reply stopped making progress'})}\n\n"
+                    return
+                
+                await asyncio.sleep(settings.stream_checkpoint_interval)
+        
+        except Exception as e:
+            error_message = f"Error: {str(e)}"
+            yield f"data: {json.dumps({'type': 'error', 'content': error_message})}\n\n"
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
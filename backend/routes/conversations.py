@@ -1,15 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, delete, desc, func
 from pydantic import BaseModel
-from typing import List, Optional
-from database import get_db
-from models import Conversation, Message
+from typing import AsyncIterator, List, Optional
+from database import get_db, async_session_maker
+from models import Conversation, Message, ConversationSummary
+from services.message_sequence import bump_version
+from services.search_service import search_service
+from services.archive_service import archive_service
+from services.response_encoding import json_streaming_response, dumps as json_dumps
 from datetime import datetime
+import hashlib
 
 router = APIRouter()
 
 
+def _etag(*parts) -> str:
+    """Weak ETag from the values that identify a resource version."""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this version."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
 class ConversationCreate(BaseModel):
     title: Optional[str] = "New Chat"
 
@@ -30,9 +49,12 @@ class ConversationResponse(BaseModel):
 
 class MessageResponse(BaseModel):
     id: str
+    seq: int
     role: str
     content: str
     model_used: Optional[str]
+    status: str
+    version: int
     timestamp: datetime
     
     class Config:
@@ -44,17 +66,86 @@ class ConversationDetailResponse(BaseModel):
     title: str
     created_at: datetime
     updated_at: datetime
+    version: int  # Pass as since_version to /sync
     messages: List[MessageResponse]
     
     class Config:
         from_attributes = True
 
 
+class ConversationSyncResponse(BaseModel):
+    version: int
+    title: Optional[str]  # Only set when it changed since the client's version
+    summary: Optional[str]  # Only set when a newer summary was written
+    messages: List[MessageResponse]  # Messages added or changed since the client's version
+
+
+# Column projections matching the response models, for paths that skip ORM hydration
+CONVERSATION_COLUMNS = (
+    Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at, Conversation.version
+)
+MESSAGE_COLUMNS = (
+    Message.id, Message.seq, Message.role, Message.content, Message.model_used,
+    Message.status, Message.version, Message.timestamp
+)
+MESSAGE_BATCH_SIZE = 500
+
+
+def _archived_fields(message: dict) -> dict:
+    """The response fields of a message decoded from an archive."""
+    return {column.key: message[column.key] for column in MESSAGE_COLUMNS}
+
+
+def _merge_archived(archived: List[dict], rows) -> List[dict]:
+    """Archived message dicts and hot message rows as one seq-ordered list of response fields."""
+    messages = [_archived_fields(message) for message in archived]
+    messages.extend(row._asdict() for row in rows)
+    messages.sort(key=lambda message: message["seq"])
+    return messages
+
+
+class SearchHitResponse(BaseModel):
+    kind: str  # 'title', 'message' or 'archive' (an archived conversation's messages)
+    conversation_id: str
+    conversation_title: str
+    message_id: Optional[str]
+    seq: Optional[int]
+    role: Optional[str]
+    rank: float
+    timestamp: datetime
+    snippet: str  # Matching terms wrapped in <b></b>; empty for archive hits
+
+
+class SearchResponse(BaseModel):
+    results: List[SearchHitResponse]
+    has_more: bool
+
+
+class MessagePageResponse(BaseModel):
+    messages: List[MessageResponse]
+    next_cursor: Optional[int]  # Pass as after_seq to get the next page
+    has_more: bool
+
+
 @router.get("/", response_model=List[ConversationResponse])
 async def list_conversations(
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db)
 ):
-    """Get all conversations ordered by most recent."""
+    """Get all conversations ordered by most recent. Supports If-None-Match."""
+    fingerprint = await db.execute(
+        select(
+            func.count(Conversation.id),
+            func.max(Conversation.updated_at),
+            func.coalesce(func.sum(Conversation.version), 0)
+        )
+    )
+    etag = _etag(*fingerprint.one())
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
     result = await db.execute(
         select(Conversation).order_by(desc(Conversation.updated_at))
     )
@@ -62,6 +153,18 @@ async def list_conversations(
     return conversations
 
 
+@router.get("/search", response_model=SearchResponse)
+async def search_conversations(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """Full-text search over conversation titles and message content, best match first."""
+    results, has_more = await search_service.search(db, q, limit, offset)
+    return {"results": results, "has_more": has_more}
+
+
 @router.post("/", response_model=ConversationResponse)
 async def create_conversation(
     conversation: ConversationCreate,
@@ -78,9 +181,76 @@ async def create_conversation(
 @router.get("/{conversation_id}", response_model=ConversationDetailResponse)
 async def get_conversation(
     conversation_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a conversation with all its messages. Supports If-None-Match.
+    Messages are streamed from a server-side cursor as column projections (no ORM objects),
+    encoded with orjson and compressed per Accept-Encoding.
+    """
+    result = await db.execute(
+        select(*CONVERSATION_COLUMNS, Conversation.archived_at).where(Conversation.id == conversation_id)
+    )
+    conversation = result.first()
+    
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    # Every change bumps the version, so it identifies the whole resource
+    etag = _etag(conversation.id, conversation.version)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    # An archived conversation is read from its archive row; only writes restore it
+    archived = await archive_service.archived_messages(db, conversation_id) if conversation.archived_at else []
+    return json_streaming_response(
+        request, _conversation_json(conversation, archived), headers={"ETag": etag}
+    )
+
+
+async def _conversation_json(conversation, archived: List[dict]) -> AsyncIterator[bytes]:
+    """Encode a conversation and its messages (archived ones first, by seq) as JSON, one message at a time."""
+    header = json_dumps({column.key: getattr(conversation, column.key) for column in CONVERSATION_COLUMNS})
+    yield header[:-1] + b',"messages":['
+    
+    separator = b""
+    position = 0
+    # The request's session is closed before the body is sent, so the cursor gets its own
+    async with async_session_maker() as db:
+        rows = await db.stream(
+            select(*MESSAGE_COLUMNS)
+            .where(Message.conversation_id == conversation.id)
+            .order_by(Message.seq)
+            .execution_options(yield_per=MESSAGE_BATCH_SIZE)
+        )
+        async for row in rows:
+            while position < len(archived) and archived[position]["seq"] < row.seq:
+                yield separator + json_dumps(_archived_fields(archived[position]))
+                separator = b","
+                position += 1
+            yield separator + json_dumps(row._asdict())
+            separator = b","
+    
+    for message in archived[position:]:
+        yield separator + json_dumps(_archived_fields(message))
+        separator = b","
+    
+    yield b"]}"
+
+
+@router.get("/{conversation_id}/sync", response_model=ConversationSyncResponse)
+async def sync_conversation(
+    conversation_id: str,
+    request: Request,
+    response: Response,
+    since_version: int = 0,
     db: AsyncSession = Depends(get_db)
 ):
-    """Get a conversation with all its messages."""
+    """
+    Get only what changed in a conversation since a version the client already has
+    (from a previous /sync or the full GET). Supports If-None-Match.
+    """
     result = await db.execute(
         select(Conversation).where(Conversation.id == conversation_id)
     )
@@ -89,23 +259,79 @@ async def get_conversation(
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Get messages
+    etag = _etag(conversation.id, conversation.version)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
+    if since_version >= conversation.version:
+        return {"version": conversation.version, "title": None, "summary": None, "messages": []}
+    
     messages_result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conversation_id)
-        .order_by(Message.timestamp)
+        select(*MESSAGE_COLUMNS)
+        .where(
+            Message.conversation_id == conversation_id,
+            Message.version > since_version
+        )
+        .order_by(Message.seq)
+    )
+    messages = messages_result.all()
+    if conversation.archived_at:
+        archived = await archive_service.archived_messages(db, conversation_id)
+        messages = _merge_archived([m for m in archived if m["version"] > since_version], messages)
+    
+    summary_result = await db.execute(
+        select(ConversationSummary.summary_text)
+        .where(
+            ConversationSummary.conversation_id == conversation_id,
+            ConversationSummary.version > since_version
+        )
+        .order_by(desc(ConversationSummary.version))
+        .limit(1)
     )
-    messages = messages_result.scalars().all()
     
     return {
-        "id": conversation.id,
-        "title": conversation.title,
-        "created_at": conversation.created_at,
-        "updated_at": conversation.updated_at,
+        "version": conversation.version,
+        "title": conversation.title if conversation.title_version > since_version else None,
+        "summary": summary_result.scalar(),
         "messages": messages
     }
 
 
+@router.get("/{conversation_id}/messages", response_model=MessagePageResponse)
+async def list_messages(
+    conversation_id: str,
+    after_seq: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get a page of messages after a seq cursor, in conversation order."""
+    result = await db.execute(
+        select(*MESSAGE_COLUMNS)
+        .where(
+            Message.conversation_id == conversation_id,
+            Message.seq > after_seq
+        )
+        .order_by(Message.seq)
+        .limit(limit + 1)
+    )
+    
+    # Messages of an archived conversation are read from its archive row; only writes restore them
+    archived = []
+    if await db.scalar(select(Conversation.archived_at).where(Conversation.id == conversation_id)):
+        archived = [m for m in await archive_service.archived_messages(db, conversation_id) if m["seq"] > after_seq]
+    messages = _merge_archived(archived, result.all())[:limit + 1]
+    
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    
+    return {
+        "messages": messages,
+        "next_cursor": messages[-1]["seq"] if messages else None,
+        "has_more": has_more
+    }
+
+
 @router.patch("/{conversation_id}", response_model=ConversationResponse)
 async def update_conversation(
     conversation_id: str,
@@ -122,6 +348,7 @@ async def update_conversation(
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     conversation.title = update.title
+    conversation.title_version = await bump_version(db, conversation_id)
     await db.commit()
     await db.refresh(conversation)
     return conversation
@@ -132,16 +359,13 @@ async def delete_conversation(
     conversation_id: str,
     db: AsyncSession = Depends(get_db)
 ):
-    """Delete a conversation and all its messages."""
+    """Delete a conversation; its messages, summaries and attachments go with it through the FK cascade."""
     result = await db.execute(
-        select(Conversation).where(Conversation.id == conversation_id)
+        delete(Conversation).where(Conversation.id == conversation_id)
     )
-    conversation = result.scalars().first()
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    await db.delete(conversation)
     await db.commit()
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Conversation not found")
     
     return {"message": "Conversation deleted successfully"}
 
@@ -153,6 +377,9 @@ async def auto_name_conversation(
 ):
     """Automatically generate a title for the conversation based on content."""
     from services.ollama_service import ollama_service
+    from services.image_store import image_store
+    
+    await archive_service.rehydrate(db, conversation_id)
     
     # Get conversation
     result = await db.execute(
@@ -165,27 +392,28 @@ async def auto_name_conversation(
         
     # Get first user message
     messages_result = await db.execute(
-        select(Message)
+        select(Message.content)
         .where(
             Message.conversation_id == conversation_id,
             Message.role == 'user'
         )
-        .order_by(Message.timestamp)
+        .order_by(Message.seq)
         .limit(1)
     )
-    first_message = messages_result.scalars().first()
+    first_message = messages_result.first()
     
     if not first_message:
         return conversation  # No messages yet
         
     # Generate title
     try:
-        prompt = f"Generate a short, concise title (max 4-5 words) for a chat that starts with this message: '{first_message.content}'. Do not use quotes. Just the title."
+        prompt = f"Generate a short, concise title (max 4-5 words) for a chat that starts with this message: '{image_store.strip_images(first_message.content)}'. Do not use quotes. Just the title."
         
         generated_title = await ollama_service.chat(
             model="llama3.2:latest",  # Use a fast model
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
+            temperature=0.7,
+            max_tokens=32
         )
         
         # Clean up title
@@ -194,6 +422,7 @@ async def auto_name_conversation(
             title = title[:47] + "..."
             
         conversation.title = title
+        conversation.title_version = await bump_version(db, conversation_id)
         await db.commit()
         await db.refresh(conversation)
         
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from database import get_db
 from services.rag_service import rag_service
 
@@ -15,13 +16,17 @@ class DocumentResponse(BaseModel):
     uploaded_at: str
 
 
+class LibraryDocumentResponse(DocumentResponse):
+    attachment_count: int
+
+
 @router.post("/upload")
 async def upload_document(
-    conversation_id: str,
+    conversation_id: Optional[str] = None,
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db)
 ):
-    """Upload and process a document for RAG."""
+    """Upload a document to the library for RAG, attaching it to a conversation if given."""
     
     # Validate file type
     allowed_extensions = ['.txt', '.pdf', '.docx']
@@ -38,25 +43,66 @@ async def upload_document(
     
     try:
         # Process document
-        document_id = await rag_service.process_document(
+        document_id, library_filename = await rag_service.process_document(
             db, conversation_id, file.filename, file_content
         )
         
+        # Identical bytes already in the library keep their first name there; the
+        # conversation lists the document under the name it was uploaded as
         return {
             "message": "Document uploaded and processed successfully",
             "document_id": document_id,
-            "filename": file.filename
+            "filename": file.filename,
+            "library_filename": library_filename
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
 
+@router.get("/library", response_model=List[LibraryDocumentResponse])
+async def get_library(
+    db: AsyncSession = Depends(get_db)
+):
+    """Get all documents in the shared library."""
+    return await rag_service.get_library_documents(db)
+
+
+@router.post("/{document_id}/attach")
+async def attach_document(
+    document_id: str,
+    conversation_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """Attach a library document to a conversation."""
+    try:
+        await rag_service.attach_document(db, conversation_id, document_id)
+    except IntegrityError:
+        raise HTTPException(status_code=404, detail="Document or conversation not found")
+    
+    return {"message": "Document attached successfully"}
+
+
+@router.delete("/{document_id}/attach")
+async def detach_document(
+    document_id: str,
+    conversation_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """Detach a document from a conversation without removing it from the library."""
+    success = await rag_service.detach_document(db, conversation_id, document_id)
+    
+    if not success:
+        raise HTTPException(status_code=404, detail="Document is not attached to this conversation")
+    
+    return {"message": "Document detached successfully"}
+
+
 @router.get("/{conversation_id}", response_model=List[DocumentResponse])
 async def get_documents(
     conversation_id: str,
     db: AsyncSession = Depends(get_db)
 ):
-    """Get all documents for a conversation."""
+    """Get all documents attached to a conversation."""
     documents = await rag_service.get_conversation_documents(db, conversation_id)
     return documents
 
@@ -66,7 +112,7 @@ async def delete_document(
     document_id: str,
     db: AsyncSession = Depends(get_db)
 ):
-    """Delete a document and its embeddings."""
+    """Delete a document and its embeddings from the library (and every conversation)."""
     success = await rag_service.delete_document(db, document_id)
     
     if not success:
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from services.image_store import image_store
+
+router = APIRouter()
+
+
+@router.get("/{image_hash}")
+async def get_image(
+    image_hash: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """Serve a stored message image. Content-addressed, so it can be cached forever."""
+    image = await image_store.get(db, image_hash)
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    return Response(
+        content=image.data,
+        media_type=image.mime_type,
+        headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": f'"{image.id}"'
+        }
+    )
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
 from services.ollama_service import ollama_service
+from services.ollama_pool import ollama_pool
+from services.token_calibration import token_calibration
 
 router = APIRouter()
 
@@ -11,6 +13,21 @@ async def get_models():
     return {"models": models}
 
 
+@router.get("/token_calibration")
+async def get_token_calibration():
+    """
+    Per-model token count calibration: the factor applied to tokenizer estimates, and the
+    mean absolute error of raw and calibrated estimates against Ollama's prompt_eval_count.
+    """
+    return {"models": token_calibration.metrics()}
+
+
+@router.get("/backends")
+async def get_backends():
+    """Ollama backend pool: health, requests in flight, and installed and loaded models per server."""
+    return {"backends": ollama_pool.status()}
+
+
 @router.get("/{model_name}/check")
 async def check_model(model_name: str):
     """Check if a specific model is available."""
@@ -0,0 +1,220 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+import orjson
+import zstandard
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, insert, delete, exists, func, text
+from database import async_session_maker
+from models import Conversation, Message, MessageArchive
+from services import text_search
+from config import settings, TEXT_SEARCH_CONFIG
+
+# Columns carried through the archive; everything needed to restore a message row as it was
+ARCHIVED_COLUMNS = (
+    Message.id, Message.seq, Message.role, Message.content, Message.model_used,
+    Message.status, Message.version, Message.prompt_tokens, Message.completion_tokens,
+    Message.estimated_prompt_tokens, Message.timestamp
+)
+
+
+class ArchiveService:
+    """
+    Move idle conversations' messages out of the hot messages table into compressed
+    archive rows. Reads decode the archive in place; the messages move back to the hot
+    table when the conversation is written to again.
+
+    conversations.archived_at means "an archive blob exists to merge back", not "the hot
+    table is empty": a message written while a conversation is being archived simply
+    stays hot, and its seq never collides with the archived ones.
+    """
+    
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+    
+    async def rehydrate(self, db: AsyncSession, conversation_id: str) -> bool:
+        """
+        Restore an archived conversation's messages into the hot table (committing), or do
+        nothing if it is not archived. Returns whether messages were restored.
+        """
+        # Claiming the flag takes the conversation row lock, so concurrent openers wait here
+        # and then find nothing left to do
+        claimed = await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, Conversation.archived_at.is_not(None))
+            .values(archived_at=None, updated_at=Conversation.updated_at)
+            .returning(Conversation.id)
+        )
+        if claimed.first() is None:
+            return False
+        
+        restored = 0
+        result = await db.execute(
+            delete(MessageArchive)
+            .where(MessageArchive.conversation_id == conversation_id)
+            .returning(MessageArchive.data)
+        )
+        data = result.scalar()
+        if data is not None:
+            rows = self._decode(data, conversation_id)
+            if rows:
+                await db.execute(insert(Message), rows)
+            restored = len(rows)
+        
+        await db.commit()
+        print(f"Rehydrated {restored} messages of conversation {conversation_id}")
+        return True
+    
+    async def archived_messages(self, db: AsyncSession, conversation_id: str) -> List[dict]:
+        """
+        An archived conversation's messages decoded from its archive row, in seq order,
+        without restoring them (read paths stay read-only; only writes rehydrate).
+        Empty when nothing is archived. Messages written since archiving are still hot.
+        """
+        result = await db.execute(
+            select(MessageArchive.data).where(MessageArchive.conversation_id == conversation_id)
+        )
+        data = result.scalar()
+        return self._decode(data, conversation_id) if data is not None else []
+    
+    def _decode(self, data: bytes, conversation_id: str) -> List[dict]:
+        """Message row dicts from an archive blob."""
+        rows = orjson.loads(zstandard.ZstdDecompressor().decompress(data))
+        for row in rows:
+            # Archives written before a column existed lack its key
+            for column in ARCHIVED_COLUMNS:
+                row.setdefault(column.key, None)
+            row["conversation_id"] = conversation_id
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"]) if row["timestamp"] else None
+        return rows
+    
+    def _idle(self, cutoff: datetime):
+        """Conditions for a conversation that can be archived: untouched since cutoff, with settled messages."""
+        return (
+            Conversation.archived_at.is_(None),
+            Conversation.updated_at < cutoff,
+            exists().where(Message.conversation_id == Conversation.id),
+            ~exists().where(Message.conversation_id == Conversation.id, Message.status == "streaming")
+        )
+    
+    async def archive_conversation(
+        self,
+        db: AsyncSession,
+        conversation_id: str,
+        cutoff: datetime
+    ) -> Tuple[int, int, int]:
+        """
+        Archive one conversation if it is still idle (committing).
+        Returns (messages archived, raw bytes, compressed bytes).
+        """
+        # Re-check idleness under the row lock; replies still streaming keep a conversation hot
+        claimed = await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, *self._idle(cutoff))
+            .values(archived_at=func.now(), updated_at=Conversation.updated_at)
+            .returning(Conversation.id)
+        )
+        if claimed.first() is None:
+            await db.rollback()
+            return 0, 0, 0
+        
+        result = await db.execute(
+            select(*ARCHIVED_COLUMNS)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.seq)
+        )
+        rows = [row._asdict() for row in result.all()]
+        
+        raw = orjson.dumps(rows)
+        data = zstandard.ZstdCompressor(level=settings.archive_compression_level).compress(raw)
+        
+        # Archived text stays searchable at conversation level: lexemes only, positions stripped
+        search_vector = await db.execute(
+            text(f"""
+                SELECT strip(to_tsvector('{TEXT_SEARCH_CONFIG}'::regconfig,
+                                         string_agg({text_search.searchable_text_sql("content")}, ' ')))
+                FROM messages
+                WHERE conversation_id = :conversation_id
+            """),
+            {"conversation_id": conversation_id}
+        )
+        
+        await db.execute(
+            insert(MessageArchive).values(
+                conversation_id=conversation_id,
+                data=data,
+                message_count=len(rows),
+                raw_bytes=len(raw),
+                compressed_bytes=len(data),
+                search_vector=search_vector.scalar()
+            )
+        )
+        await db.execute(delete(Message).where(Message.conversation_id == conversation_id))
+        await db.commit()
+        return len(rows), len(raw), len(data)
+    
+    async def archive_idle(self) -> Tuple[int, int, int, int]:
+        """
+        Archive up to one batch of conversations idle for archive_after_days.
+        Returns (conversations, messages, raw bytes, compressed bytes).
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=settings.archive_after_days)
+        
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(Conversation.id)
+                .where(*self._idle(cutoff))
+                .order_by(Conversation.updated_at)
+                .limit(settings.archive_batch_size)
+            )
+            candidates = result.scalars().all()
+            await db.rollback()
+            
+            conversations = messages = raw_bytes = compressed_bytes = 0
+            for conversation_id in candidates:
+                try:
+                    count, raw, compressed = await self.archive_conversation(db, conversation_id, cutoff)
+                except Exception as e:
+                    print(f"Error archiving conversation {conversation_id}: {e}")
+                    await db.rollback()
+                    continue
+                if count:
+                    conversations += 1
+                    messages += count
+                    raw_bytes += raw
+                    compressed_bytes += compressed
+        
+        if conversations:
+            print(
+                f"Archived {conversations} idle conversations ({messages} messages, "
+                f"{raw_bytes} bytes compressed to {compressed_bytes})"
+            )
+        return conversations, messages, raw_bytes, compressed_bytes
+    
+    async def _run(self):
+        while True:
+            try:
+                # Keep going while full batches come back, then wait for the next round
+                while (await self.archive_idle())[0] >= settings.archive_batch_size:
+                    pass
+            except Exception as e:
+                print(f"Error in archive job: {e}")
+            await asyncio.sleep(settings.archive_interval_seconds)
+    
+    def start(self):
+        """Start the periodic archive job (no-op when archiving is disabled)."""
+        if settings.archive_after_days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance
+archive_service = ArchiveService()
@@ -0,0 +1,213 @@
+import base64
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import orjson
+import zstandard
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, cast, text, Text
+from database import async_session_maker
+from models import (
+    Conversation, Message, MessageArchive, ConversationSummary, ImageBlob,
+    Document, DocumentChunk, ConversationDocument
+)
+
+FORMAT_NAME = "mychatgpt-ndjson"
+FORMAT_VERSION = 1
+BATCH_ROWS = 1000  # Rows per cursor fetch on export and per COPY batch on import
+
+# Record type -> (model, {column: staging type}), in an order that satisfies foreign keys.
+# Embeddings travel as pgvector text ('[0.1,...]') and are cast back on insert.
+RECORD_TYPES: Dict[str, Tuple[type, Dict[str, str]]] = {
+    "conversation": (Conversation, {
+        "id": "text", "title": "text", "last_seq": "integer", "version": "integer",
+        "title_version": "integer", "created_at": "timestamptz", "updated_at": "timestamptz"
+    }),
+    "message": (Message, {
+        "id": "text", "conversation_id": "text", "seq": "integer", "role": "text", "content": "text",
+        "model_used": "text", "status": "text", "version": "integer", "prompt_tokens": "integer",
+        "completion_tokens": "integer", "estimated_prompt_tokens": "integer", "timestamp": "timestamptz"
+    }),
+    "summary": (ConversationSummary, {
+        "id": "text", "conversation_id": "text", "summary_text": "text", "messages_summarized": "integer",
+        "summarized_through_seq": "integer", "version": "integer", "created_at": "timestamptz"
+    }),
+    "image": (ImageBlob, {
+        "id": "text", "mime_type": "text", "data": "bytea", "size": "integer", "created_at": "timestamptz"
+    }),
+    "document": (Document, {
+        "id": "text", "filename": "text", "file_type": "text", "content": "text", "content_hash": "text",
+        "embedding_model": "text", "chunker_version": "integer", "uploaded_at": "timestamptz"
+    }),
+    "chunk": (DocumentChunk, {
+        "id": "text", "document_id": "text", "chunk_text": "text", "chunk_index": "integer", "embedding": "vector"
+    }),
+    "attachment": (ConversationDocument, {
+        "conversation_id": "text", "document_id": "text", "filename": "text", "attached_at": "timestamptz"
+    }),
+}
+DOCUMENT_TYPES = ("document", "chunk", "attachment")
+
+
+class BackupService:
+    """Streaming NDJSON export and import of conversations (and optionally the document library)."""
+    
+    def _record(self, record_type: str, row: dict) -> bytes:
+        columns = RECORD_TYPES[record_type][1]
+        data = {}
+        for name, kind in columns.items():
+            value = row.get(name)
+            if kind == "bytea" and value is not None:
+                value = base64.b64encode(value).decode("ascii")
+            data[name] = value
+        return orjson.dumps({"type": record_type, "data": data}) + b"\n"
+    
+    async def export_lines(self, include_documents: bool = False) -> AsyncIterator[bytes]:
+        """
+        Yield the export as NDJSON lines: a header, every record, then an end record with counts.
+        Reads one consistent snapshot through server-side cursors, so memory use does not
+        grow with the size of the database. Archived messages are exported as plain messages.
+        """
+        counts = {}
+        yield orjson.dumps({
+            "type": "header", "format": FORMAT_NAME, "version": FORMAT_VERSION,
+            "include_documents": include_documents
+        }) + b"\n"
+        
+        async with async_session_maker() as db:
+            await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            
+            for record_type, (model, columns) in RECORD_TYPES.items():
+                if record_type in DOCUMENT_TYPES and not include_documents:
+                    continue
+                
+                selected = [
+                    cast(model.__table__.c[name], Text).label(name) if kind == "vector" else model.__table__.c[name]
+                    for name, kind in columns.items()
+                ]
+                rows = await db.stream(select(*selected).execution_options(yield_per=BATCH_ROWS))
+                count = 0
+                async for row in rows:
+                    yield self._record(record_type, row._asdict())
+                    count += 1
+                
+                if record_type == "message":
+                    async for line in self._archived_messages(db):
+                        yield line
+                        count += 1
+                counts[record_type] = count
+        
+        yield orjson.dumps({"type": "end", "counts": counts}) + b"\n"
+    
+    async def _archived_messages(self, db: AsyncSession) -> AsyncIterator[bytes]:
+        """Message records from cold storage, one archived conversation at a time."""
+        decompressor = zstandard.ZstdDecompressor()
+        archives = await db.stream(
+            select(MessageArchive.conversation_id, MessageArchive.data).execution_options(yield_per=1)
+        )
+        async for archive in archives:
+            for row in orjson.loads(decompressor.decompress(archive.data)):
+                row["conversation_id"] = archive.conversation_id
+                yield self._record("message", row)
+    
+    def _staging_value(self, kind: str, value):
+        if value is None:
+            return None
+        if kind == "timestamptz":
+            return datetime.fromisoformat(value)
+        if kind == "bytea":
+            return base64.b64decode(value)
+        return value
+    
+    async def _flush(self, db: AsyncSession, record_type: str, batch: List[dict]) -> int:
+        """COPY a batch into a temporary staging table, then insert it, skipping rows that already exist."""
+        model, columns = RECORD_TYPES[record_type]
+        table = model.__tablename__
+        staging = f"import_{table}"
+        names = list(columns)
+        
+        # Staging columns use plain types the COPY binary codecs know; embeddings are staged as text
+        definitions = ", ".join(
+            f"{name} {'text' if kind == 'vector' else kind}" for name, kind in columns.items()
+        )
+        # Statements go through the session so COPY runs inside its transaction
+        await db.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {staging} ({definitions}) ON COMMIT DELETE ROWS"))
+        connection = await db.connection()
+        raw = (await connection.get_raw_connection()).driver_connection
+        await raw.copy_records_to_table(
+            staging,
+            records=[tuple(self._staging_value(columns[name], row.get(name)) for name in names) for row in batch],
+            columns=names
+        )
+        
+        selected = ", ".join(f"{name}::vector" if columns[name] == "vector" else name for name in names)
+        result = await db.execute(text(
+            f"INSERT INTO {table} ({', '.join(names)}) SELECT {selected} FROM {staging} ON CONFLICT DO NOTHING"
+        ))
+        await db.commit()
+        return result.rowcount
+    
+    async def import_lines(self, db: AsyncSession, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        Import an NDJSON export read incrementally from `chunks`, committing every batch.
+        Rows whose keys already exist are skipped, so an interrupted import can simply be rerun.
+        Returns per-type counts of read and inserted rows and whether the end record was seen.
+        """
+        read: Dict[str, int] = {}
+        inserted: Dict[str, int] = {}
+        complete = False
+        header_seen = False
+        batch_type: Optional[str] = None
+        batch: List[dict] = []
+        pending = b""
+        line_number = 0
+        
+        async def lines() -> AsyncIterator[bytes]:
+            nonlocal pending
+            async for chunk in chunks:
+                pending += chunk
+                *complete_lines, pending = pending.split(b"\n")
+                for line in complete_lines:
+                    yield line
+            if pending:
+                yield pending
+        
+        async for line in lines():
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = orjson.loads(line)
+                record_type = record["type"]
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                raise ValueError(f"Line {line_number}: not an export record")
+            
+            if not header_seen:
+                if record_type != "header" or record.get("format") != FORMAT_NAME:
+                    raise ValueError("Not a conversation export (missing header)")
+                if record.get("version") != FORMAT_VERSION:
+                    raise ValueError(f"Unsupported export format version {record.get('version')}")
+                header_seen = True
+                continue
+            if record_type == "end":
+                complete = True
+                break
+            if record_type not in RECORD_TYPES:
+                raise ValueError(f"Line {line_number}: unknown record type '{record_type}'")
+            
+            # Records arrive grouped by type in foreign-key order; flush whenever the type changes
+            if batch and (record_type != batch_type or len(batch) >= BATCH_ROWS):
+                inserted[batch_type] = inserted.get(batch_type, 0) + await self._flush(db, batch_type, batch)
+                batch = []
+            batch_type = record_type
+            batch.append(record["data"])
+            read[record_type] = read.get(record_type, 0) + 1
+        
+        if batch:
+            inserted[batch_type] = inserted.get(batch_type, 0) + await self._flush(db, batch_type, batch)
+        
+        print(f"Imported {sum(inserted.values())} of {sum(read.values())} records (complete: {complete})")
+        return {"read": read, "inserted": inserted, "complete": complete}
+
+
+# Singleton instance
+backup_service = BackupService()
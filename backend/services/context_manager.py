@@ -1,84 +1,202 @@
-from typing import List, Dict, Tuple
-import re
+from typing import List, Dict, Optional, Tuple
+import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, delete, desc, func
+from database import async_session_maker
 from models import Message, ConversationSummary
 from services.ollama_service import ollama_service
+from services.image_store import image_store
+from services.message_sequence import bump_version
 from config import settings, MODEL_CONFIGS, SUMMARY_TRIGGER_PERCENTAGE, SUMMARY_COMPRESSION_RATIO
 
 
 class ContextManager:
     """Manage conversation context with intelligent summarization."""
     
+    def __init__(self):
+        # Per-conversation locks so a thread is never summarized twice at once
+        self._summary_locks: Dict[str, asyncio.Lock] = {}
+        self._summary_lock_users: Dict[str, int] = {}
+    
     def _strip_images(self, content: str) -> str:
-        """Remove base64 images from content to save tokens."""
-        if not content:
-            return ""
-        return re.sub(r'!\[.*?\]\(data:image\/.*?;base64,.*?\)', '[Image]', content)
+        """Remove images from content to save tokens."""
+        return image_store.strip_images(content)
     
     async def get_context_messages(
         self,
         db: AsyncSession,
         conversation_id: str,
         model: str
-    ) -> Tuple[List[dict], bool]:
+    ) -> Tuple[List[dict], bool, Optional[dict]]:
         """
-        Get messages for context, with summarization if needed.
-        Returns (messages, was_summarized)
+        Read the messages for context in the caller's session (no model calls).
+        Returns (messages, was_summarized, summary job). A summary job means the history is
+        over budget: pass it to summarize() once the session is closed, which returns the
+        final (messages, was_summarized).
         """
         # Get model's context window
         context_window = MODEL_CONFIGS.get(model, {}).get('context_window', settings.default_context_window)
         max_tokens = int(context_window * SUMMARY_TRIGGER_PERCENTAGE)
         
-        # Get all messages
+        # Fast path: the latest summary plus only the messages after its watermark
+        latest_summary = await self._latest_summary(db, conversation_id)
+        if latest_summary:
+            recent_dicts, _ = await self._load_messages(
+                db, conversation_id, after_seq=latest_summary.summarized_through_seq
+            )
+            summarized = [self._summary_message(latest_summary.summary_text)] + recent_dicts
+            if ollama_service.count_messages_tokens(summarized, model) <= max_tokens:
+                return summarized, True, None
+        
+        message_dicts, seqs = await self._load_messages(db, conversation_id)
+        
+        if not message_dicts:
+            return [], False, None
+        
+        # Count tokens (calibrated to the model's tokenizer)
+        total_tokens = ollama_service.count_messages_tokens(message_dicts, model)
+        
+        # If within limits, return as is
+        if total_tokens <= max_tokens:
+            return message_dicts, False, None
+        
+        # Need to summarize
+        return message_dicts, False, {"messages": message_dicts, "seqs": seqs, "max_tokens": max_tokens}
+    
+    async def summarize(
+        self,
+        conversation_id: str,
+        job: dict,
+        model: str
+    ) -> Tuple[List[dict], bool]:
+        """
+        Run a summary job from get_context_messages. Holds no database connection while the
+        model writes the summary; the summary is stored in a short session of its own.
+        Returns (messages, was_summarized). When the model call fails nothing is stored and
+        the unsummarized messages come back; packing drops the oldest of them to fit.
+        """
+        try:
+            summarized_messages = await self._summarize_and_compress(
+                conversation_id, job["messages"], job["seqs"], job["max_tokens"], model
+            )
+        except Exception as e:
+            print(f"Error summarizing conversation {conversation_id}, continuing without a summary: {e}")
+            return job["messages"], False
+        return summarized_messages, True
+    
+    async def _load_messages(
+        self,
+        db: AsyncSession,
+        conversation_id: str,
+        after_seq: int = 0
+    ) -> Tuple[List[dict], List[int]]:
+        """
+        Load finished messages after a seq watermark (replies still streaming are not context yet).
+        Returns (message dicts with images stripped, their seqs).
+        """
         result = await db.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation_id)
-            .order_by(Message.timestamp)
+            select(Message.role, Message.content, Message.seq)
+            .where(
+                Message.conversation_id == conversation_id,
+                Message.seq > after_seq,
+                Message.status != "streaming"
+            )
+            .order_by(Message.seq)
         )
-        messages = result.scalars().all()
-        
-        if not messages:
-            return [], False
+        messages = result.all()
         
         # Convert to dict format and strip images to save tokens
         message_dicts = [
             {"role": msg.role, "content": self._strip_images(msg.content)}
             for msg in messages
         ]
+        return message_dicts, [msg.seq for msg in messages]
+    
+    async def _latest_summary(
+        self,
+        db: AsyncSession,
+        conversation_id: str
+    ) -> Optional[ConversationSummary]:
+        """Get the newest summary of a conversation."""
+        result = await db.execute(
+            select(ConversationSummary)
+            .where(ConversationSummary.conversation_id == conversation_id)
+            .order_by(desc(ConversationSummary.created_at))
+            .limit(1)
+        )
+        return result.scalars().first()
+    
+    async def compact_summaries(
+        self,
+        db: AsyncSession,
+        conversation_id: Optional[str] = None
+    ) -> Tuple[int, int]:
+        """
+        Delete every summary except the newest per conversation (or just for one conversation).
+        The caller commits. Returns (rows deleted, summary text bytes reclaimed).
+        """
+        ranked = select(
+            ConversationSummary.id,
+            func.row_number().over(
+                partition_by=ConversationSummary.conversation_id,
+                order_by=(desc(ConversationSummary.created_at), desc(ConversationSummary.summarized_through_seq))
+            ).label("rank")
+        )
+        if conversation_id:
+            ranked = ranked.where(ConversationSummary.conversation_id == conversation_id)
+        ranked = ranked.subquery()
         
-        # Count tokens
-        total_tokens = ollama_service.count_messages_tokens(message_dicts)
-        
-        # If within limits, return as is
-        if total_tokens <= max_tokens:
-            return message_dicts, False
-        
-        # Need to summarize
-        summarized_messages = await self._summarize_and_compress(
-            db, conversation_id, message_dicts, max_tokens, model
+        result = await db.execute(
+            delete(ConversationSummary)
+            .where(ConversationSummary.id.in_(select(ranked.c.id).where(ranked.c.rank > 1)))
+            .returning(func.octet_length(ConversationSummary.summary_text))
         )
+        reclaimed = result.scalars().all()
         
-        return summarized_messages, True
+        rows, size = len(reclaimed), sum(reclaimed)
+        if rows:
+            print(f"Compacted {rows} superseded summaries ({size} bytes)")
+        return rows, size
+    
+    def _summary_message(self, summary_text: str) -> dict:
+        return {"role": "system", "content": f"Previous conversation summary:\n{summary_text}"}
     
     async def _summarize_and_compress(
         self,
-        db: AsyncSession,
         conversation_id: str,
         messages: List[dict],
+        seqs: List[int],
         max_tokens: int,
         model: str
     ) -> List[dict]:
         """Summarize older messages and keep recent ones."""
+        lock = self._summary_locks.setdefault(conversation_id, asyncio.Lock())
+        self._summary_lock_users[conversation_id] = self._summary_lock_users.get(conversation_id, 0) + 1
+        try:
+            async with lock:
+                return await self._summarize_locked(
+                    conversation_id, messages, seqs, max_tokens, model
+                )
+        finally:
+            # Drop the lock once nobody holds or waits on it
+            self._summary_lock_users[conversation_id] -= 1
+            if self._summary_lock_users[conversation_id] == 0:
+                del self._summary_lock_users[conversation_id]
+                del self._summary_locks[conversation_id]
+    
+    async def _summarize_locked(
+        self,
+        conversation_id: str,
+        messages: List[dict],
+        seqs: List[int],
+        max_tokens: int,
+        model: str
+    ) -> List[dict]:
+        """Summarize while holding the conversation's summarization lock."""
         
-        # Check if we have existing summaries
-        result = await db.execute(
-            select(ConversationSummary)
-            .where(ConversationSummary.conversation_id == conversation_id)
-            .order_by(desc(ConversationSummary.created_at))
-            .limit(1)
-        )
-        existing_summary = result.scalars().first()
+        # Check if we have existing summaries (a concurrent turn may have just written one)
+        async with async_session_maker() as db:
+            existing_summary = await self._latest_summary(db, conversation_id)
         
         # Calculate how many messages to keep unsummarized
         target_tokens = int(max_tokens * SUMMARY_COMPRESSION_RATIO)
@@ -88,7 +206,7 @@ class ContextManager:
         keep_count = 0
         
         for i in range(len(messages) - 1, -1, -1):
-            msg_tokens = ollama_service.count_tokens(messages[i]['content'])
+            msg_tokens = ollama_service.count_tokens(messages[i]['content'], model)
             if recent_tokens + msg_tokens > target_tokens:
                 break
             recent_tokens += msg_tokens
@@ -99,27 +217,37 @@ class ContextManager:
         
         messages_to_summarize = messages[:-keep_count] if keep_count > 0 else messages
         recent_messages = messages[-keep_count:] if keep_count > 0 else []
+        summarize_through_seq = seqs[len(messages_to_summarize) - 1] if messages_to_summarize else 0
         
-        # If we already summarized these messages, use existing summary
-        if existing_summary and existing_summary.messages_summarized >= len(messages_to_summarize):
+        # If we already summarized these messages, use existing summary with what came after it
+        if existing_summary and existing_summary.summarized_through_seq >= summarize_through_seq:
             summary_text = existing_summary.summary_text
+            recent_messages = [
+                msg for msg, seq in zip(messages, seqs)
+                if seq > existing_summary.summarized_through_seq
+            ]
         else:
             # Create new summary
             summary_text = await self._create_summary(messages_to_summarize, model)
             
             # Store summary
-            new_summary = ConversationSummary(
-                conversation_id=conversation_id,
-                summary_text=summary_text,
-                messages_summarized=len(messages_to_summarize)
-            )
-            db.add(new_summary)
-            await db.commit()
+            async with async_session_maker() as db:
+                new_summary = ConversationSummary(
+                    conversation_id=conversation_id,
+                    version=await bump_version(db, conversation_id),
+                    summary_text=summary_text,
+                    messages_summarized=len(messages_to_summarize),
+                    summarized_through_seq=summarize_through_seq
+                )
+                db.add(new_summary)
+                await db.flush()
+                
+                # Only the newest summary is ever read; drop the ones it supersedes in the same transaction
+                await self.compact_summaries(db, conversation_id)
+                await db.commit()
         
         # Combine summary with recent messages
-        result_messages = [
-            {"role": "system", "content": f"Previous conversation summary:\n{summary_text}"}
-        ]
+        result_messages = [self._summary_message(summary_text)]
         result_messages.extend(recent_messages)
         
         return result_messages
@@ -129,13 +257,7 @@ class ContextManager:
         if not messages:
             return "No previous conversation."
         
-        # Create prompt for summarization
-        conversation_text = "\n".join([
-            f"{msg['role'].upper()}: {msg['content']}"
-            for msg in messages
-        ])
-        
-        summarization_prompt = [
+        instructions = [
             {
                 "role": "system",
                 "content": "You are a helpful assistant that creates concise summaries of conversations. "
@@ -143,10 +265,30 @@ class ContextManager:
             },
             {
                 "role": "user",
-                "content": f"Please summarize the following conversation concisely:\n\n{conversation_text}"
+                "content": "Please summarize the following conversation concisely:\n\n"
             }
         ]
         
+        # Create prompt for summarization, fitted to the model: the oldest messages are left
+        # out first, and a single message that is too long on its own is cut
+        budget = ollama_service.prompt_budget(model) - ollama_service.count_messages_tokens(instructions, model)
+        lines = []
+        for msg in reversed(messages):
+            line = f"{msg['role'].upper()}: {msg['content']}"
+            tokens = ollama_service.count_tokens(line + "\n", model)
+            if tokens > budget:
+                if not lines:
+                    lines.append(ollama_service.truncate_tokens(line, budget, model))
+                break
+            lines.append(line)
+            budget -= tokens
+        conversation_text = "\n".join(reversed(lines))
+        
+        summarization_prompt = [
+            instructions[0],
+            {"role": "user", "content": instructions[1]["content"] + conversation_text}
+        ]
+        
         summary = await ollama_service.chat(model, summarization_prompt, temperature=0.3)
         return summary
     
@@ -162,18 +304,21 @@ class ContextManager:
         
         # Get all messages
         result = await db.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation_id)
-            .order_by(Message.timestamp)
+            select(Message.role, Message.content)
+            .where(
+                Message.conversation_id == conversation_id,
+                Message.status != "streaming"
+            )
+            .order_by(Message.seq)
         )
-        messages = result.scalars().all()
+        messages = result.all()
         
         message_dicts = [
             {"role": msg.role, "content": msg.content}
             for msg in messages
         ]
         
-        total_tokens = ollama_service.count_messages_tokens(message_dicts)
+        total_tokens = ollama_service.count_messages_tokens(message_dicts, model)
         return total_tokens > max_tokens
 
 
@@ -0,0 +1,180 @@
+from typing import List, Dict, Optional, Tuple, Callable
+from services.ollama_service import ollama_service, PromptTooLongError
+from config import CONTEXT_BUDGET_SHARES, CONTEXT_MIN_TRIM_TOKENS, CONTEXT_ITEM_OVERHEAD
+
+MESSAGE_OVERHEAD = 4  # Same per-message allowance as count_messages_tokens
+
+
+class ContextPacker:
+    """
+    Fit summary, history, retrieved chunks and web results into one token budget.
+    The budget is what ollama_service.prompt_budget leaves (the model's context window minus
+    the reply cap, within what can be sent at all) after the user's query; a query that
+    cannot be sent on its own is refused.
+    Each section gets a share of it; shares a section does not need go to the others.
+    Within a section the lowest-priority items (oldest turns, least similar chunks,
+    lowest-scored web results) are trimmed or dropped first.
+    """
+    
+    def pack(
+        self,
+        model: str,
+        context_messages: List[dict],
+        was_summarized: bool,
+        query: str,
+        chunks: Optional[List[dict]] = None,
+        web_results: Optional[List[Dict]] = None,
+        images: int = 0
+    ) -> Tuple[List[dict], List[dict], List[Dict], dict]:
+        """
+        `images` is the number of images sent with the query, which take prompt tokens too.
+        Returns (context messages, chunks, web results, report) where the report says
+        what each section was allocated, used, kept and dropped.
+        """
+        query_tokens = self.query_tokens(model, query, images)
+        budget = max(ollama_service.prompt_budget(model) - query_tokens, 0)
+        
+        summary, history = [], list(context_messages)
+        if was_summarized and history and history[0]["role"] == "system":
+            summary = [history.pop(0)]
+        
+        sections = {
+            "summary": [self._message_item(m, model, trimmable=True) for m in summary],
+            # Newest first: the oldest turns go first
+            "history": self._turn_items(history, model),
+            "documents": [
+                self._text_item(chunk, chunk["text"], model, key="text")
+                for chunk in sorted(chunks or [], key=lambda c: c["similarity"], reverse=True)
+            ],
+            "web": [self._web_item(result, model) for result in self._rank_web(web_results or [])],
+        }
+        
+        demands = {name: sum(item["tokens"] for item in items) for name, items in sections.items()}
+        allocations = self._allocate(budget, demands)
+        
+        kept = {}
+        report = {"budget": budget, "used": 0}
+        for name, items in sections.items():
+            kept[name], tokens, trimmed = self._take(items, allocations[name], model)
+            report[name] = {
+                "allocated": allocations[name],
+                "tokens": tokens,
+                "kept": self._count(kept[name]),
+                "dropped": self._count(item["payload"] for item in items) - self._count(kept[name]),
+                "trimmed": trimmed
+            }
+            report["used"] += tokens
+        report["documents"]["similarities"] = [round(chunk["similarity"], 4) for chunk in kept["documents"]]
+        report["web"]["sources"] = [result["url"] for result in kept["web"] if result.get("url")]
+        
+        history = [message for turn in reversed(kept["history"]) for message in turn]
+        messages = kept["summary"] + history
+        return messages, kept["documents"], kept["web"], report
+    
+    def query_tokens(self, model: str, query: str, images: int = 0) -> int:
+        """
+        Tokens the user's query and its images take; raises PromptTooLongError when they
+        cannot be sent on their own.
+        """
+        tokens = ollama_service.count_tokens(query, model) + MESSAGE_OVERHEAD
+        tokens += images * ollama_service.image_tokens(model)
+        if tokens > ollama_service.prompt_limit(model):
+            raise PromptTooLongError(
+                f"Message is too long for {model}: about {tokens} tokens, "
+                f"at most {ollama_service.prompt_limit(model)} fit"
+            )
+        return tokens
+    
+    def _allocate(self, budget: int, demands: Dict[str, int]) -> Dict[str, int]:
+        """Split the budget by share, handing what a section does not need to the rest."""
+        allocations = {name: 0 for name in demands}
+        pending = {name for name, demand in demands.items() if demand > 0}
+        remaining = budget
+        while pending and remaining > 0:
+            total_share = sum(CONTEXT_BUDGET_SHARES[name] for name in pending)
+            fair = {name: int(remaining * CONTEXT_BUDGET_SHARES[name] / total_share) for name in pending}
+            satisfied = {name for name in pending if demands[name] <= fair[name]}
+            if not satisfied:
+                allocations.update(fair)
+                break
+            for name in satisfied:
+                allocations[name] = demands[name]
+                remaining -= demands[name]
+            pending -= satisfied
+        return allocations
+    
+    def _take(self, items: List[dict], allocation: int, model: str) -> Tuple[list, int, int]:
+        """
+        Keep items in priority order while they fit; the first one that does not is trimmed
+        into what is left (when it can be and enough is left) and everything after it dropped.
+        Returns (kept payloads, tokens used, number of items trimmed).
+        """
+        kept, used = [], 0
+        for item in items:
+            if used + item["tokens"] <= allocation:
+                kept.append(item["payload"])
+                used += item["tokens"]
+                continue
+            room = allocation - used - item["fixed"]
+            if item["trim"] and room >= CONTEXT_MIN_TRIM_TOKENS:
+                kept.append(item["trim"](room))
+                used = allocation
+                return kept, used, 1
+            break
+        return kept, used, 0
+    
+    def _item(self, payload, tokens: int, fixed: int, trim: Optional[Callable]) -> dict:
+        return {"payload": payload, "tokens": tokens, "fixed": fixed, "trim": trim}
+    
+    def _message_item(self, message: dict, model: str, trimmable: bool = False) -> dict:
+        trim = (
+            lambda room: {**message, "content": ollama_service.truncate_tokens(message["content"], room, model)}
+        ) if trimmable else None
+        tokens = ollama_service.count_tokens(message["content"], model) + MESSAGE_OVERHEAD
+        return self._item(message, tokens, MESSAGE_OVERHEAD, trim)
+    
+    def _turn_items(self, history: List[dict], model: str) -> List[dict]:
+        """
+        Group history into turns (a user message and the replies after it), newest first.
+        Turns are kept or dropped whole, so trimming never leaves a reply without the
+        message it answers at the start of the history.
+        """
+        turns = []
+        for message in history:
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return [
+            self._item(turn, sum(self._message_item(m, model)["tokens"] for m in turn), 0, None)
+            for turn in reversed(turns)
+        ]
+    
+    def _count(self, payloads) -> int:
+        """Messages or items in a section; a history turn counts its messages."""
+        return sum(len(p) if isinstance(p, list) else 1 for p in payloads)
+    
+    def _text_item(self, payload: dict, text: str, model: str, key: str, fixed: int = 0) -> dict:
+        """An item whose `key` field is trimmed to fit; `fixed` tokens (title, source) are not."""
+        def trim(room: int) -> dict:
+            return {**payload, key: ollama_service.truncate_tokens(text, room, model)}
+        fixed += CONTEXT_ITEM_OVERHEAD
+        return self._item(payload, ollama_service.count_tokens(text, model) + fixed, fixed, trim)
+    
+    def _web_item(self, result: Dict, model: str) -> dict:
+        if result.get("error"):
+            # Keep the error visible to the model rather than trimming it
+            tokens = ollama_service.count_tokens(result["error"], model) + CONTEXT_ITEM_OVERHEAD
+            return self._item(result, tokens, tokens, None)
+        fixed = ollama_service.count_tokens(f"{result.get('title', '')} {result.get('url', '')}", model)
+        return self._text_item(result, result.get("content", ""), model, key="content", fixed=fixed)
+    
+    def _rank_web(self, results: List[Dict]) -> List[Dict]:
+        """Errors and the search answer first, then results by score."""
+        return sorted(
+            results,
+            key=lambda r: (r.get("type") == "result", -(r.get("score") or 0))
+        )
+
+
+# Singleton instance
+context_packer = ContextPacker()
@@ -0,0 +1,92 @@
+import asyncio
+import base64
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from PIL import Image, ImageOps
+from config import settings, MODEL_CONFIGS, IMAGE_MAX_SIZE, IMAGE_QUALITY
+
+
+def _downscale(data: bytes, max_size: int, quality: int) -> bytes:
+    """Resize an image to fit max_size and recompress it as JPEG."""
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder skip resolution we are about to throw away
+    image.draft("RGB", (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+    
+    resized = max(image.size) > max_size
+    if resized:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    processed = output.getvalue()
+    
+    # Small images that already fit may be smaller as they were
+    if not resized and len(processed) >= len(data):
+        return data
+    return processed
+
+
+class ImageProcessor:
+    """Downscale and recompress images for vision models in a worker pool."""
+    
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.image_worker_threads,
+            thread_name_prefix="image-preprocess"
+        )
+        # LRU of processed base64 payloads keyed by (content hash, max size, quality)
+        self._cache: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+    
+    def _limits(self, model: str) -> Tuple[int, int]:
+        config = MODEL_CONFIGS.get(model, {})
+        return (
+            config.get("image_max_size", IMAGE_MAX_SIZE),
+            config.get("image_quality", IMAGE_QUALITY)
+        )
+    
+    async def prepare_for_model(
+        self,
+        model: str,
+        images: List[Tuple[str, bytes]]
+    ) -> List[str]:
+        """Turn (content hash, bytes) pairs into base64 payloads sized for the model."""
+        max_size, quality = self._limits(model)
+        return list(await asyncio.gather(*[
+            self._prepare(image_hash, data, max_size, quality)
+            for image_hash, data in images
+        ]))
+    
+    async def _prepare(self, image_hash: str, data: bytes, max_size: int, quality: int) -> str:
+        key = (image_hash, max_size, quality)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        
+        loop = asyncio.get_running_loop()
+        try:
+            processed = await loop.run_in_executor(self._executor, _downscale, data, max_size, quality)
+        except Exception as e:
+            print(f"Error preprocessing image {image_hash}: {e}")
+            processed = data
+        
+        payload = base64.b64encode(processed).decode("ascii")
+        self._cache[key] = payload
+        while len(self._cache) > settings.image_cache_entries:
+            self._cache.popitem(last=False)
+        return payload
+
+
+# Singleton instance
+image_processor = ImageProcessor()
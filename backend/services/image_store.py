@@ -0,0 +1,81 @@
+import base64
+import binascii
+import hashlib
+import re
+from typing import List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import ImageBlob
+
+# Inline images as pasted by the client. Character classes instead of
+# non-greedy wildcards keep matching linear in the size of the payload.
+INLINE_IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\(data:(image/[\w.+-]+);base64,([A-Za-z0-9+/=\s]+)\)')
+
+# Stored references to out-of-line images
+IMAGE_REF_PREFIX = "/api/images/"
+IMAGE_REF_PATTERN = re.compile(r'!\[([^\]]*)\]\(' + re.escape(IMAGE_REF_PREFIX) + r'([0-9a-f]{64})\)')
+
+
+class ImageStore:
+    """Content-addressed store for message images, deduplicated by SHA-256."""
+    
+    async def externalize(
+        self,
+        db: AsyncSession,
+        content: str
+    ) -> Tuple[str, List[Tuple[str, bytes]]]:
+        """
+        Move inline base64 images into the blob store and replace them with references.
+        Returns (content with references, (hash, bytes) of the images in order).
+        """
+        if "data:image/" not in content:
+            return content, []
+        
+        images = []
+        blobs = {}
+        
+        def replace(match: re.Match) -> str:
+            alt_text, mime_type, payload = match.groups()
+            try:
+                data = base64.b64decode(payload, validate=False)
+            except (binascii.Error, ValueError):
+                return match.group(0)
+            image_hash = hashlib.sha256(data).hexdigest()
+            blobs[image_hash] = (mime_type, data)
+            images.append((image_hash, data))
+            return f"![{alt_text}]({IMAGE_REF_PREFIX}{image_hash})"
+        
+        stored_content = INLINE_IMAGE_PATTERN.sub(replace, content)
+        
+        for image_hash, (mime_type, data) in blobs.items():
+            await db.execute(
+                pg_insert(ImageBlob)
+                .values(id=image_hash, mime_type=mime_type, data=data, size=len(data))
+                .on_conflict_do_nothing()
+            )
+        
+        return stored_content, images
+    
+    async def get(
+        self,
+        db: AsyncSession,
+        image_hash: str
+    ) -> Optional[ImageBlob]:
+        """Get a stored image by hash."""
+        result = await db.execute(select(ImageBlob).where(ImageBlob.id == image_hash))
+        return result.scalars().first()
+    
+    def strip_images(self, content: str) -> str:
+        """Replace image references (and legacy inline images) with a placeholder."""
+        if not content:
+            return ""
+        if IMAGE_REF_PREFIX in content:
+            content = IMAGE_REF_PATTERN.sub('[Image]', content)
+        if "data:image/" in content:
+            content = INLINE_IMAGE_PATTERN.sub('[Image]', content)
+        return content
+
+
+# Singleton instance
+image_store = ImageStore()
@@ -0,0 +1,36 @@
+from typing import Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
+from models import Conversation
+
+
+async def allocate_seq(db: AsyncSession, conversation_id: str, count: int = 1) -> Tuple[int, int]:
+    """
+    Reserve `count` consecutive message sequence numbers in a conversation and bump its version.
+    Returns (first seq, new conversation version). The counter row stays locked until the
+    caller's transaction ends, so concurrent writers to one conversation never collide.
+    """
+    result = await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(last_seq=Conversation.last_seq + count, version=Conversation.version + 1)
+        .returning(Conversation.last_seq, Conversation.version)
+    )
+    row = result.first()
+    if row is None:
+        raise ValueError(f"Conversation {conversation_id} not found")
+    return row.last_seq - count + 1, row.version
+
+
+async def bump_version(db: AsyncSession, conversation_id: str) -> int:
+    """Bump a conversation's change version (for delta sync) and return the new value."""
+    result = await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(version=Conversation.version + 1)
+        .returning(Conversation.version)
+    )
+    version = result.scalar()
+    if version is None:
+        raise ValueError(f"Conversation {conversation_id} not found")
+    return version
@@ -0,0 +1,50 @@
+from typing import List, Sequence
+
+# Maximal marginal relevance over an over-fetched retrieval candidate set.
+# numpy is imported on first use so it stays off the startup path when the stage is off.
+
+
+def parse_embeddings(texts: Sequence[str]):
+    """Candidate embeddings in pgvector text form ('[0.1,...]') as one float32 matrix."""
+    import numpy as np
+    import orjson
+    return np.asarray(orjson.loads("[" + ",".join(texts) + "]"), dtype=np.float32)
+
+
+def mmr_select(
+    query: Sequence[float],
+    embeddings,
+    k: int,
+    lambda_mult: float,
+    duplicate_threshold: float,
+    min_relevance: float = 0.0
+) -> List[int]:
+    """
+    Indices of up to k candidates, in selection order. Each step picks the candidate
+    maximizing lambda * sim(query) - (1 - lambda) * max sim(already selected). Candidates at
+    least duplicate_threshold similar to a selected one, or less relevant than min_relevance
+    times the best candidate, are never picked, so the set can be smaller than k rather than
+    padded with copies or off-topic chunks.
+    """
+    import numpy as np
+    if len(embeddings) == 0 or k <= 0:
+        return []
+    
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    
+    relevance = vectors @ query
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    available = relevance >= min_relevance * max(float(relevance.max()), 0.0)
+    selected = []
+    while len(selected) < k and available.any():
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        similarity = vectors @ vectors[best]
+        redundancy = np.maximum(redundancy, similarity)
+        available &= similarity < duplicate_threshold
+    return selected
@@ -0,0 +1,251 @@
+import asyncio
+import re
+import time
+from datetime import datetime
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Set
+import httpx
+import ollama
+from config import settings
+
+# Errors meaning the backend could not be reached (nothing was generated), so the request
+# can safely be sent to another one
+CONNECTION_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, ConnectionError)
+
+
+def _loaded_until(expires_at: Optional[str]) -> float:
+    """
+    Monotonic time until which /api/ps says a model stays loaded. Its expires_at is RFC 3339
+    with nanoseconds; without a usable value the configured keep_alive is assumed.
+    """
+    try:
+        # Python parses at most microseconds
+        expires = datetime.fromisoformat(re.sub(r"(\.\d{6})\d+", r"\1", expires_at.replace("Z", "+00:00")))
+        return time.monotonic() + (expires.timestamp() - time.time())
+    except (AttributeError, TypeError, ValueError):
+        return time.monotonic() + settings.ollama_keep_alive_seconds
+
+
+class OllamaBackend:
+    """One Ollama server, with what the pool knows about its models and load."""
+    
+    def __init__(self, url: str, models: Optional[List[str]] = None):
+        self.url = url.rstrip("/")
+        # Connect quickly so a dead box fails over instead of hanging; generation itself is unbounded
+        self.client = ollama.AsyncClient(
+            host=self.url, timeout=httpx.Timeout(None, connect=settings.ollama_connect_timeout)
+        )
+        self.models: Optional[Set[str]] = set(models) if models else None  # Configured; None = whatever is installed
+        self.installed: Optional[Set[str]] = None  # From the last health check; None = not known yet
+        self.loaded: Dict[str, float] = {}  # Model -> monotonic time it is expected to stay loaded until
+        self.outstanding = 0
+        self.served = 0
+        self.healthy = True
+        self.last_error: Optional[str] = None
+    
+    def serves(self, model: str) -> bool:
+        if self.models is not None:
+            return model in self.models
+        return self.installed is None or model in self.installed
+    
+    def is_loaded(self, model: str) -> bool:
+        return self.loaded.get(model, 0.0) > time.monotonic()
+    
+    def expect_loaded(self, model: str):
+        """
+        Note that a request for the model was sent: Ollama loads it (evicting the least
+        recently used one beyond its loaded-model limit) and keeps it for keep_alive.
+        """
+        self.loaded.pop(model, None)
+        self.loaded[model] = time.monotonic() + settings.ollama_keep_alive_seconds
+        while len(self.loaded) > settings.ollama_max_loaded_models:
+            del self.loaded[next(iter(self.loaded))]
+    
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "served": self.served,
+            "models": sorted(self.models if self.models is not None else self.installed or []),
+            "loaded": sorted(model for model in self.loaded if self.is_loaded(model)),
+            "last_error": self.last_error
+        }
+
+
+class OllamaPool:
+    """
+    Route Ollama calls across a pool of servers.
+    A request goes to the healthy backend serving its model with the fewest requests in
+    flight, where a backend that already has the model loaded counts OLLAMA_AFFINITY_WEIGHT
+    fewer (loading a model costs far more than queueing behind a couple of requests).
+    Connection errors mark a backend down and the request moves on to the next one; a
+    periodic health check brings backends back and refreshes their installed and loaded models.
+    """
+    
+    def __init__(self):
+        configured = settings.ollama_backends or [{"url": settings.ollama_base_url}]
+        self.backends = [OllamaBackend(entry["url"], entry.get("models")) for entry in configured]
+        self._task: Optional[asyncio.Task] = None
+    
+    def select(self, model: str, exclude: Set[OllamaBackend] = frozenset()) -> Optional[OllamaBackend]:
+        """Best backend for a model, or None when every candidate has been tried."""
+        candidates = [b for b in self.backends if b not in exclude and b.serves(model)]
+        # With no healthy candidate, try the others anyway rather than fail outright: the
+        # health check may just not have noticed a recovery yet
+        healthy = [b for b in candidates if b.healthy]
+        if not candidates:
+            return None
+        return min(
+            healthy or candidates,
+            key=lambda b: (
+                b.outstanding - (settings.ollama_affinity_weight if b.is_loaded(model) else 0),
+                b.served
+            )
+        )
+    
+    async def call(self, model: str, operation: Callable[[ollama.AsyncClient], Awaitable]):
+        """Run `operation(client)` on the best backend for `model`, failing over on connection errors."""
+        tried: Set[OllamaBackend] = set()
+        error = None
+        while True:
+            backend = self._next(model, tried, error)
+            backend.outstanding += 1
+            try:
+                result = await operation(backend.client)
+            except Exception as e:
+                if not self._should_retry(backend, model, e):
+                    raise
+                error = e
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._mark_served(backend, model)
+            return result
+    
+    async def stream(
+        self,
+        model: str,
+        operation: Callable[[ollama.AsyncClient], Awaitable[AsyncGenerator]]
+    ) -> AsyncGenerator:
+        """
+        Stream `operation(client)` from the best backend for `model`. Failover only happens before
+        the first chunk; an error after that is raised, since part of the reply was already sent.
+        """
+        tried: Set[OllamaBackend] = set()
+        error = None
+        while True:
+            backend = self._next(model, tried, error)
+            backend.outstanding += 1
+            try:
+                # ollama's client only connects once the stream is first read
+                stream = await operation(backend.client)
+                try:
+                    first = await stream.__anext__()
+                except StopAsyncIteration:
+                    self._mark_served(backend, model)
+                    return
+                except Exception as e:
+                    if not self._should_retry(backend, model, e):
+                        raise
+                    error = e
+                    continue
+                self._mark_served(backend, model)
+                try:
+                    yield first
+                    async for chunk in stream:
+                        yield chunk
+                finally:
+                    await stream.aclose()
+                return
+            finally:
+                backend.outstanding -= 1
+    
+    def _next(self, model: str, tried: Set[OllamaBackend], error: Optional[Exception]) -> OllamaBackend:
+        """Next backend to try; once all have failed, the last failure is raised."""
+        backend = self.select(model, tried)
+        if backend is None:
+            raise error or ConnectionError(f"No Ollama backend serves {model}")
+        tried.add(backend)
+        backend.expect_loaded(model)
+        return backend
+    
+    def _should_retry(self, backend: OllamaBackend, model: str, error: Exception) -> bool:
+        """Record a failed attempt; whether another backend should get the request."""
+        if isinstance(error, CONNECTION_ERRORS):
+            backend.healthy = False
+            backend.loaded.clear()
+            backend.last_error = f"{type(error).__name__}: {error}"
+            print(f"Ollama backend {backend.url} unreachable ({backend.last_error}); failing over")
+            return True
+        if isinstance(error, ollama.ResponseError) and error.status_code == 404:
+            # This backend does not have the model after all
+            if backend.installed is not None:
+                backend.installed.discard(model)
+            backend.loaded.pop(model, None)
+            return True
+        return False
+    
+    def _mark_served(self, backend: OllamaBackend, model: str):
+        backend.served += 1
+        backend.healthy = True
+    
+    async def check(self, backend: OllamaBackend):
+        """Health check one backend: its installed models, and its loaded ones where Ollama reports them."""
+        try:
+            async with httpx.AsyncClient(base_url=backend.url, timeout=settings.ollama_connect_timeout) as http:
+                tags = await http.get("/api/tags")
+                tags.raise_for_status()
+                backend.installed = {m["name"] for m in tags.json().get("models", [])}
+                
+                running = await http.get("/api/ps")  # Not available on older Ollama versions
+                if running.status_code == 200:
+                    backend.loaded = {
+                        m["name"]: _loaded_until(m.get("expires_at")) for m in running.json().get("models", [])
+                    }
+            if not backend.healthy:
+                print(f"Ollama backend {backend.url} is back")
+            backend.healthy = True
+            backend.last_error = None
+        except Exception as e:
+            if backend.healthy:
+                print(f"Ollama backend {backend.url} failed its health check: {e}")
+            backend.healthy = False
+            backend.last_error = f"{type(e).__name__}: {e}"
+    
+    async def check_all(self):
+        await asyncio.gather(*(self.check(backend) for backend in self.backends))
+    
+    def available_models(self) -> Set[str]:
+        """Models installed on at least one healthy backend (as of the last health check)."""
+        models = set()
+        for backend in self.backends:
+            if backend.healthy and backend.installed is not None:
+                models |= backend.installed if backend.models is None else backend.installed & backend.models
+        return models
+    
+    def status(self) -> List[dict]:
+        return [backend.status() for backend in self.backends]
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.ollama_health_interval_seconds)
+            await self.check_all()
+    
+    async def start(self):
+        """Run a first health check, then keep checking in the background."""
+        await self.check_all()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance
+ollama_pool = OllamaPool()
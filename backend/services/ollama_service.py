@@ -1,86 +1,279 @@
-import ollama
-from typing import AsyncGenerator, List
-from config import settings, MODEL_CONFIGS, EMBEDDING_MODEL
-import tiktoken
+import asyncio
+import hashlib
+import json
+import os
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+from config import (
+    settings, MODEL_CONFIGS, EMBEDDING_MODEL, TOKENIZER_ENCODING, IMAGE_TOKENS,
+    NUM_PREDICT, NUM_PREDICT_MIN, NUM_CTX_MIN, NUM_CTX_PROMPT_MARGIN
+)
+from services.ollama_pool import ollama_pool
+from services.stream_fanout import StreamFanout
+from services.token_calibration import token_calibration
+
+
+def _request_key(
+    operation: str,
+    model: str,
+    messages: List[dict],
+    temperature: float,
+    max_tokens: Optional[int] = None
+) -> str:
+    """Build the single-flight key for an upstream call."""
+    prompt = json.dumps(messages, sort_keys=True, default=str)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{operation}:{model}:{temperature}:{max_tokens}:{prompt_hash}"
+
+
+class PromptTooLongError(ValueError):
+    """A prompt that does not fit the model's context with room for a reply; never sent."""
 
 
 class OllamaService:
-    """Service for interacting with Ollama API."""
+    """Service for interacting with Ollama API (through the backend pool)."""
     
     def __init__(self):
-        self.base_url = settings.ollama_base_url
-        self.client = ollama.AsyncClient(host=self.base_url)
+        self.pool = ollama_pool
+        # Single-flight registries: identical in-flight requests share one upstream call
+        self._inflight_streams: Dict[str, StreamFanout] = {}
+        self._inflight_calls: Dict[str, asyncio.Task] = {}
+        # Tokenizer, loaded by load_tokenizer() at startup; None until then or if it is unavailable
+        self._encoding = None
+        self._tokenizer_loaded = False
     
     async def chat_stream(
         self,
         model: str,
         messages: List[dict],
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        usage: Optional[dict] = None
     ) -> AsyncGenerator[str, None]:
-        """Stream chat responses from Ollama."""
-        try:
-            stream = await self.client.chat(
-                model=model,
-                messages=messages,
-                stream=True,
-                options={"temperature": temperature}
+        """
+        Stream chat responses from Ollama, sharing identical in-flight streams.
+        If given, `usage` is filled with the call's token usage once the stream ends.
+        Raises when the upstream call fails, after yielding whatever was generated.
+        """
+        key = _request_key("chat_stream", model, messages, temperature)
+        fanout = self._inflight_streams.get(key)
+        if fanout is None:
+            fanout = StreamFanout()
+            self._inflight_streams[key] = fanout
+            fanout.task = asyncio.create_task(
+                self._run_stream(key, fanout, model, messages, temperature)
             )
-            
-            async for chunk in stream:
-                if 'message' in chunk and 'content' in chunk['message']:
-                    yield chunk['message']['content']
+            # Also covers a task cancelled before it ever started running
+            fanout.task.add_done_callback(lambda t: self._stream_finished(key, fanout))
+        
+        fanout.subscribers += 1
+        try:
+            async for chunk in fanout.subscribe():
+                yield chunk
+            # A failed call raises rather than ending like a finished reply
+            if fanout.error is not None:
+                raise fanout.exception or RuntimeError(fanout.error)
+            if usage is not None:
+                usage.update(fanout.usage)
+        finally:
+            fanout.subscribers -= 1
+            # Stop generating once nobody is listening any more; unregister first so a new
+            # identical request starts a fresh stream instead of joining the cancelled one
+            if fanout.subscribers == 0 and not fanout.done:
+                self._unregister_stream(key, fanout)
+                fanout.task.cancel()
+    
+    def _unregister_stream(self, key: str, fanout: StreamFanout):
+        if self._inflight_streams.get(key) is fanout:
+            del self._inflight_streams[key]
+    
+    def _stream_finished(self, key: str, fanout: StreamFanout):
+        """Done callback of a stream task: unregister it and release anyone still waiting."""
+        self._unregister_stream(key, fanout)
+        if not fanout.done:
+            asyncio.get_running_loop().create_task(fanout.close("Generation was cancelled"))
+    
+    async def _run_stream(
+        self,
+        key: str,
+        fanout: StreamFanout,
+        model: str,
+        messages: List[dict],
+        temperature: float
+    ):
+        """Pump the upstream stream into a fan-out and unregister it when finished (or failed)."""
+        error = None
+        try:
+            async for chunk in self._chat_stream_upstream(model, messages, temperature, fanout.usage):
+                await fanout.publish(chunk)
         except Exception as e:
-            yield f"Error: {str(e)}"
+            fanout.exception = e
+            error = str(e)
+        finally:
+            self._unregister_stream(key, fanout)
+            await fanout.close(error)
+    
+    async def _chat_stream_upstream(
+        self,
+        model: str,
+        messages: List[dict],
+        temperature: float,
+        usage: dict
+    ) -> AsyncGenerator[str, None]:
+        """Stream chat responses from Ollama, filling `usage` from the final chunk."""
+        options = self._generation_options(model, messages, temperature)
+        stream = self.pool.stream(model, lambda client: client.chat(
+            model=model,
+            messages=messages,
+            stream=True,
+            options=options
+        ))
+        
+        async for chunk in stream:
+            if 'message' in chunk and 'content' in chunk['message']:
+                yield chunk['message']['content']
+            if chunk.get('done'):
+                usage.update(self._record_usage(model, messages, chunk))
     
     async def chat(
         self,
         model: str,
         messages: List[dict],
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        usage: Optional[dict] = None,
+        max_tokens: Optional[int] = None
     ) -> str:
-        """Get a non-streaming chat response."""
-        try:
-            response = await self.client.chat(
-                model=model,
-                messages=messages,
-                stream=False,
-                options={"temperature": temperature}
+        """
+        Get a non-streaming chat response, sharing identical in-flight calls.
+        If given, `usage` is filled with the call's token usage and `max_tokens` caps the reply
+        below the model's limit. Raises when the call fails.
+        """
+        key = _request_key("chat", model, messages, temperature, max_tokens)
+        task = self._inflight_calls.get(key)
+        if task is None:
+            task = asyncio.create_task(self._chat_upstream(model, messages, temperature, max_tokens))
+            self._inflight_calls[key] = task
+            task.add_done_callback(
+                lambda t: self._inflight_calls.pop(key, None) if self._inflight_calls.get(key) is t else None
             )
-            return response['message']['content']
-        except Exception as e:
-            return f"Error: {str(e)}"
+        # Shield so one caller going away does not cancel the call for the others
+        content, call_usage = await asyncio.shield(task)
+        if usage is not None:
+            usage.update(call_usage)
+        return content
+    
+    async def _chat_upstream(
+        self,
+        model: str,
+        messages: List[dict],
+        temperature: float,
+        max_tokens: Optional[int] = None
+    ) -> Tuple[str, dict]:
+        """Get a non-streaming chat response from Ollama, with its token usage."""
+        options = self._generation_options(model, messages, temperature, max_tokens)
+        response = await self.pool.call(model, lambda client: client.chat(
+            model=model,
+            messages=messages,
+            stream=False,
+            options=options
+        ))
+        return response['message']['content'], self._record_usage(model, messages, response)
+    
+    def reply_limit(self, model: str) -> int:
+        """Most tokens a reply from the model may generate (per-model "num_predict" override)."""
+        return MODEL_CONFIGS.get(model, {}).get("num_predict", NUM_PREDICT)
+    
+    def prompt_limit(self, model: str) -> int:
+        """
+        Largest prompt (estimated tokens) that can be sent to the model: with the estimate's
+        margin and the minimum reply it still fits the fixed num_ctx, or else the window.
+        """
+        config = MODEL_CONFIGS.get(model, {})
+        context = config.get("num_ctx") or config.get('context_window', settings.default_context_window)
+        return max(int((context - NUM_PREDICT_MIN) / NUM_CTX_PROMPT_MARGIN), 0)
+    
+    def prompt_budget(self, model: str) -> int:
+        """Prompt tokens to fill when building a prompt: room for a full-length reply, within prompt_limit."""
+        context_window = MODEL_CONFIGS.get(model, {}).get('context_window', settings.default_context_window)
+        return max(min(context_window - self.reply_limit(model), self.prompt_limit(model)), 0)
+    
+    def _generation_options(
+        self,
+        model: str,
+        messages: List[dict],
+        temperature: float,
+        max_tokens: Optional[int] = None
+    ) -> dict:
+        """
+        Ollama options sized to the request. Without num_ctx Ollama runs every model at its
+        default context size, truncating longer prompts, and without num_predict a reply can
+        run on indefinitely. num_ctx covers the estimated prompt plus the reply cap, rounded up
+        to a power of two so similar requests share one KV cache size (a different num_ctx
+        makes Ollama reload the model), and never exceeds the model's window.
+        Raises PromptTooLongError for a prompt over prompt_limit rather than let Ollama truncate it.
+        """
+        config = MODEL_CONFIGS.get(model, {})
+        context_window = config.get('context_window', settings.default_context_window)
+        estimated = self.count_messages_tokens(messages, model)
+        if estimated > self.prompt_limit(model):
+            raise PromptTooLongError(
+                f"Prompt of about {estimated} tokens does not fit {model} "
+                f"(at most {self.prompt_limit(model)} with room for a reply)"
+            )
+        prompt_tokens = int(estimated * NUM_CTX_PROMPT_MARGIN)
+        
+        # Cap the reply by what the window (or fixed num_ctx) leaves after the prompt
+        num_predict = min(max_tokens or self.reply_limit(model), self.reply_limit(model))
+        num_predict = min(num_predict, (config.get("num_ctx") or context_window) - prompt_tokens)
+        
+        num_ctx = config.get("num_ctx")
+        if num_ctx is None:
+            num_ctx = NUM_CTX_MIN
+            while num_ctx < prompt_tokens + num_predict and num_ctx < context_window:
+                num_ctx *= 2
+            num_ctx = min(num_ctx, context_window)
+        
+        return {"temperature": temperature, "num_ctx": num_ctx, "num_predict": num_predict}
+    
+    def _record_usage(self, model: str, messages: List[dict], response: dict) -> dict:
+        """Token usage from a finished Ollama response, fed into the model's calibration."""
+        estimated = self.count_messages_tokens(messages)
+        usage = {
+            "prompt_tokens": response.get('prompt_eval_count'),
+            "completion_tokens": response.get('eval_count'),
+            "estimated_prompt_tokens": estimated
+        }
+        # Prompts that may have hit Ollama's prefix cache or carry images would skew the factor
+        if token_calibration.samples_prompt(messages):
+            token_calibration.observe(model, estimated, usage["prompt_tokens"])
+        return usage
     
     async def generate_embedding(self, text: str) -> List[float]:
         """Generate embeddings using Ollama."""
         try:
-            response = await self.client.embeddings(
+            response = await self.pool.call(EMBEDDING_MODEL, lambda client: client.embeddings(
                 model=EMBEDDING_MODEL,
                 prompt=text
-            )
+            ))
             return response['embedding']
         except Exception as e:
             print(f"Error generating embedding: {e}")
             return []
     
     async def check_model_availability(self, model: str) -> bool:
-        """Check if a model is available."""
+        """Check if a model is available on a healthy backend (as of the last periodic health check)."""
         try:
-            models = await self.client.list()
-            available_models = [m['name'] for m in models.get('models', [])]
-            return model in available_models
+            return model in self.pool.available_models()
         except Exception as e:
             print(f"Error checking model availability: {e}")
             return False
     
     async def get_available_models(self) -> List[dict]:
-        """Get list of available models with metadata."""
+        """Get list of models available on any healthy backend (as of the last health check), with metadata."""
         try:
-            models = await self.client.list()
+            installed = self.pool.available_models()
             available_models = []
             
-            for model in models.get('models', []):
-                model_name = model['name']
-                if model_name in MODEL_CONFIGS:
+            for model_name in MODEL_CONFIGS:
+                if model_name in installed:
                     available_models.append({
                         "name": model_name,
                         "display_name": MODEL_CONFIGS[model_name]["name"],
@@ -95,22 +288,78 @@ class OllamaService:
             print(f"Error getting available models: {e}")
             return []
     
-    def count_tokens(self, text: str, model: str = "gpt-3.5-turbo") -> int:
-        """Count tokens in text. Using GPT tokenizer as approximation."""
+    def load_tokenizer(self) -> bool:
+        """
+        Load the tiktoken encoding used for token counting (blocking; call once at startup).
+        BPE files are read from TIKTOKEN_CACHE_DIR when set, so hosts without internet access
+        work from a pre-populated directory. Returns whether the tokenizer is available.
+        """
+        if self._tokenizer_loaded:
+            return self._encoding is not None
+        self._tokenizer_loaded = True
+        
+        if settings.tiktoken_cache_dir:
+            os.environ["TIKTOKEN_CACHE_DIR"] = settings.tiktoken_cache_dir
         try:
-            encoding = tiktoken.encoding_for_model(model)
-            return len(encoding.encode(text))
-        except Exception:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            return True
+        except Exception as e:
+            print(
+                f"Warning: tiktoken encoding '{TOKENIZER_ENCODING}' could not be loaded ({e}); "
+                f"token counts fall back to len(text) // 4. Set TIKTOKEN_CACHE_DIR to a directory "
+                f"containing its BPE file."
+            )
+            return False
+    
+    def _raw_token_count(self, text: str) -> int:
+        if not self._tokenizer_loaded:
+            self.load_tokenizer()
+        if self._encoding is None:
             # Fallback: rough estimation
             return len(text) // 4
+        return len(self._encoding.encode(text, disallowed_special=()))
+    
+    def count_tokens(self, text: str, model: Optional[str] = None) -> int:
+        """
+        Count tokens in text. Using GPT tokenizer as approximation, scaled to the model's
+        own tokenizer by its calibration factor when a model is given.
+        """
+        count = self._raw_token_count(text)
+        return token_calibration.calibrate(model, count) if model else count
+    
+    def truncate_tokens(self, text: str, max_tokens: int, model: Optional[str] = None) -> str:
+        """Cut text down to at most max_tokens (calibrated for `model` when given)."""
+        raw_budget = int(max_tokens / token_calibration.factor(model)) if model else max_tokens
+        if raw_budget <= 0:
+            return ""
+        if not self._tokenizer_loaded:
+            self.load_tokenizer()
+        if self._encoding is None:
+            return text[:raw_budget * 4]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        if len(tokens) <= raw_budget:
+            return text
+        return self._encoding.decode(tokens[:raw_budget])
+    
+    def image_tokens(self, model: Optional[str]) -> int:
+        """Prompt tokens one image takes for the model (per-model "image_tokens" override)."""
+        return MODEL_CONFIGS.get(model, {}).get("image_tokens", IMAGE_TOKENS)
     
-    def count_messages_tokens(self, messages: List[dict]) -> int:
-        """Count total tokens in a list of messages."""
+    def count_messages_tokens(self, messages: List[dict], model: Optional[str] = None) -> int:
+        """
+        Count total tokens in a list of messages (text calibrated for `model` when given),
+        including the fixed cost of any images attached to them.
+        """
         total = 0
+        images = 0
         for message in messages:
-            total += self.count_tokens(message.get('content', ''))
+            total += self._raw_token_count(message.get('content', ''))
             total += 4  # Account for message formatting
-        return total
+            images += len(message.get('images') or [])
+        if model:
+            total = token_calibration.calibrate(model, total)
+        return total + images * self.image_tokens(model)
 
 
 # Singleton instance
@@ -1,14 +1,26 @@
+import hashlib
 import io
 import os
 import re
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, text
-from models import Document, DocumentChunk
+from sqlalchemy import select, text, delete, func, bindparam, String
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import async_session_maker
+from models import Document, DocumentChunk, ConversationDocument
 from services.ollama_service import ollama_service
-from config import CHUNK_SIZE, CHUNK_OVERLAP, TOP_K_DOCUMENTS
-from pypdf import PdfReader
-from docx import Document as DocxDocument
+from services import vector_index
+from services.mmr import mmr_select, parse_embeddings
+from config import settings, CHUNK_SIZE, CHUNK_OVERLAP, TOP_K_DOCUMENTS, CHUNKER_VERSION, EMBEDDING_MODEL
+
+
+# Everything a document listing shows; never the extracted text
+DOCUMENT_LIST_COLUMNS = (Document.id, Document.filename, Document.file_type, Document.uploaded_at)
+
+# Attached document ids are rendered into chunk queries as literals (`IN ('a', 'b')`), quoted by
+# SQLAlchemy, rather than sent as a bound array: the planner can only prune document_chunks'
+# hash partitions on constants, while a prepared statement's generic plan probes every partition.
+DOCUMENT_IDS_PARAM = bindparam("document_ids", type_=String, expanding=True, literal_execute=True)
 
 
 class RAGService:
@@ -17,15 +29,33 @@ class RAGService:
     async def process_document(
         self,
         db: AsyncSession,
-        conversation_id: str,
+        conversation_id: Optional[str],
         filename: str,
         file_content: bytes
-    ) -> str:
-        """Process and store a document with embeddings."""
+    ) -> Tuple[str, str]:
+        """
+        Add a document to the library (storing it once) and optionally attach it to a conversation.
+        Returns the library document id and its library filename, which is the name it was
+        first uploaded under when the same bytes were already there.
+        """
         
         # Determine file type
         file_ext = os.path.splitext(filename)[1].lower()
         
+        # The same bytes are only ever ingested once; later uploads just attach them. A lock on
+        # the hash, held until this transaction ends, makes a concurrent upload of the same bytes
+        # wait for this one and then find its document (ix_documents_content_hash is unique too)
+        content_hash = hashlib.sha256(file_content).hexdigest()
+        await db.execute(
+            text("SELECT pg_advisory_xact_lock(hashtextextended(:key, 0))"),
+            {"key": f"document:{content_hash}:{EMBEDDING_MODEL}:{CHUNKER_VERSION}"}
+        )
+        existing = await self._find_ingested_document(db, content_hash)
+        if existing:
+            if conversation_id:
+                await self.attach_document(db, conversation_id, existing.id, filename=filename)
+            return existing.id, existing.filename
+        
         # Extract text based on file type
         if file_ext == '.txt':
             text_content = file_content.decode('utf-8')
@@ -38,10 +68,12 @@ class RAGService:
         
         # Create document record
         document = Document(
-            conversation_id=conversation_id,
             filename=filename,
             file_type=file_ext[1:],  # Remove the dot
-            content=text_content
+            content=text_content,
+            content_hash=content_hash,
+            embedding_model=EMBEDDING_MODEL,
+            chunker_version=CHUNKER_VERSION
         )
         db.add(document)
         await db.flush()  # Get document ID
@@ -61,19 +93,95 @@ class RAGService:
             )
             db.add(chunk)
         
+        if conversation_id:
+            await self.attach_document(db, conversation_id, document.id, filename=filename, commit=False)
+        
         await db.commit()
-        return document.id
+        return document.id, filename
     
-    async def search_relevant_chunks(
+    async def _find_ingested_document(
+        self,
+        db: AsyncSession,
+        content_hash: str
+    ):
+        """Find a library document (id, filename) with the same bytes, embedding model and chunker version."""
+        result = await db.execute(
+            select(Document.id, Document.filename)
+            .where(
+                Document.content_hash == content_hash,
+                Document.embedding_model == EMBEDDING_MODEL,
+                Document.chunker_version == CHUNKER_VERSION
+            )
+            .limit(1)
+        )
+        return result.first()
+    
+    async def attach_document(
+        self,
+        db: AsyncSession,
+        conversation_id: str,
+        document_id: str,
+        filename: Optional[str] = None,
+        commit: bool = True
+    ):
+        """
+        Attach a library document to a conversation (idempotent). `filename` is the name it was
+        uploaded under in this conversation, shown there instead of the library name; attaching
+        again with a new name replaces it.
+        """
+        statement = pg_insert(ConversationDocument).values(
+            conversation_id=conversation_id, document_id=document_id, filename=filename
+        )
+        if filename:
+            statement = statement.on_conflict_do_update(
+                index_elements=[ConversationDocument.conversation_id, ConversationDocument.document_id],
+                set_={"filename": statement.excluded.filename}
+            )
+        else:
+            statement = statement.on_conflict_do_nothing()
+        await db.execute(statement)
+        if commit:
+            await db.commit()
+    
+    async def detach_document(
         self,
         db: AsyncSession,
         conversation_id: str,
+        document_id: str
+    ) -> bool:
+        """Detach a document from a conversation, keeping it in the library."""
+        result = await db.execute(
+            delete(ConversationDocument).where(
+                ConversationDocument.conversation_id == conversation_id,
+                ConversationDocument.document_id == document_id
+            )
+        )
+        await db.commit()
+        return result.rowcount > 0
+    
+    async def search_relevant_chunks(
+        self,
+        conversation_id: str,
         query: str,
         top_k: int = TOP_K_DOCUMENTS
-    ) -> List[str]:
-        """Search for relevant document chunks using semantic similarity."""
+    ) -> List[dict]:
+        """
+        Search for relevant chunks of the documents attached to a conversation.
+        Uses short sessions of its own, none of them open while the query is embedded.
+        Returns [{"text", "similarity"}], most similar first.
+        """
         
         try:
+            # Resolve the attached documents first: nothing to search means no embedding call,
+            # and their chunk count picks exact or index search. The ids go into the queries
+            # as literals (DOCUMENT_IDS_PARAM), so only the attached documents' partitions are
+            # scanned (see benchmarks/partition_pruning.py).
+            async with async_session_maker() as db:
+                document_ids = await self._attached_document_ids(db, conversation_id)
+                if not document_ids:
+                    return []
+                exact = await self._count_chunks(db, document_ids) <= settings.rag_exact_search_max_chunks
+            
             # Generate query embedding
             query_embedding = await ollama_service.generate_embedding(query)
             
@@ -81,39 +189,81 @@ class RAGService:
                 print("Warning: Failed to generate embedding for query")
                 return []
             
-            # Get all documents for this conversation
-            result = await db.execute(
-                select(Document).where(Document.conversation_id == conversation_id)
-            )
-            documents = result.scalars().all()
-            
-            if not documents:
-                print(f"No documents found for conversation {conversation_id}")
-                return []
-            
-            document_ids = [doc.id for doc in documents]
-            print(f"Found {len(documents)} documents for conversation")
+            # Search for similar chunks of the attached documents using pgvector.
+            # With few attached chunks they are all scored exactly. Otherwise the coarse stage
+            # runs on the compact index representation; when that is lossy an over-fetched
+            # candidate set is reranked at full precision. With MMR on, more results are
+            # fetched with their embeddings and diversified in-process.
+            fetch_k = top_k * settings.rag_mmr_candidate_multiplier if settings.rag_mmr_enabled else top_k
+            embedding_column = ", {}embedding::text AS embedding_text" if settings.rag_mmr_enabled else ""
+            candidate_embedding, chunk_embedding = embedding_column.format(""), embedding_column.format("dc.")
+            coarse_distance = vector_index.coarse_distance_sql("dc.embedding", "query_embedding")
+            params = {
+                "query_embedding": str(query_embedding),  # Convert list to string
+                "document_ids": document_ids,
+                "top_k": fetch_k
+            }
+            if exact:
+                # A materialized CTE cannot use the ANN index, so every attached chunk is scored
+                query_sql = text(f"""
+                    WITH attached AS MATERIALIZED (
+                        SELECT dc.chunk_text, dc.embedding
+                        FROM document_chunks dc
+                        WHERE dc.document_id IN :document_ids
+                    )
+                    SELECT chunk_text, 1 - (embedding <=> CAST(:query_embedding AS vector)) as similarity{candidate_embedding}
+                    FROM attached
+                    ORDER BY embedding <=> CAST(:query_embedding AS vector)
+                    LIMIT :top_k
+                """).bindparams(DOCUMENT_IDS_PARAM)
+            elif vector_index.needs_rerank():
+                params["candidates"] = fetch_k * settings.rerank_candidate_multiplier
+                query_sql = text(f"""
+                    WITH candidates AS (
+                        SELECT dc.chunk_text, dc.embedding
+                        FROM document_chunks dc
+                        WHERE dc.document_id IN :document_ids
+                        ORDER BY {coarse_distance}
+                        LIMIT :candidates
+                    )
+                    SELECT chunk_text, 1 - (embedding <=> CAST(:query_embedding AS vector)) as similarity{candidate_embedding}
+                    FROM candidates
+                    ORDER BY embedding <=> CAST(:query_embedding AS vector)
+                    LIMIT :top_k
+                """).bindparams(DOCUMENT_IDS_PARAM)
+            else:
+                query_sql = text(f"""
+                    SELECT dc.chunk_text, 1 - (dc.embedding <=> CAST(:query_embedding AS vector)) as similarity{chunk_embedding}
+                    FROM document_chunks dc
+                    WHERE dc.document_id IN :document_ids
+                    ORDER BY {coarse_distance}
+                    LIMIT :top_k
+                """).bindparams(DOCUMENT_IDS_PARAM)
             
-            # Search for similar chunks using pgvector
-            # Using raw SQL for vector similarity search
-            query_sql = text("""
-                SELECT chunk_text, 1 - (embedding <=> CAST(:query_embedding AS vector)) as similarity
-                FROM document_chunks
-                WHERE document_id = ANY(:document_ids)
-                ORDER BY embedding <=> CAST(:query_embedding AS vector)
-                LIMIT :top_k
-            """)
+            async with async_session_maker() as db:
+                if not exact:
+                    # SET LOCAL lasts until the end of this transaction, so it covers the query below
+                    for statement in vector_index.search_settings_sql(params.get("candidates", fetch_k)):
+                        await db.execute(text(statement))
+                
+                result = await db.execute(query_sql, params)
+                rows = result.fetchall()
             
-            result = await db.execute(
-                query_sql,
-                {
-                    "query_embedding": str(query_embedding),  # Convert list to string
-                    "document_ids": document_ids,
-                    "top_k": top_k
-                }
-            )
+            if settings.rag_mmr_enabled and rows:
+                picked = mmr_select(
+                    query_embedding,
+                    parse_embeddings([row.embedding_text for row in rows]),
+                    top_k,
+                    settings.rag_mmr_lambda,
+                    settings.rag_mmr_duplicate_threshold,
+                    settings.rag_mmr_min_relevance
+                )
+                rows = [rows[i] for i in picked]
             
-            chunks = [row[0] for row in result.fetchall()]
+            chunks = [
+                {"text": row.chunk_text, "similarity": float(row.similarity)}
+                for row in rows
+            ]
             print(f"Found {len(chunks)} relevant chunks")
             return chunks
             
@@ -123,16 +273,52 @@ class RAGService:
             traceback.print_exc()
             return []
     
+    def format_document_context(self, chunks: List[dict]) -> str:
+        """Format retrieved chunks into a context string for the LLM."""
+        if not chunks:
+            return ""
+        
+        context = "### Relevant Documents:\n\n"
+        for i, chunk in enumerate(chunks, 1):
+            context += f"**Document {i}:**\n{chunk['text']}\n\n"
+        context += "---\n\n"
+        return context
+    
+    async def _count_chunks(self, db: AsyncSession, document_ids: List[str]) -> int:
+        """Number of chunks the documents hold (an index-only count on document_id)."""
+        result = await db.execute(
+            select(func.count()).select_from(DocumentChunk)
+            .where(DocumentChunk.document_id.in_(DOCUMENT_IDS_PARAM))
+            .params(document_ids=document_ids)
+        )
+        return result.scalar()
+    
+    async def _attached_document_ids(self, db: AsyncSession, conversation_id: str) -> List[str]:
+        """Ids of the documents attached to a conversation."""
+        result = await db.execute(
+            select(ConversationDocument.document_id)
+            .where(ConversationDocument.conversation_id == conversation_id)
+        )
+        return list(result.scalars().all())
+    
     async def get_conversation_documents(
         self,
         db: AsyncSession,
         conversation_id: str
     ) -> List[dict]:
-        """Get all documents for a conversation."""
+        """Get all documents attached to a conversation."""
         result = await db.execute(
-            select(Document).where(Document.conversation_id == conversation_id)
+            select(
+                Document.id,
+                func.coalesce(ConversationDocument.filename, Document.filename).label("filename"),
+                Document.file_type,
+                Document.uploaded_at
+            )
+            .join(ConversationDocument, ConversationDocument.document_id == Document.id)
+            .where(ConversationDocument.conversation_id == conversation_id)
+            .order_by(ConversationDocument.attached_at)
         )
-        documents = result.scalars().all()
+        documents = result.all()
         
         return [
             {
@@ -144,22 +330,37 @@ class RAGService:
             for doc in documents
         ]
     
+    async def get_library_documents(self, db: AsyncSession) -> List[dict]:
+        """Get every document in the library with its attachment count."""
+        result = await db.execute(
+            select(*DOCUMENT_LIST_COLUMNS, func.count(ConversationDocument.conversation_id).label("attachment_count"))
+            .outerjoin(ConversationDocument, ConversationDocument.document_id == Document.id)
+            .group_by(Document.id)
+            .order_by(Document.uploaded_at.desc())
+        )
+        
+        return [
+            {
+                "id": doc.id,
+                "filename": doc.filename,
+                "file_type": doc.file_type,
+                "uploaded_at": doc.uploaded_at.isoformat(),
+                "attachment_count": doc.attachment_count
+            }
+            for doc in result.all()
+        ]
+    
     async def delete_document(
         self,
         db: AsyncSession,
         document_id: str
     ) -> bool:
-        """Delete a document and its chunks."""
+        """Delete a document from the library; its chunks and attachments go with it through the FK cascade."""
         result = await db.execute(
-            select(Document).where(Document.id == document_id)
+            delete(Document).where(Document.id == document_id)
         )
-        document = result.scalars().first()
-        
-        if document:
-            await db.delete(document)
-            await db.commit()
-            return True
-        return False
+        await db.commit()
+        return result.rowcount > 0
     
 
     def _chunk_text(self, text: str) -> List[str]:
@@ -223,6 +424,8 @@ class RAGService:
     
     async def _extract_pdf_text(self, file_content: bytes) -> str:
         """Extract text from PDF."""
+        from pypdf import PdfReader
+        
         pdf_file = io.BytesIO(file_content)
         pdf_reader = PdfReader(pdf_file)
         
@@ -234,6 +437,8 @@ class RAGService:
     
     async def _extract_docx_text(self, file_content: bytes) -> str:
         """Extract text from DOCX."""
+        from docx import Document as DocxDocument
+        
         docx_file = io.BytesIO(file_content)
         doc = DocxDocument(docx_file)
         
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import update
+from database import async_session_maker
+from models import Message
+from services.stream_fanout import StreamFanout
+from services.message_sequence import bump_version
+from config import settings
+
+
+class _ReplyCheckpointer:
+    """Write-behind persistence of a streaming reply in batched appends."""
+    
+    def __init__(self, message_id: str, conversation_id: str):
+        self.message_id = message_id
+        self.conversation_id = conversation_id
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+    
+    def append(self, chunk: str):
+        self._pending.append(chunk)
+        self._pending_bytes += len(chunk.encode("utf-8"))
+    
+    def due(self) -> bool:
+        """Whether enough time or text has accumulated to checkpoint."""
+        return bool(self._pending) and (
+            self._pending_bytes >= settings.stream_checkpoint_bytes
+            or time.monotonic() - self._last_flush >= settings.stream_checkpoint_interval
+        )
+    
+    def _take(self) -> str:
+        delta = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+        return delta
+    
+    async def flush(self):
+        """
+        Append the buffered text to the message row. The conversation version is left alone
+        (sync clients follow a 'streaming' reply via /stream/{id}; finish() bumps it once).
+        A failed write is logged and its text kept buffered for the next attempt, so a
+        database hiccup never stops generation.
+        """
+        delta = self._take()
+        if not delta:
+            return
+        try:
+            async with async_session_maker() as db:
+                await db.execute(
+                    update(Message)
+                    .where(Message.id == self.message_id, Message.conversation_id == self.conversation_id)
+                    .values(content=Message.content + delta)
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"Error checkpointing reply {self.message_id} (retrying with the next checkpoint): {e}")
+            self._pending.insert(0, delta)
+            self._pending_bytes += len(delta.encode("utf-8"))
+    
+    async def finish(self, status: str, usage: Optional[dict] = None):
+        """
+        Write the remaining text, mark the reply with its final status (and token usage,
+        when known) and bump the conversation.
+        """
+        delta = self._take()
+        async with async_session_maker() as db:
+            # Bumping the version also bumps updated_at
+            version = await bump_version(db, self.conversation_id)
+            await db.execute(
+                update(Message)
+                .where(Message.id == self.message_id, Message.conversation_id == self.conversation_id)
+                .values(content=Message.content + delta, status=status, version=version, **(usage or {}))
+            )
+            await db.commit()
+
+
+class ReplyStreams:
+    """
+    Run assistant reply generation independently of the client connection.
+    Replies are checkpointed to their message row while streaming, and clients can
+    re-subscribe to an in-progress reply on this worker by message id.
+    """
+    
+    def __init__(self):
+        self._active: Dict[str, StreamFanout] = {}
+    
+    def get(self, message_id: str) -> Optional[StreamFanout]:
+        """Get the live stream of a reply generating in this process."""
+        return self._active.get(message_id)
+    
+    def start(
+        self,
+        message_id: str,
+        conversation_id: str,
+        chunks: AsyncIterator[str],
+        on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+        usage: Optional[dict] = None
+    ) -> StreamFanout:
+        """
+        Start generating into an existing 'streaming' message row.
+        `usage` is the dict the chunk source fills with token usage; it is saved with the reply.
+        """
+        fanout = StreamFanout()
+        self._active[message_id] = fanout
+        fanout.task = asyncio.create_task(
+            self._run(message_id, conversation_id, fanout, chunks, on_complete, usage)
+        )
+        return fanout
+    
+    async def fail(self, message_id: str, conversation_id: str):
+        """Mark a reply row that generation never started for as failed."""
+        try:
+            await _ReplyCheckpointer(message_id, conversation_id).finish("error")
+        except Exception as e:
+            print(f"Error marking reply {message_id} as failed: {e}")
+    
+    async def _run(
+        self,
+        message_id: str,
+        conversation_id: str,
+        fanout: StreamFanout,
+        chunks: AsyncIterator[str],
+        on_complete: Optional[Callable[[str], Awaitable[None]]],
+        usage: Optional[dict]
+    ):
+        checkpointer = _ReplyCheckpointer(message_id, conversation_id)
+        status = "complete"
+        error = None
+        try:
+            async for chunk in chunks:
+                await fanout.publish(chunk)
+                checkpointer.append(chunk)
+                if checkpointer.due():
+                    await checkpointer.flush()
+        except asyncio.CancelledError:
+            status = "interrupted"
+            error = "Generation was interrupted"
+            raise
+        except Exception as e:
+            status = "error"
+            error = f"Error: {str(e)}"
+        finally:
+            try:
+                await checkpointer.finish(status, usage)
+                if on_complete and status == "complete":
+                    await on_complete("".join(fanout.chunks))
+            except Exception as e:
+                print(f"Error finalizing reply {message_id}: {e}")
+            finally:
+                self._active.pop(message_id, None)
+                await fanout.close(error)
+
+
+# Singleton instance
+reply_streams = ReplyStreams()
@@ -0,0 +1,119 @@
+import zlib
+from typing import AsyncIterator, Iterable, Optional
+import orjson
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+try:
+    import zstandard
+except ImportError:  # Optional codec
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # Optional codec
+    brotli = None
+
+
+# Server preference when the client accepts several encodings
+_PREFERENCE = ("zstd", "br", "gzip")
+
+
+def _available() -> Iterable[str]:
+    for encoding in _PREFERENCE:
+        if encoding == "zstd" and zstandard is None:
+            continue
+        if encoding == "br" and brotli is None:
+            continue
+        yield encoding
+
+
+def negotiate_encoding(request: Request) -> Optional[str]:
+    """Pick a content encoding from Accept-Encoding, or None for identity."""
+    accepted = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    
+    for encoding in _available():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    """Incremental compressor with one interface over gzip, brotli and zstd."""
+    
+    def __init__(self, encoding: str):
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self._finish = self._compressor.flush
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=4)
+            self._compress = self._compressor.process
+            self._finish = self._compressor.finish
+            return
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+            self._finish = self._compressor.flush
+        self._compress = self._compressor.compress
+    
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+    
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+async def _encode(body: AsyncIterator[bytes], encoding: Optional[str], batch_bytes: int) -> AsyncIterator[bytes]:
+    """Batch small parts into larger writes, compressing them if an encoding was negotiated."""
+    compressor = _Compressor(encoding) if encoding else None
+    buffer = []
+    buffered = 0
+    async for part in body:
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= batch_bytes:
+            data = b"".join(buffer)
+            buffer, buffered = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    
+    data = b"".join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.finish()
+    if data:
+        yield data
+
+
+def json_streaming_response(
+    request: Request,
+    body: AsyncIterator[bytes],
+    headers: Optional[dict] = None,
+    batch_bytes: int = 64 * 1024,
+    media_type: str = "application/json"
+) -> StreamingResponse:
+    """Stream pre-encoded JSON (or NDJSON) parts, compressed per the client's Accept-Encoding."""
+    encoding = negotiate_encoding(request)
+    response_headers = {"Vary": "Accept-Encoding", **(headers or {})}
+    if encoding:
+        response_headers["Content-Encoding"] = encoding
+    return StreamingResponse(
+        _encode(body, encoding, batch_bytes),
+        media_type=media_type,
+        headers=response_headers
+    )
+
+
+def dumps(value) -> bytes:
+    """Fast JSON encoding (datetimes as RFC 3339)."""
+    return orjson.dumps(value)
@@ -0,0 +1,107 @@
+from typing import List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from services import text_search
+from config import TEXT_SEARCH_CONFIG, TEXT_SEARCH_TITLE_WEIGHT, TEXT_SEARCH_CANDIDATES
+
+
+class SearchService:
+    """Ranked full-text search over conversation titles and message history."""
+    
+    async def search(
+        self,
+        db: AsyncSession,
+        query: str,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[List[dict], bool]:
+        """
+        Find conversations by title and messages by content, best match first. Archived
+        conversations match as a whole (their text is not kept for snippets). Only the
+        TEXT_SEARCH_CANDIDATES most recent matches of each source are ranked, so a very
+        common term finds its best matches among recent history.
+        Returns (one page of hits with snippets, whether more hits follow).
+        """
+        # ts_rank_cd reads each match's vector to rank it, so ranking every match would cost
+        # as much as the term is common. Each source first takes its newest matches (for a
+        # common term the planner walks the timestamp index and stops after :candidates
+        # rows; a rare term comes straight from the GIN index), and only those are ranked.
+        # ts_headline re-parses the text, so snippets are only built for the requested page.
+        query_sql = text(f"""
+            WITH q AS (
+                SELECT {text_search.query_sql("query")} AS query
+            ),
+            title_matches AS (
+                SELECT c.id, c.title_search_vector, c.updated_at
+                FROM conversations c, q
+                WHERE c.title_search_vector @@ q.query
+                ORDER BY c.updated_at DESC
+                LIMIT :candidates
+            ),
+            message_matches AS (
+                SELECT m.conversation_id, m.id, m.search_vector, m.timestamp
+                FROM messages m, q
+                WHERE m.search_vector @@ q.query
+                ORDER BY m.timestamp DESC
+                LIMIT :candidates
+            ),
+            archive_matches AS (
+                SELECT a.conversation_id, a.search_vector, c.updated_at
+                FROM message_archives a
+                JOIN conversations c ON c.id = a.conversation_id, q
+                WHERE a.search_vector @@ q.query
+                ORDER BY c.updated_at DESC
+                LIMIT :candidates
+            ),
+            hits AS (
+                SELECT 'title' AS kind, t.id AS conversation_id, NULL AS message_id,
+                       ts_rank_cd(t.title_search_vector, q.query) * :title_weight AS rank,
+                       t.updated_at AS timestamp
+                FROM title_matches t, q
+                UNION ALL
+                SELECT 'message', m.conversation_id, m.id,
+                       ts_rank_cd(m.search_vector, q.query),
+                       m.timestamp
+                FROM message_matches m, q
+                UNION ALL
+                SELECT 'archive', a.conversation_id, NULL,
+                       ts_rank(a.search_vector, q.query),
+                       a.updated_at
+                FROM archive_matches a, q
+            ),
+            page AS (
+                SELECT * FROM hits
+                ORDER BY rank DESC, timestamp DESC
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT page.kind, page.conversation_id, c.title AS conversation_title,
+                   page.message_id, m.seq, m.role, page.rank, page.timestamp,
+                   CASE WHEN page.kind = 'title'
+                        THEN ts_headline('{TEXT_SEARCH_CONFIG}'::regconfig, c.title, q.query, 'HighlightAll=true')
+                        WHEN page.kind = 'archive'
+                        THEN ''
+                        ELSE ts_headline('{TEXT_SEARCH_CONFIG}'::regconfig,
+                                         {text_search.searchable_text_sql("m.content")}, q.query,
+                                         'MaxFragments=2, MinWords=8, MaxWords=30')
+                   END AS snippet
+            FROM page
+            JOIN conversations c ON c.id = page.conversation_id
+            LEFT JOIN messages m ON m.id = page.message_id AND m.conversation_id = page.conversation_id
+            CROSS JOIN q
+            ORDER BY page.rank DESC, page.timestamp DESC
+        """)
+        
+        result = await db.execute(query_sql, {
+            "query": query,
+            "title_weight": TEXT_SEARCH_TITLE_WEIGHT,
+            "candidates": TEXT_SEARCH_CANDIDATES,
+            "limit": limit + 1,
+            "offset": offset
+        })
+        hits = [dict(row._mapping) for row in result.all()]
+        
+        return hits[:limit], len(hits) > limit
+
+
+# Singleton instance
+search_service = SearchService()
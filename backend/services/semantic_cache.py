@@ -0,0 +1,121 @@
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from database import async_session_maker
+from models import ResponseCacheEntry
+from services.ollama_service import ollama_service
+from config import settings
+
+
+class SemanticCache:
+    """Semantic response cache for prompts sent without conversation history."""
+    
+    @property
+    def enabled(self) -> bool:
+        return settings.semantic_cache_enabled
+    
+    async def lookup(
+        self,
+        model: str,
+        prompt: str
+    ) -> Tuple[Optional[str], List[float]]:
+        """
+        Find a cached answer for a semantically similar prompt.
+        Returns (response or None, prompt embedding) so a miss can be stored without re-embedding.
+        The prompt is embedded before a database session is opened for the lookup.
+        """
+        embedding = await ollama_service.generate_embedding(prompt)
+        if not embedding:
+            return None, []
+        
+        async with async_session_maker() as db:
+            try:
+                result = await db.execute(
+                    text("""
+                        SELECT id, response, 1 - (embedding <=> CAST(:embedding AS vector)) AS similarity
+                        FROM response_cache
+                        WHERE model = :model
+                          AND created_at > now() - make_interval(secs => :ttl)
+                        ORDER BY embedding <=> CAST(:embedding AS vector)
+                        LIMIT 1
+                    """),
+                    {
+                        "embedding": str(embedding),
+                        "model": model,
+                        "ttl": settings.semantic_cache_ttl_seconds
+                    }
+                )
+                row = result.first()
+                if not row or row.similarity < settings.semantic_cache_threshold:
+                    return None, embedding
+                
+                await db.execute(
+                    text("""
+                        UPDATE response_cache
+                        SET hit_count = hit_count + 1, last_used_at = now()
+                        WHERE id = :id
+                    """),
+                    {"id": row.id}
+                )
+                await db.commit()
+                return row.response, embedding
+            except Exception as e:
+                print(f"Error in semantic cache lookup: {e}")
+                await db.rollback()
+                return None, embedding
+    
+    async def store(
+        self,
+        db: AsyncSession,
+        model: str,
+        prompt: str,
+        response: str,
+        embedding: List[float]
+    ):
+        """
+        Cache an answer and evict expired / least recently used entries. Only ever called
+        with a reply that finished: failed generations raise instead of returning text.
+        """
+        if not embedding or not response:
+            return
+        
+        try:
+            db.add(ResponseCacheEntry(
+                model=model,
+                prompt=prompt,
+                response=response,
+                embedding=embedding
+            ))
+            await db.flush()
+            await self._evict(db)
+            await db.commit()
+        except Exception as e:
+            print(f"Error storing semantic cache entry: {e}")
+            await db.rollback()
+    
+    async def _evict(self, db: AsyncSession):
+        """Apply TTL expiry, then trim to the configured size by least recent use."""
+        await db.execute(
+            text("DELETE FROM response_cache WHERE created_at <= now() - make_interval(secs => :ttl)"),
+            {"ttl": settings.semantic_cache_ttl_seconds}
+        )
+        await db.execute(
+            text("""
+                DELETE FROM response_cache
+                WHERE id IN (
+                    SELECT id FROM response_cache
+                    ORDER BY last_used_at DESC
+                    OFFSET :max_entries
+                )
+            """),
+            {"max_entries": settings.semantic_cache_max_entries}
+        )
+    
+    def iter_chunks(self, response: str, chunk_size: int = 64) -> Iterator[str]:
+        """Split a cached answer into pieces so it streams like a live response."""
+        for start in range(0, len(response), chunk_size):
+            yield response[start:start + chunk_size]
+
+
+# Singleton instance
+semantic_cache = SemanticCache()
@@ -0,0 +1,41 @@
+import asyncio
+from typing import AsyncGenerator, Dict, List, Optional
+
+
+class StreamFanout:
+    """One upstream token stream replayed to every subscriber that joins while it runs."""
+    
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[str] = None
+        self.exception: Optional[Exception] = None  # What ended the upstream call, when it failed
+        self.subscribers = 0
+        self.usage: Dict[str, int] = {}  # Token usage of the upstream call, once it finished
+        self.task: Optional[asyncio.Task] = None
+        self._cond = asyncio.Condition()
+    
+    async def publish(self, chunk: str):
+        async with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+    
+    async def close(self, error: Optional[str] = None):
+        async with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+    
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """Yield every chunk from the start, then follow the live stream."""
+        position = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: len(self.chunks) > position or self.done)
+                pending = self.chunks[position:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            position += len(pending)
+            if finished and position >= len(self.chunks):
+                return
@@ -0,0 +1,36 @@
+from config import TEXT_SEARCH_CONFIG, TEXT_SEARCH_MAX_CHARS
+
+# Message text is indexed through a stored generated tsvector column. Inline
+# images (markdown image links and any stray base64 data URIs) are removed
+# first so image payloads and hashes never become search terms.
+
+_MARKDOWN_IMAGE = r"!\[[^]]*\]\([^)]*\)"
+_DATA_URI = r"data:[^;,\s]+;base64,[A-Za-z0-9+/=]+"
+
+
+def searchable_text_sql(column: str) -> str:
+    """SQL expression for the part of a message that is indexed and used for snippets."""
+    stripped = f"regexp_replace(regexp_replace({column}, '{_MARKDOWN_IMAGE}', ' ', 'g'), '{_DATA_URI}', ' ', 'g')"
+    return f"left({stripped}, {TEXT_SEARCH_MAX_CHARS})"
+
+
+def message_vector_sql() -> str:
+    """
+    Generated column expression for messages.search_vector. Replies still streaming get
+    NULL: their checkpoint writes would otherwise re-parse the whole growing text each
+    time, and they only become searchable once finished.
+    """
+    return (
+        f"CASE WHEN status = 'streaming' THEN NULL "
+        f"ELSE to_tsvector('{TEXT_SEARCH_CONFIG}'::regconfig, {searchable_text_sql('content')}) END"
+    )
+
+
+def title_vector_sql() -> str:
+    """Generated column expression for conversations.title_search_vector."""
+    return f"to_tsvector('{TEXT_SEARCH_CONFIG}'::regconfig, title)"
+
+
+def query_sql(param: str) -> str:
+    """tsquery for a user search string (web-search syntax: quotes, OR, -exclusion)."""
+    return f"websearch_to_tsquery('{TEXT_SEARCH_CONFIG}'::regconfig, :{param})"
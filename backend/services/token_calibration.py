@@ -0,0 +1,94 @@
+from typing import Dict, List
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, desc
+from models import Message
+from config import TOKEN_CALIBRATION_ALPHA, TOKEN_CALIBRATION_RATIO_RANGE, TOKEN_CALIBRATION_WINDOW
+
+
+class TokenCalibration:
+    """
+    Per-model correction from tiktoken estimates to the prompt token counts Ollama reports.
+    Local models use other vocabularies than the GPT tokenizer, so the raw estimate is
+    scaled by a moving average of actual / estimated.
+    """
+    
+    def __init__(self):
+        self._models: Dict[str, dict] = {}
+    
+    def factor(self, model: str) -> float:
+        stats = self._models.get(model)
+        return stats["factor"] if stats else 1.0
+    
+    def calibrate(self, model: str, estimated: int) -> int:
+        """Scale a raw tokenizer estimate to the model's own token count."""
+        return round(estimated * self.factor(model))
+    
+    def samples_prompt(self, messages: List[dict]) -> bool:
+        """
+        Whether a prompt's evaluated count can be compared with its estimate. Ollama reuses
+        the KV cache for a prompt prefix it evaluated before and reports only the new tokens,
+        so only a lone user message with no images is sampled: a conversation's first turn
+        (or a one-shot prompt), whose text no earlier request shares. Image tokens are
+        invisible to the text tokenizer.
+        """
+        return len(messages) == 1 and messages[0].get("role") == "user" and not messages[0].get("images")
+    
+    def observe(self, model: str, estimated: int, actual: int):
+        """
+        Record one prompt's raw estimate against the count Ollama evaluated. Callers only pass
+        prompts that samples_prompt() accepts.
+        """
+        if not model or estimated <= 0 or not actual or actual <= 0:
+            return
+        # Far-off ratios mean an identical prompt served from the cache (only new tokens
+        # are evaluated) or a truncated prompt, not a tokenizer difference
+        ratio = actual / estimated
+        low, high = TOKEN_CALIBRATION_RATIO_RANGE
+        if not low <= ratio <= high:
+            return
+        
+        # Score the factor that was in effect for this prompt (1.0 before the first sample),
+        # then seed a new model's factor with its first ratio
+        in_effect = self.factor(model)
+        stats = self._models.setdefault(
+            model, {"factor": ratio, "samples": 0, "raw_error": 0.0, "calibrated_error": 0.0}
+        )
+        stats["raw_error"] += abs(estimated - actual) / actual
+        stats["calibrated_error"] += abs(estimated * in_effect - actual) / actual
+        stats["factor"] += TOKEN_CALIBRATION_ALPHA * (ratio - stats["factor"])
+        stats["samples"] += 1
+    
+    async def load(self, db: AsyncSession):
+        """
+        Warm up from the most recent recorded first replies (seq 2, answering the opening
+        message alone), so factors survive restarts.
+        """
+        result = await db.execute(
+            select(Message.model_used, Message.estimated_prompt_tokens, Message.prompt_tokens)
+            .where(Message.prompt_tokens.is_not(None), Message.seq == 2)
+            .order_by(desc(Message.timestamp))
+            .limit(TOKEN_CALIBRATION_WINDOW)
+        )
+        rows = result.all()
+        for row in reversed(rows):
+            self.observe(row.model_used, row.estimated_prompt_tokens or 0, row.prompt_tokens)
+        print(f"Token calibration loaded from {len(rows)} first replies")
+    
+    def metrics(self) -> Dict[str, dict]:
+        """
+        Per model: the current factor, the number of samples, and the mean absolute error of
+        the raw and of the calibrated estimate as a fraction of the actual count.
+        """
+        return {
+            model: {
+                "factor": round(stats["factor"], 4),
+                "samples": stats["samples"],
+                "raw_error": round(stats["raw_error"] / stats["samples"], 4),
+                "calibrated_error": round(stats["calibrated_error"] / stats["samples"], 4)
+            }
+            for model, stats in self._models.items()
+        }
+
+
+# Singleton instance
+token_calibration = TokenCalibration()
@@ -0,0 +1,78 @@
+from typing import List
+from config import settings, EMBEDDING_DIMENSION
+
+INDEX_PREFIX = "ix_document_chunks_embedding_"
+HNSW_EF_SEARCH_DEFAULT = 40  # pgvector's default; also the most rows one index scan returns
+HNSW_EF_SEARCH_MAX = 1000
+
+# The ANN index is built on a compact form of the embedding (an expression
+# index), while the full-precision column stays in the table so coarse
+# candidates can be reranked exactly.
+
+
+def _coarse_expression(column: str) -> str:
+    """SQL expression for the compact form of an embedding column or value."""
+    mode = settings.embedding_storage_mode
+    if mode == "halfvec":
+        return f"({column})::halfvec({EMBEDDING_DIMENSION})"
+    if mode == "binary":
+        return f"binary_quantize({column})::bit({EMBEDDING_DIMENSION})"
+    if mode == "matryoshka":
+        dim = settings.embedding_matryoshka_dimension
+        return f"subvector({column}, 1, {dim})::vector({dim})"
+    return column
+
+
+def _coarse_operator() -> str:
+    """Distance operator matching the compact representation."""
+    return "<~>" if settings.embedding_storage_mode == "binary" else "<=>"
+
+
+def _coarse_opclass() -> str:
+    """Index operator class matching the compact representation."""
+    return {
+        "full": "vector_cosine_ops",
+        "halfvec": "halfvec_cosine_ops",
+        "binary": "bit_hamming_ops",
+        "matryoshka": "vector_cosine_ops",
+    }[settings.embedding_storage_mode]
+
+
+def coarse_distance_sql(column: str, query_param: str) -> str:
+    """Distance between a stored embedding and a query parameter in the configured compact space."""
+    query = _coarse_expression(f"CAST(:{query_param} AS vector)")
+    return f"{_coarse_expression(column)} {_coarse_operator()} {query}"
+
+
+def index_name() -> str:
+    """Name of the document chunk ANN index for the configured storage mode."""
+    mode = settings.embedding_storage_mode
+    if mode == "matryoshka":
+        return f"{INDEX_PREFIX}matryoshka_{settings.embedding_matryoshka_dimension}"
+    return f"{INDEX_PREFIX}{mode}"
+
+
+def index_ddl() -> str:
+    """DDL for the HNSW expression index used by the coarse search stage."""
+    return (
+        f"CREATE INDEX IF NOT EXISTS {index_name()} ON document_chunks "
+        f"USING hnsw (({_coarse_expression('embedding')}) {_coarse_opclass()})"
+    )
+
+
+def search_settings_sql(limit: int) -> List[str]:
+    """
+    SET LOCAL statements for an index scan that has to yield `limit` rows. An HNSW scan
+    returns at most hnsw.ef_search rows before the document filter is applied, so it is
+    raised to the limit; iterative scans (pgvector 0.8+) keep scanning while the filter
+    discards rows.
+    """
+    statements = [f"SET LOCAL hnsw.ef_search = {min(max(limit, HNSW_EF_SEARCH_DEFAULT), HNSW_EF_SEARCH_MAX)}"]
+    if settings.hnsw_iterative_scan:
+        statements.append("SET LOCAL hnsw.iterative_scan = strict_order")
+    return statements
+
+
+def needs_rerank() -> bool:
+    """Whether coarse results must be reranked at full precision."""
+    return settings.embedding_storage_mode != "full"
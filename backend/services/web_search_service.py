@@ -1,20 +1,25 @@
-from tavily import TavilyClient
 from config import settings
 from typing import List, Dict
 import asyncio
-import aiohttp
 
 
 class WebSearchService:
     """Service for web search using Tavily API."""
     
     def __init__(self):
-        self.client = None
-        if settings.tavily_api_key:
-            self.client = TavilyClient(api_key=settings.tavily_api_key)
+        self._client = None
+    
+    @property
+    def client(self):
+        """Tavily client, created (and tavily imported) on first use."""
+        if self._client is None and settings.tavily_api_key:
+            from tavily import TavilyClient
+            self._client = TavilyClient(api_key=settings.tavily_api_key)
+        return self._client
     
     async def check_internet_connection(self) -> bool:
         """Check if internet connection is available."""
+        import aiohttp
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get('https://www.google.com', timeout=aiohttp.ClientTimeout(total=3)) as response:
@@ -0,0 +1,192 @@
+"""
+Routing of the Ollama backend pool (services/ollama_pool.py) against fake Ollama servers
+on local ports. Each test drives its own event loop with asyncio.run.
+"""
+import asyncio
+import json
+import socket
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiohttp import web
+
+from config import settings
+from services.ollama_pool import OllamaPool
+
+MODEL = "llama3.2:latest"
+
+
+class FakeOllama:
+    """The parts of the Ollama API the pool uses: /api/tags, /api/ps and streaming /api/chat."""
+    
+    def __init__(self, loaded=None, hold=False, drop_after_first=False):
+        self.loaded = loaded or {}  # Model -> expires_at reported by /api/ps
+        self.hold = hold  # Keep streams open until release is set
+        self.drop_after_first = drop_after_first  # Close the connection after the first chunk
+        self.requests = 0
+        self.release = asyncio.Event()
+        self._runner = None
+        self.url = None
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/tags", self.tags)
+        app.router.add_get("/api/ps", self.ps)
+        app.router.add_post("/api/chat", self.chat)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.url = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+        return self
+    
+    async def stop(self):
+        self.release.set()
+        await self._runner.cleanup()
+    
+    async def tags(self, request):
+        return web.json_response({"models": [{"name": MODEL}]})
+    
+    async def ps(self, request):
+        return web.json_response({
+            "models": [{"name": name, "expires_at": expires_at} for name, expires_at in self.loaded.items()]
+        })
+    
+    async def chat(self, request):
+        body = await request.json()
+        self.requests += 1
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        chunk = {"model": body["model"], "message": {"role": "assistant", "content": "ok"}, "done": False}
+        await response.write((json.dumps(chunk) + "\n").encode())
+        if self.drop_after_first:
+            request.transport.close()
+            return response
+        if self.hold:
+            await self.release.wait()
+        final = {"model": body["model"], "message": {"role": "assistant", "content": ""}, "done": True}
+        await response.write((json.dumps(final) + "\n").encode())
+        return response
+
+
+def _expires_at(seconds: float) -> str:
+    """An /api/ps expires_at, with Ollama's nanosecond precision."""
+    moment = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%f") + "123Z"
+
+
+def _closed_port_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def _chat(pool: OllamaPool):
+    return pool.stream(MODEL, lambda client: client.chat(
+        model=MODEL, messages=[{"role": "user", "content": "hi"}], stream=True
+    ))
+
+
+async def _drain(stream) -> str:
+    return "".join([chunk["message"]["content"] async for chunk in stream])
+
+
+@pytest.fixture
+def pool_settings(monkeypatch):
+    """Point the pool at the given backend urls; returns a factory for a checked pool."""
+    monkeypatch.setattr(settings, "ollama_connect_timeout", 1.0)
+    monkeypatch.setattr(settings, "ollama_affinity_weight", 2)
+    
+    async def make_pool(*urls) -> OllamaPool:
+        monkeypatch.setattr(settings, "ollama_backends", [{"url": url} for url in urls])
+        pool = OllamaPool()
+        await pool.check_all()
+        return pool
+    
+    return make_pool
+
+
+def test_least_outstanding_wins_over_served_count(pool_settings):
+    async def run():
+        # Both have the model loaded, so affinity does not tip the balance
+        loaded = {MODEL: _expires_at(600)}
+        busy, idle = await FakeOllama(loaded, hold=True).start(), await FakeOllama(loaded).start()
+        try:
+            pool = await pool_settings(busy.url, idle.url)
+            
+            # Ties go to the first backend; keep that stream open
+            held = _chat(pool)
+            assert (await held.__anext__())["message"]["content"] == "ok"
+            
+            # Every later request goes to the idle backend, even once it has served more
+            for _ in range(3):
+                assert await _drain(_chat(pool)) == "ok"
+            assert (busy.requests, idle.requests) == (1, 3)
+            
+            busy.release.set()
+            await _drain(held)
+            assert [b.outstanding for b in pool.backends] == [0, 0]
+        finally:
+            await busy.stop()
+            await idle.stop()
+    
+    asyncio.run(run())
+
+
+def test_affinity_follows_expires_at(pool_settings):
+    async def run():
+        cold = await FakeOllama().start()
+        warm = await FakeOllama(loaded={MODEL: _expires_at(600)}).start()
+        expired = await FakeOllama(loaded={MODEL: _expires_at(-600)}).start()
+        try:
+            # The backend with the model loaded wins although it is listed last
+            pool = await pool_settings(cold.url, warm.url)
+            assert pool.select(MODEL) is pool.backends[1]
+            await _drain(_chat(pool))
+            assert (cold.requests, warm.requests) == (0, 1)
+            
+            # A model whose expires_at has passed is no longer loaded
+            pool = await pool_settings(cold.url, expired.url)
+            assert not pool.backends[1].is_loaded(MODEL)
+            await _drain(_chat(pool))
+            assert (cold.requests, expired.requests) == (1, 0)
+        finally:
+            for server in (cold, warm, expired):
+                await server.stop()
+    
+    asyncio.run(run())
+
+
+def test_failover_before_first_chunk(pool_settings):
+    async def run():
+        live = await FakeOllama().start()
+        try:
+            pool = await pool_settings(_closed_port_url(), live.url)
+            # The health check already saw the dead one; make the pool try it anyway
+            pool.backends[0].healthy = True
+            
+            assert await _drain(_chat(pool)) == "ok"
+            assert live.requests == 1
+            assert not pool.backends[0].healthy
+            assert pool.backends[0].last_error
+        finally:
+            await live.stop()
+    
+    asyncio.run(run())
+
+
+def test_no_failover_after_first_chunk(pool_settings):
+    async def run():
+        dropping, spare = await FakeOllama(drop_after_first=True).start(), await FakeOllama().start()
+        try:
+            pool = await pool_settings(dropping.url, spare.url)
+            
+            # Part of the reply was already sent, so the error surfaces instead of a second attempt
+            with pytest.raises(Exception):
+                await _drain(_chat(pool))
+            assert (dropping.requests, spare.requests) == (1, 0)
+        finally:
+            await dropping.stop()
+            await spare.stop()
+    
+    asyncio.run(run())
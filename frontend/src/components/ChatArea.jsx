@@ -1,11 +1,11 @@
 import { useState, useEffect, useRef } from 'react';
 import { Bot, User, Edit2, Check, X, Copy } from 'lucide-react';
-import ReactMarkdown from 'react-markdown';
+import ReactMarkdown, { defaultUrlTransform } from 'react-markdown';
 import { Prism as SyntaxHighlighter } from 'react-syntax-highlighter';
 import { vscDarkPlus } from 'react-syntax-highlighter/dist/esm/styles/prism';
 import ModelSelector from './ModelSelector';
 import InputArea from './InputArea';
-import { getConversation, streamChat, updateConversation, autoNameConversation } from '../services/api';
+import { getConversation, syncConversation, streamChat, updateConversation, autoNameConversation, resolveImageUrl } from '../services/api';
 import './ChatArea.css';
 
 const CodeBlock = ({ language, children, ...props }) => {
@@ -51,6 +51,7 @@ function ChatArea({ conversation, models, selectedModel, onModelChange, onUpdate
     const [useRag, setUseRag] = useState(false);
     const [useWebSearch, setUseWebSearch] = useState(false);
     const isStreamingRef = useRef(false);
+    const versionRef = useRef(0);
 
     useEffect(() => {
         activeConversationIdRef.current = conversation?.id;
@@ -71,12 +72,30 @@ function ChatArea({ conversation, models, selectedModel, onModelChange, onUpdate
     const loadConversation = async () => {
         try {
             const data = await getConversation(conversation.id);
+            versionRef.current = data.version;
             setMessages(data.messages || []);
         } catch (error) {
             console.error('Error loading conversation:', error);
         }
     };
 
+    // Fetch only the messages added or changed since the last load/sync
+    const syncMessages = async () => {
+        try {
+            const data = await syncConversation(conversation.id, versionRef.current);
+            if (!data) return;
+            versionRef.current = data.version;
+            setMessages(prev => {
+                const byId = new Map(prev.filter(m => !String(m.id).startsWith('temp-')).map(m => [m.id, m]));
+                data.messages.forEach(m => byId.set(m.id, m));
+                return [...byId.values()].sort((a, b) => a.seq - b.seq);
+            });
+        } catch (error) {
+            console.error('Error syncing conversation:', error);
+            await loadConversation();
+        }
+    };
+
     const handleTitleSave = async () => {
         if (titleInput.trim() !== conversation.title) {
             try {
@@ -173,8 +192,8 @@ function ChatArea({ conversation, models, selectedModel, onModelChange, onUpdate
                     setStreamingMessage('');
                     isStreamingRef.current = false;
 
-                    // Reload conversation to get the new messages (and replace optimistic one)
-                    loadConversation().then(() => {
+                    // Sync the new messages (and replace the optimistic one)
+                    syncMessages().then(() => {
                         // Check if we should auto-name (if it was the first message)
                         if (conversation.title === 'New Chat' && messages.length === 0) {
                             // Note: messages.length checks the state captured in closure, which is empty initially.
@@ -182,7 +201,7 @@ function ChatArea({ conversation, models, selectedModel, onModelChange, onUpdate
                             // but checking title 'New Chat' is the main valid condition.
                             autoNameConversation(conversation.id).then(() => {
                                 onUpdateConversations();
-                                loadConversation();  // Refresh title
+                                syncMessages();  // Refresh title
                             });
                         }
                     });
@@ -307,6 +326,7 @@ function ChatArea({ conversation, models, selectedModel, onModelChange, onUpdate
                                     </div>
                                     <div className="message-text">
                                         <ReactMarkdown
+                                            urlTransform={(url) => defaultUrlTransform(resolveImageUrl(url))}
                                             components={{
                                                 code({ node, inline, className, children, ...props }) {
                                                     const match = /language-(\w+)/.exec(className || '');
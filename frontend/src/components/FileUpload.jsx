@@ -1,6 +1,6 @@
 import { useState } from 'react';
 import { Upload, FileText, X, Loader } from 'lucide-react';
-import { uploadDocument, getDocuments, deleteDocument } from '../services/api';
+import { uploadDocument, getDocuments, detachDocument } from '../services/api';
 import './FileUpload.css';
 
 function FileUpload({ conversationId, compact }) {
@@ -46,10 +46,10 @@ function FileUpload({ conversationId, compact }) {
     };
 
     const handleDelete = async (documentId) => {
-        if (!window.confirm('Delete this document?')) return;
+        if (!window.confirm('Remove this document from the chat?')) return;
 
         try {
-            await deleteDocument(documentId);
+            await detachDocument(conversationId, documentId);
             setDocuments(documents.filter(d => d.id !== documentId));
         } catch (error) {
             console.error('Error deleting document:', error);
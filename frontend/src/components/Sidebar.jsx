@@ -1,11 +1,46 @@
-import { useState } from 'react';
-import { MessageSquarePlus, Trash2, MessageSquare, Menu, X, Edit2, Check } from 'lucide-react';
-import { deleteConversation, updateConversation } from '../services/api';
+import { useState, useEffect } from 'react';
+import { MessageSquarePlus, Trash2, MessageSquare, Menu, X, Edit2, Check, Search } from 'lucide-react';
+import { deleteConversation, updateConversation, searchConversations } from '../services/api';
 import './Sidebar.css';
 
 function Sidebar({ conversations, currentConversation, onNewChat, onSelectConversation, onDeleteConversation, isCollapsed, onToggle, onUpdateConversations }) {
     const [editingId, setEditingId] = useState(null);
     const [editTitle, setEditTitle] = useState('');
+    const [searchQuery, setSearchQuery] = useState('');
+    const [searchResults, setSearchResults] = useState(null);
+
+    // Search as the user types, once they pause
+    useEffect(() => {
+        const query = searchQuery.trim();
+        if (!query) {
+            setSearchResults(null);
+            return;
+        }
+        let cancelled = false;
+        const timer = setTimeout(async () => {
+            try {
+                const data = await searchConversations(query);
+                if (!cancelled) setSearchResults(data.results);
+            } catch (error) {
+                console.error('Error searching conversations:', error);
+            }
+        }, 250);
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [searchQuery]);
+
+    const handleSelectResult = (result) => {
+        const conversation = conversations.find(c => c.id === result.conversation_id)
+            || { id: result.conversation_id, title: result.conversation_title };
+        onSelectConversation(conversation);
+    };
+
+    // Snippets come back with matches wrapped in <b></b>; render those as highlights, never as HTML
+    const renderSnippet = (snippet) => snippet.split(/(<b>.*?<\/b>)/g).map((part, i) =>
+        part.startsWith('<b>') ? <mark key={i}>{part.slice(3, -4)}</mark> : part
+    );
 
     const handleDelete = async (e, conversationId) => {
         e.stopPropagation();
@@ -86,8 +121,42 @@ function Sidebar({ conversations, currentConversation, onNewChat, onSelectConver
                 </button>
             )}
 
+            {!isCollapsed && (
+                <div className="sidebar-search">
+                    <Search size={16} />
+                    <input
+                        type="text"
+                        placeholder="Search chats"
+                        value={searchQuery}
+                        onChange={(e) => setSearchQuery(e.target.value)}
+                        onKeyDown={(e) => e.key === 'Escape' && setSearchQuery('')}
+                    />
+                </div>
+            )}
+
             <div className="conversations-list">
-                {conversations.length === 0 ? (
+                {searchResults !== null ? (
+                    searchResults.length === 0 ? (
+                        <div className="empty-state">
+                            <Search size={48} opacity={0.3} />
+                            <p>No matches</p>
+                        </div>
+                    ) : (
+                        searchResults.map((result) => (
+                            <div
+                                key={`${result.kind}-${result.message_id || result.conversation_id}`}
+                                className={`conversation-item glass-hover ${currentConversation?.id === result.conversation_id ? 'active' : ''}`}
+                                onClick={() => handleSelectResult(result)}
+                            >
+                                <div className="conversation-content">
+                                    <div className="conversation-title">{result.conversation_title}</div>
+                                    <div className="search-snippet">{renderSnippet(result.snippet)}</div>
+                                    <div className="conversation-date">{formatDate(result.timestamp)}</div>
+                                </div>
+                            </div>
+                        ))
+                    )
+                ) : conversations.length === 0 ? (
                     <div className="empty-state">
                         <MessageSquare size={48} opacity={0.3} />
                         <p>No conversations yet</p>
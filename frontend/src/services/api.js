@@ -25,6 +25,27 @@ export const getConversation = async (conversationId) => {
     return response.data;
 };
 
+// Changes since `version` (from getConversation or a previous sync); null when nothing changed
+const syncEtags = {};
+export const syncConversation = async (conversationId, version) => {
+    const response = await api.get(`/conversations/${conversationId}/sync`, {
+        params: { since_version: version },
+        headers: syncEtags[conversationId] ? { 'If-None-Match': syncEtags[conversationId] } : {},
+        validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+    });
+    if (response.status === 304) return null;
+    if (response.headers.etag) syncEtags[conversationId] = response.headers.etag;
+    return response.data;
+};
+
+// Full-text search over titles and messages; snippets mark matches with <b></b>
+export const searchConversations = async (query, limit = 20, offset = 0) => {
+    const response = await api.get('/conversations/search', {
+        params: { q: query, limit, offset },
+    });
+    return response.data;
+};
+
 export const autoNameConversation = async (conversationId) => {
     const response = await api.post(`/conversations/${conversationId}/auto_name`);
     return response.data;
@@ -41,7 +62,40 @@ export const deleteConversation = async (conversationId) => {
 };
 
 // Chat
-export const streamChat = (conversationId, message, model, useRag, useWebSearch, onChunk, onError, onComplete) => {
+const readEventStream = async (response, onChunk, onError, onComplete, onMetadata) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        const chunk = decoder.decode(value);
+        const lines = chunk.split('\n');
+
+        for (const line of lines) {
+            if (line.startsWith('data: ')) {
+                try {
+                    const data = JSON.parse(line.slice(6));
+
+                    if (data.type === 'metadata') {
+                        if (onMetadata) onMetadata(data.data);
+                    } else if (data.type === 'chunk') {
+                        onChunk(data.content);
+                    } else if (data.type === 'error') {
+                        onError(data.content);
+                    } else if (data.type === 'done') {
+                        onComplete();
+                    }
+                } catch (e) {
+                    console.error('Error parsing SSE data:', e);
+                }
+            }
+        }
+    }
+};
+
+export const streamChat = (conversationId, message, model, useRag, useWebSearch, onChunk, onError, onComplete, onMetadata) => {
 
 
     // Note: We'll use POST request with fetch for streaming instead
@@ -57,38 +111,22 @@ export const streamChat = (conversationId, message, model, useRag, useWebSearch,
             use_rag: useRag,
             use_web_search: useWebSearch,
         }),
-    }).then(async (response) => {
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n');
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    try {
-                        const data = JSON.parse(line.slice(6));
-
-                        if (data.type === 'metadata') {
-                            // Handle metadata if needed
-                        } else if (data.type === 'chunk') {
-                            onChunk(data.content);
-                        } else if (data.type === 'error') {
-                            onError(data.content);
-                        } else if (data.type === 'done') {
-                            onComplete();
-                        }
-                    } catch (e) {
-                        console.error('Error parsing SSE data:', e);
-                    }
-                }
-            }
-        }
-    }).catch(onError);
+    }).then((response) => readEventStream(response, onChunk, onError, onComplete, onMetadata)).catch(onError);
+};
+
+// Reconnect to an assistant reply (metadata.assistant_message_id), skipping `offset` characters already received
+export const resumeChat = (messageId, offset, onChunk, onError, onComplete) => {
+    fetch(`${API_BASE_URL}/chat/stream/${messageId}?offset=${offset}`)
+        .then((response) => readEventStream(response, onChunk, onError, onComplete))
+        .catch(onError);
+};
+
+// Images are stored out of line and referenced as /api/images/<hash>
+export const resolveImageUrl = (url) => {
+    if (url.startsWith('/api/images/')) {
+        return API_BASE_URL.replace(/\/api$/, '') + url;
+    }
+    return url;
 };
 
 // Models
@@ -115,6 +153,21 @@ export const getDocuments = async (conversationId) => {
     return response.data;
 };
 
+export const getLibraryDocuments = async () => {
+    const response = await api.get('/documents/library');
+    return response.data;
+};
+
+export const attachDocument = async (conversationId, documentId) => {
+    const response = await api.post(`/documents/${documentId}/attach?conversation_id=${conversationId}`);
+    return response.data;
+};
+
+export const detachDocument = async (conversationId, documentId) => {
+    const response = await api.delete(`/documents/${documentId}/attach?conversation_id=${conversationId}`);
+    return response.data;
+};
+
 export const deleteDocument = async (documentId) => {
     const response = await api.delete(`/documents/${documentId}`);
     return response.data;